@@ -1,19 +1,44 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_, extract
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
-import pandas as pd
+from sqlalchemy import func, and_, or_, extract, case, literal
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Iterator
+import heapq
 import database
 import models
+import rollup
+import energy_stats
+import purge
+from config import HOUSE_AREA_CONFIG
 
+# 默认面积区间及名称（左闭右开，最后一个区间无上限）
+DEFAULT_AREA_EDGES = [0.0, 50.0, 100.0, 150.0]
+DEFAULT_AREA_NAMES = ("小户型(≤50㎡)", "中户型(50-100㎡)", "大户型(100-150㎡)", "超大户型(>150㎡)")
 
 
 class SmartHomeAnalytics:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, use_rollup: Optional[bool] = None, snapshot=None):
         self.db = db
+        # 按小时分组的统计优先读小时汇总表（默认跟随 ROLLUP_CONFIG）
+        self.usage = rollup.usage_measures(use_rollup)
+        # 传入 snapshot.DataSnapshot 时，分析改在内存快照上计算，不再查询数据库
+        self.snapshot = snapshot
+        self._hidden = None
+
+    def _visible(self, user_id=None, device_id=None) -> list:
+        """排除正在删除的用户和设备的条件，每个分析实例只查询一次未完成的删除任务"""
+        if self._hidden is None:
+            self._hidden = purge.hidden_ids(self.db)
+        return purge.visible_filters(self._hidden, user_id, device_id)
     
-    def analyze_device_usage_frequency(self) -> List[models.DeviceUsageAnalysis]:
-        """分析不同设备的使用频率和使用时间段"""
+    def analyze_device_usage_frequency(self, vectorized: bool = True) -> List[models.DeviceUsageAnalysis]:
+        """分析不同设备的使用频率和使用时间段
+
+        vectorized=True 时只发一次分组查询，由 pandas 一次性算出所有设备的统计和高峰时段；
+        vectorized=False 保留逐设备查询高峰时段的旧路径。
+        """
+        if vectorized:
+            return self._analyze_device_usage_vectorized()
+
         # 查询设备使用数据
         query = self.db.query(
             database.Device.device_name,
@@ -25,6 +50,8 @@ class SmartHomeAnalytics:
             database.UsageRecord, database.Device.device_id == database.UsageRecord.device_id
         ).join(
             database.DeviceType, database.Device.device_type_id == database.DeviceType.type_id
+        ).filter(
+            *self._visible(database.Device.user_id, database.Device.device_id)
         ).group_by(
             database.Device.device_id, database.Device.device_name, database.DeviceType.type_name
         ).all()
@@ -45,7 +72,72 @@ class SmartHomeAnalytics:
             results.append(analysis)
         
         return results
-    
+
+    def _analyze_device_usage_vectorized(self) -> List[models.DeviceUsageAnalysis]:
+        """按 (设备, 小时) 分组取回一次数据，向量化计算频次、总时长、平均时长和前3高峰时段"""
+        # pandas 只在这里用到，按需导入，不拖慢只处理 CRUD 的 API worker 启动
+        import pandas as pd
+        if self.snapshot is not None:
+            df = self.snapshot.device_hour_usage()
+        else:
+            usage = self.usage
+            rows = self.db.query(
+                database.Device.device_id,
+                database.Device.device_name,
+                database.DeviceType.type_name,
+                usage.hour.label('hour'),
+                usage.usage_count.label('usage_count'),
+                usage.timed_count.label('timed_count'),
+                usage.total_minutes.label('total_minutes')
+            ).join(
+                usage.entity, database.Device.device_id == usage.device_id
+            ).join(
+                database.DeviceType, database.Device.device_type_id == database.DeviceType.type_id
+            ).filter(
+                *self._visible(database.Device.user_id, database.Device.device_id)
+            ).group_by(
+                database.Device.device_id, database.Device.device_name, database.DeviceType.type_name, usage.hour
+            ).all()
+            df = pd.DataFrame(rows, columns=['device_id', 'device_name', 'type_name', 'hour',
+                                             'usage_count', 'timed_count', 'total_minutes'])
+
+        if df.empty:
+            return []
+
+        df['hour'] = df['hour'].astype(int)
+        df['total_minutes'] = df['total_minutes'].fillna(0).astype(float)
+
+        # 每个设备的汇总统计
+        summary = df.groupby('device_id', sort=True).agg(
+            device_name=('device_name', 'first'),
+            type_name=('type_name', 'first'),
+            usage_frequency=('usage_count', 'sum'),
+            timed_count=('timed_count', 'sum'),
+            total_minutes=('total_minutes', 'sum')
+        )
+        summary['avg_duration'] = (summary['total_minutes'] / summary['timed_count']).where(
+            summary['timed_count'] > 0, 0.0
+        )
+
+        # 每个设备使用次数最多的3个小时（次数相同时取较早的小时）
+        peaks = df.sort_values(
+            ['device_id', 'usage_count', 'hour'], ascending=[True, False, True]
+        ).groupby('device_id', sort=False).head(3)
+        peak_hours = peaks.groupby('device_id', sort=False)['hour'].agg(list)
+
+        results = []
+        for device_id, row in summary.iterrows():
+            results.append(models.DeviceUsageAnalysis(
+                device_name=row.device_name,
+                device_type=row.type_name,
+                total_usage_hours=round(row.total_minutes / 60, 2),
+                usage_frequency=int(row.usage_frequency),
+                avg_session_duration=round(float(row.avg_duration), 2),
+                peak_usage_hours=[int(h) for h in peak_hours.get(device_id, [])]
+            ))
+
+        return results
+
     def _get_peak_usage_hours(self, device_name: str) -> List[int]:
         """获取设备的高峰使用时间段"""
         query = self.db.query(
@@ -54,7 +146,8 @@ class SmartHomeAnalytics:
         ).join(
             database.Device, database.UsageRecord.device_id == database.Device.device_id
         ).filter(
-            database.Device.device_name == device_name
+            database.Device.device_name == device_name,
+            *self._visible(database.Device.user_id, database.Device.device_id)
         ).group_by(
             extract('hour', database.UsageRecord.start_time)
         ).order_by(
@@ -63,41 +156,173 @@ class SmartHomeAnalytics:
         
         return [int(row.hour) for row in query if row.hour is not None]
     
-    def analyze_user_habits(self) -> List[models.UserHabitAnalysis]:
+    def analyze_user_habits(self, user_ids: Optional[List[int]] = None, skip: int = 0,
+                            limit: Optional[int] = None, concurrent_since: Optional[datetime] = None,
+                            chunk_size: int = 500) -> List[models.UserHabitAnalysis]:
         """找出用户的使用习惯（如哪些设备经常同时使用）"""
-        users = self.db.query(database.User).all()
         results = []
-        
-        for user in users:
-            # 分析用户的设备使用习惯
-            user_records = self.db.query(database.UsageRecord).filter(
-                database.UsageRecord.user_id == user.user_id
-            ).all()
-            
-            # 找出经常同时使用的设备
-            frequently_used_together = self._find_concurrent_device_usage(user.user_id)
-            
-            # 找出用户的活跃时间段
-            peak_hours = self._get_user_peak_hours(user.user_id)
+        for chunk in self.iter_user_habits(user_ids=user_ids, skip=skip, limit=limit,
+                                           concurrent_since=concurrent_since, chunk_size=chunk_size):
+            results.extend(chunk)
+        return results
+    
+    def iter_user_habits(self, user_ids: Optional[List[int]] = None, skip: int = 0,
+                         limit: Optional[int] = None, concurrent_since: Optional[datetime] = None,
+                         chunk_size: int = 500) -> Iterator[List[models.UserHabitAnalysis]]:
+        """按 user_id 顺序分块批量计算用户习惯，每块用户只发固定数量的分组查询"""
+        if self.snapshot is not None:
+            yield from self._iter_user_habits_snapshot(user_ids, skip, limit, concurrent_since, chunk_size)
+            return
+
+        remaining = limit
+        last_user_id = None
+        while remaining is None or remaining > 0:
+            batch_size = chunk_size if remaining is None else min(chunk_size, remaining)
+            query = self.db.query(database.User.user_id, database.User.username).filter(
+                *self._visible(database.User.user_id)
+            )
+            if user_ids is not None:
+                query = query.filter(database.User.user_id.in_(user_ids))
+            query = query.order_by(database.User.user_id)
+            # 第一块按 skip 偏移，之后按 user_id 续查，避免深分页
+            if last_user_id is None:
+                query = query.offset(skip)
+            else:
+                query = query.filter(database.User.user_id > last_user_id)
+            users = query.limit(batch_size).all()
+            if not users:
+                break
             
-            # 找出用户最常用的设备
-            favorite_devices = self._get_user_favorite_devices(user.user_id)
+            yield self._analyze_user_habits_chunk(users, concurrent_since)
             
+            last_user_id = users[-1].user_id
+            if remaining is not None:
+                remaining -= len(users)
+            if len(users) < batch_size:
+                break
+    
+    def _analyze_user_habits_chunk(self, users, concurrent_since: Optional[datetime] = None) -> List[models.UserHabitAnalysis]:
+        """一块用户的习惯分析：活跃时段、最常用设备、同时使用的设备组合各一次查询"""
+        ids = [user.user_id for user in users]
+        
+        usage = self.usage
+        
+        # 找出用户的活跃时间段：按 (用户, 小时) 计数后用 ROW_NUMBER 取每个用户前3
+        hourly = self.db.query(
+            usage.user_id.label('user_id'),
+            usage.hour.label('hour'),
+            usage.usage_count.label('usage_count')
+        ).filter(
+            usage.user_id.in_(ids), *self._visible(device_id=usage.device_id)
+        ).group_by(
+            usage.user_id, usage.hour
+        ).subquery()
+        hour_rank = func.row_number().over(
+            partition_by=hourly.c.user_id,
+            order_by=(hourly.c.usage_count.desc(), hourly.c.hour)
+        ).label('rn')
+        ranked_hours = self.db.query(hourly.c.user_id, hourly.c.hour, hour_rank).subquery()
+        peak_hours = {}
+        for row in self.db.query(ranked_hours.c.user_id, ranked_hours.c.hour).filter(
+            ranked_hours.c.rn <= 3
+        ).order_by(ranked_hours.c.user_id, ranked_hours.c.rn):
+            if row.hour is not None:
+                peak_hours.setdefault(row.user_id, []).append(int(row.hour))
+        
+        # 找出用户最常用的设备：按 (用户, 设备名) 计数后取每个用户前5
+        device_counts = self.db.query(
+            usage.user_id.label('user_id'),
+            database.Device.device_name.label('device_name'),
+            usage.usage_count.label('usage_count')
+        ).join(
+            database.Device, usage.device_id == database.Device.device_id
+        ).filter(
+            usage.user_id.in_(ids), *self._visible(device_id=usage.device_id)
+        ).group_by(
+            usage.user_id, database.Device.device_name
+        ).subquery()
+        device_rank = func.row_number().over(
+            partition_by=device_counts.c.user_id,
+            order_by=(device_counts.c.usage_count.desc(), device_counts.c.device_name)
+        ).label('rn')
+        ranked_devices = self.db.query(
+            device_counts.c.user_id, device_counts.c.device_name, device_rank
+        ).subquery()
+        favorite_devices = {}
+        for row in self.db.query(ranked_devices.c.user_id, ranked_devices.c.device_name).filter(
+            ranked_devices.c.rn <= 5
+        ).order_by(ranked_devices.c.user_id, ranked_devices.c.rn):
+            favorite_devices.setdefault(row.user_id, []).append(row.device_name)
+        
+        # 找出经常同时使用的设备：一次取回整块用户的记录，再逐用户扫描线统计
+        records_query = self.db.query(
+            database.UsageRecord.user_id,
+            database.UsageRecord.start_time,
+            database.UsageRecord.end_time,
+            database.Device.device_name
+        ).join(
+            database.Device, database.UsageRecord.device_id == database.Device.device_id
+        ).filter(
+            database.UsageRecord.user_id.in_(ids),
+            database.UsageRecord.end_time.isnot(None),
+            *self._visible(device_id=database.UsageRecord.device_id)
+        )
+        if concurrent_since is not None:
+            records_query = records_query.filter(database.UsageRecord.start_time >= concurrent_since)
+        records_by_user = {}
+        for row in records_query.order_by(database.UsageRecord.user_id, database.UsageRecord.record_id):
+            records_by_user.setdefault(row.user_id, []).append(row)
+        
+        results = []
+        for user in users:
             analysis = models.UserHabitAnalysis(
                 user_id=user.user_id,
                 username=user.username,
-                frequently_used_together=frequently_used_together,
-                peak_activity_hours=peak_hours,
-                favorite_devices=favorite_devices
+                frequently_used_together=self._top_concurrent_pairs(records_by_user.get(user.user_id, [])),
+                peak_activity_hours=peak_hours.get(user.user_id, []),
+                favorite_devices=favorite_devices.get(user.user_id, [])
             )
             results.append(analysis)
         
         return results
     
-    def _find_concurrent_device_usage(self, user_id: int) -> List[List[str]]:
-        """查找同时使用的设备组合"""
+    def _iter_user_habits_snapshot(self, user_ids: Optional[List[int]], skip: int, limit: Optional[int],
+                                   concurrent_since: Optional[datetime], chunk_size: int
+                                   ) -> Iterator[List[models.UserHabitAnalysis]]:
+        """在快照上计算用户习惯：所选用户整体分组统计一次，再按 chunk_size 分块产出"""
+        users = self.snapshot.users.sort_values('user_id')
+        if user_ids is not None:
+            users = users[users['user_id'].isin(user_ids)]
+        users = users.iloc[skip:] if limit is None else users.iloc[skip:skip + limit]
+        if users.empty:
+            return
+
+        ids = users['user_id'].to_numpy()
+        peak_hours = self.snapshot.user_peak_hours(ids)
+        favorite_devices = self.snapshot.user_favorite_devices(ids)
+        records_by_user = self.snapshot.user_finished_records(ids, concurrent_since)
+
+        users = list(users[['user_id', 'username']].itertuples(index=False))
+        for begin in range(0, len(users), chunk_size):
+            yield [
+                models.UserHabitAnalysis(
+                    user_id=user.user_id,
+                    username=user.username,
+                    frequently_used_together=self._top_concurrent_pairs(records_by_user.get(user.user_id, [])),
+                    peak_activity_hours=peak_hours.get(user.user_id, []),
+                    favorite_devices=favorite_devices.get(user.user_id, [])
+                )
+                for user in users[begin:begin + chunk_size]
+            ]
+
+    def _find_concurrent_device_usage(self, user_id: int, since: Optional[datetime] = None,
+                                      max_pairs: Optional[int] = None) -> List[List[str]]:
+        """查找同时使用的设备组合
+
+        since 只扫描该时间之后开始的使用记录；max_pairs 限制最多统计的重叠记录对数。
+        """
         # 查询用户的使用记录
-        records = self.db.query(
+        query = self.db.query(
             database.UsageRecord.start_time,
             database.UsageRecord.end_time,
             database.Device.device_name
@@ -105,153 +330,233 @@ class SmartHomeAnalytics:
             database.Device, database.UsageRecord.device_id == database.Device.device_id
         ).filter(
             database.UsageRecord.user_id == user_id,
-            database.UsageRecord.end_time.isnot(None)
-        ).all()
+            database.UsageRecord.end_time.isnot(None),
+            *self._visible(database.UsageRecord.user_id, database.UsageRecord.device_id)
+        )
+        if since is not None:
+            query = query.filter(database.UsageRecord.start_time >= since)
         
-        # 找出时间重叠的设备使用记录
-        concurrent_pairs = []
-        for i, record1 in enumerate(records):
-            for record2 in records[i+1:]:
-                # 检查时间是否重叠
-                if (record1.start_time <= record2.end_time and 
-                    record1.end_time >= record2.start_time):
-                    pair = sorted([record1.device_name, record2.device_name])
-                    concurrent_pairs.append(pair)
+        return self._top_concurrent_pairs(query.all(), max_pairs=max_pairs)
+    
+    @staticmethod
+    def _top_concurrent_pairs(records, max_pairs: Optional[int] = None, top_n: int = 5) -> List[List[str]]:
+        """用扫描线统计时间重叠的设备组合，返回出现次数最多的 top_n 组
+
+        复杂度 O(n log n + k)，k 为重叠记录对数。结果与两两比较的实现一致：
+        次数相同的组合按其首个重叠记录对 (i, j) 在原记录顺序中的先后排列。
+        """
+        pair_counts = {}
+        first_seen = {}
+        found = 0
         
-        # 统计并返回最常见的组合
-        from collections import Counter
-        pair_counts = Counter(tuple(pair) for pair in concurrent_pairs)
-        top_pairs = [list(pair) for pair, count in pair_counts.most_common(5)]
+        def add_pair(i, j):
+            key = tuple(sorted((records[i].device_name, records[j].device_name)))
+            position = (i, j) if i < j else (j, i)
+            pair_counts[key] = pair_counts.get(key, 0) + 1
+            if key not in first_seen or position < first_seen[key]:
+                first_seen[key] = position
         
-        return top_pairs
-    
-    def _get_user_peak_hours(self, user_id: int) -> List[int]:
-        """获取用户的活跃时间段"""
-        query = self.db.query(
-            extract('hour', database.UsageRecord.start_time).label('hour'),
-            func.count().label('count')
-        ).filter(
-            database.UsageRecord.user_id == user_id
-        ).group_by(
-            extract('hour', database.UsageRecord.start_time)
-        ).order_by(
-            func.count().desc()
-        ).limit(3).all()
+        # 结束时间早于开始时间的异常记录无法参与扫描，单独与其余记录逐一比较
+        valid = [i for i, r in enumerate(records) if r.end_time >= r.start_time]
+        invalid = [i for i, r in enumerate(records) if r.end_time < r.start_time]
         
-        return [int(row.hour) for row in query if row.hour is not None]
-    
-    def _get_user_favorite_devices(self, user_id: int) -> List[str]:
-        """获取用户最常用的设备"""
-        query = self.db.query(
-            database.Device.device_name,
-            func.count(database.UsageRecord.record_id).label('usage_count')
-        ).join(
-            database.UsageRecord, database.Device.device_id == database.UsageRecord.device_id
-        ).filter(
-            database.UsageRecord.user_id == user_id
-        ).group_by(
-            database.Device.device_name
-        ).order_by(
-            func.count(database.UsageRecord.record_id).desc()
-        ).limit(5).all()
+        # 按开始时间扫描，堆中保存尚未结束的记录；堆内剩余记录都与当前记录重叠
+        active = []
+        for i in sorted(valid, key=lambda idx: records[idx].start_time):
+            start_time = records[i].start_time
+            while active and active[0][0] < start_time:
+                heapq.heappop(active)
+            for _, j in active:
+                if max_pairs is not None and found >= max_pairs:
+                    break
+                add_pair(j, i)
+                found += 1
+            heapq.heappush(active, (records[i].end_time, i))
         
-        return [row.device_name for row in query]
-    
-    def analyze_house_area_impact(self) -> List[models.HouseAreaAnalysis]:
-        """分析房屋面积对设备使用行为的影响"""
-        # 定义面积区间
-        area_ranges = [
-            (0, 50, "小户型(≤50㎡)"),
-            (50, 100, "中户型(50-100㎡)"),
-            (100, 150, "大户型(100-150㎡)"),
-            (150, float('inf'), "超大户型(>150㎡)")
-        ]
+        invalid_set = set(invalid)
+        for i in invalid:
+            for j in range(len(records)):
+                if j == i or (j in invalid_set and j < i):
+                    continue
+                if max_pairs is not None and found >= max_pairs:
+                    break
+                if (records[i].start_time <= records[j].end_time and
+                        records[i].end_time >= records[j].start_time):
+                    add_pair(i, j)
+                    found += 1
         
+        top_pairs = heapq.nsmallest(top_n, pair_counts, key=lambda key: (-pair_counts[key], first_seen[key]))
+        return [list(pair) for pair in top_pairs]
+    
+    def analyze_house_area_impact(self, edges: Optional[List[float]] = None,
+                                  quantiles: Optional[int] = None) -> List[models.HouseAreaAnalysis]:
+        """分析房屋面积对设备使用行为的影响
+
+        按面积区间 [edges[i], edges[i+1]) 分组（最后一个区间无上限），默认区间取 HOUSE_AREA_CONFIG；
+        指定 quantiles 时按用户面积分布等分。分桶用 CASE 表达式在库内完成，
+        设备数、使用时长、热门设备类型各一次分组查询，查询条数与用户数和区间数无关。
+        """
+        if quantiles is not None:
+            edges = self._area_quantile_edges(quantiles)
+        elif edges is None:
+            edges = HOUSE_AREA_CONFIG['edges']
+        edges = sorted(set(float(edge) for edge in edges))
+        if not edges:
+            return []
+
+        if self.snapshot is not None:
+            device_rows, usage_rows, type_rows = self.snapshot.house_area_rows(edges)
+        else:
+            User = database.User
+            bucket = self._area_bucket(edges).label('bucket')
+            in_range = and_(User.house_area.isnot(None), User.house_area >= edges[0],
+                            *self._visible(User.user_id))
+
+            # 每个区间的用户数、设备总数和有设备的用户数（平均设备数只统计有设备的用户）
+            device_counts = self.db.query(
+                database.Device.user_id,
+                func.count(database.Device.device_id).label('device_count')
+            ).filter(
+                *self._visible(device_id=database.Device.device_id)
+            ).group_by(database.Device.user_id).subquery()
+            device_rows = self.db.query(
+                bucket,
+                func.count(User.user_id).label('user_count'),
+                func.sum(device_counts.c.device_count).label('device_total'),
+                func.count(device_counts.c.device_count).label('users_with_devices')
+            ).outerjoin(
+                device_counts, device_counts.c.user_id == User.user_id
+            ).filter(in_range).group_by(bucket).all()
+
+            usage = self.usage
+            usage_rows = self.db.query(
+                bucket,
+                usage.total_minutes.label('total_minutes'),
+                usage.timed_count.label('timed_count')
+            ).select_from(usage.entity).join(
+                User, User.user_id == usage.user_id
+            ).filter(in_range, *self._visible(device_id=usage.device_id)).group_by(bucket).all()
+
+            type_rows = self.db.query(
+                bucket,
+                database.DeviceType.type_name,
+                func.count(database.Device.device_id).label('count')
+            ).select_from(database.Device).join(
+                User, User.user_id == database.Device.user_id
+            ).join(
+                database.DeviceType, database.DeviceType.type_id == database.Device.device_type_id
+            ).filter(
+                in_range, *self._visible(device_id=database.Device.device_id)
+            ).group_by(bucket, database.DeviceType.type_name).all()
+
+        usage_by_bucket = {row.bucket: row for row in usage_rows}
+        types_by_bucket = {}
+        for row in type_rows:
+            types_by_bucket.setdefault(row.bucket, []).append((row.count, row.type_name))
+
+        names = self._area_bucket_names(edges)
         results = []
-        for min_area, max_area, range_name in area_ranges:
-            # 筛选该面积范围的用户
-            if max_area == float('inf'):
-                users_in_range = self.db.query(database.User).filter(
-                    database.User.house_area >= min_area
-                ).all()
-            else:
-                users_in_range = self.db.query(database.User).filter(
-                    and_(database.User.house_area >= min_area,
-                         database.User.house_area < max_area)
-                ).all()
-            
-            if not users_in_range:
+        for row in sorted(device_rows, key=lambda r: r.bucket):
+            if not row.user_count:
                 continue
-            
-            user_ids = [user.user_id for user in users_in_range]
-            
-            # 计算平均设备数量 - 分两步进行
-            if user_ids:
-                # 先获取每个用户的设备数量
-                device_counts = self.db.query(
-                    func.count(database.Device.device_id).label('device_count')
-                ).filter(
-                    database.Device.user_id.in_(user_ids)
-                ).group_by(
-                    database.Device.user_id
-                ).all()
-                
-                # 然后计算平均值
-                if device_counts:
-                    avg_devices = sum(count.device_count for count in device_counts) / len(device_counts)
-                else:
-                    avg_devices = 0
-            else:
-                avg_devices = 0
-            
-            # 计算平均使用时长
-            if user_ids:
-                avg_usage_minutes = self.db.query(
-                    func.avg(database.UsageRecord.duration_minutes)
-                ).filter(
-                    database.UsageRecord.user_id.in_(user_ids)
-                ).scalar() or 0
-                avg_usage_hours = avg_usage_minutes / 60 if avg_usage_minutes else 0
-            else:
-                avg_usage_hours = 0
-            
-            # 获取最受欢迎的设备类型
-            if user_ids:
-                popular_types = self.db.query(
-                    database.DeviceType.type_name,
-                    func.count(database.Device.device_id).label('count')
-                ).join(
-                    database.Device, database.DeviceType.type_id == database.Device.device_type_id
-                ).filter(
-                    database.Device.user_id.in_(user_ids)
-                ).group_by(
-                    database.DeviceType.type_name
-                ).order_by(
-                    func.count(database.Device.device_id).desc()
-                ).limit(3).all()
-            else:
-                popular_types = []
-            
-            analysis = models.HouseAreaAnalysis(
-                area_range=range_name,
+            avg_devices = float(row.device_total) / row.users_with_devices if row.users_with_devices else 0
+
+            usage_row = usage_by_bucket.get(row.bucket)
+            avg_usage_minutes = (float(usage_row.total_minutes or 0) / usage_row.timed_count
+                                 if usage_row is not None and usage_row.timed_count else 0)
+            avg_usage_hours = avg_usage_minutes / 60 if avg_usage_minutes else 0
+
+            popular = sorted(types_by_bucket.get(row.bucket, []), key=lambda item: (-item[0], item[1]))[:3]
+
+            results.append(models.HouseAreaAnalysis(
+                area_range=names[row.bucket],
                 avg_devices_count=round(avg_devices, 2),
                 avg_usage_hours=round(avg_usage_hours, 2),
-                popular_device_types=[row.type_name for row in popular_types]
-            )
-            results.append(analysis)
-        
+                popular_device_types=[type_name for _, type_name in popular]
+            ))
+
         return results
+
+    @staticmethod
+    def _area_bucket(edges: List[float]):
+        """面积所在区间的序号：CASE WHEN house_area < edges[1] THEN 0 WHEN ... ELSE len(edges)-1"""
+        area = database.User.house_area
+        whens = [(area < edge, index) for index, edge in enumerate(edges[1:])]
+        return case(*whens, else_=len(edges) - 1) if whens else literal(0)
+
+    @staticmethod
+    def _area_bucket_names(edges: List[float]) -> List[str]:
+        """区间名称，默认区间沿用小/中/大/超大户型的叫法"""
+        if edges == DEFAULT_AREA_EDGES:
+            return list(DEFAULT_AREA_NAMES)
+        names = [f"{low:g}-{high:g}㎡" for low, high in zip(edges, edges[1:])]
+        names.append(f"≥{edges[-1]:g}㎡")
+        return names
+
+    def _area_quantile_edges(self, quantiles: int) -> List[float]:
+        """按面积分布等分的区间下界，用 NTILE 窗口函数一次查询取得"""
+        if self.snapshot is not None:
+            return self.snapshot.area_quantile_edges(quantiles)
+        tile = func.ntile(quantiles).over(order_by=database.User.house_area).label('tile')
+        ranked = self.db.query(
+            database.User.house_area.label('house_area'), tile
+        ).filter(database.User.house_area.isnot(None), *self._visible(database.User.user_id)).subquery()
+        rows = self.db.query(func.min(ranked.c.house_area)).group_by(ranked.c.tile).order_by(ranked.c.tile).all()
+        return [float(row[0]) for row in rows]
     
-    def generate_energy_consumption_report(self) -> Dict[str, Any]:
-        """生成能耗分析报告"""
+    def generate_energy_consumption_report(self, start_date: Optional[date] = None,
+                                           end_date: Optional[date] = None) -> Dict[str, Any]:
+        """生成能耗分析报告
+
+        start_date/end_date 为日期闭区间；启用 ENERGY_STATS_CONFIG 时读物化的能耗统计表，
+        否则从使用记录（或小时汇总表）现算。
+        """
+        if self.snapshot is not None:
+            # 能耗统计表只汇总已结束的记录，启用时快照上同样只统计已结束的记录
+            energy_by_type, energy_by_user = self.snapshot.energy_rows(
+                start_date, end_date, finished_only=energy_stats.is_enabled()
+            )
+        else:
+            energy_by_type, energy_by_user = self._energy_rows(start_date, end_date)
+
+        return {
+            'energy_by_device_type': [
+                {'type_name': row.type_name, 'total_energy': float(row.total_energy or 0)}
+                for row in energy_by_type
+            ],
+            'top_energy_users': [
+                {'username': row.username, 'total_energy': float(row.total_energy or 0)}
+                for row in energy_by_user
+            ]
+        }
+
+    def _energy_rows(self, start_date: Optional[date], end_date: Optional[date]):
+        """按设备类型、按用户（前10）汇总能耗的两次分组查询"""
+        if energy_stats.is_enabled():
+            stat = database.EnergyStatistic
+            source, device_id, user_id = stat, stat.device_id, stat.user_id
+            total_energy = func.sum(stat.daily_consumption)
+            date_filters = []
+            if start_date is not None:
+                date_filters.append(stat.stat_date >= start_date)
+            if end_date is not None:
+                date_filters.append(stat.stat_date <= end_date)
+        else:
+            usage = self.usage
+            source, device_id, user_id = usage.entity, usage.device_id, usage.user_id
+            total_energy = usage.total_energy
+            date_filters = usage.date_filters(start_date, end_date)
+        
         # 按设备类型统计能耗
         energy_by_type = self.db.query(
             database.DeviceType.type_name,
-            func.sum(database.UsageRecord.energy_consumed).label('total_energy')
+            total_energy.label('total_energy')
         ).join(
             database.Device, database.DeviceType.type_id == database.Device.device_type_id
         ).join(
-            database.UsageRecord, database.Device.device_id == database.UsageRecord.device_id
+            source, database.Device.device_id == device_id
+        ).filter(
+            *date_filters, *self._visible(database.Device.user_id, database.Device.device_id)
         ).group_by(
             database.DeviceType.type_name
         ).all()
@@ -259,22 +564,15 @@ class SmartHomeAnalytics:
         # 按用户统计能耗
         energy_by_user = self.db.query(
             database.User.username,
-            func.sum(database.UsageRecord.energy_consumed).label('total_energy')
+            total_energy.label('total_energy')
         ).join(
-            database.UsageRecord, database.User.user_id == database.UsageRecord.user_id
+            source, database.User.user_id == user_id
+        ).filter(
+            *date_filters, *self._visible(user_id, device_id)
         ).group_by(
             database.User.username
         ).order_by(
-            func.sum(database.UsageRecord.energy_consumed).desc()
+            total_energy.desc()
         ).limit(10).all()
         
-        return {
-            'energy_by_device_type': [
-                {'type_name': row.type_name, 'total_energy': float(row.total_energy or 0)}
-                for row in energy_by_type
-            ],
-            'top_energy_users': [
-                {'username': row.username, 'total_energy': float(row.total_energy or 0)}
-                for row in energy_by_user
-            ]
-        } 
\ No newline at end of file
+        return energy_by_type, energy_by_user
@@ -0,0 +1,132 @@
+"""
+API worker 启动开销基准
+
+在全新的解释器中导入入口（默认 main:app），统计导入耗时和常驻内存峰值，
+并解析 python -X importtime 的输出列出最耗时的模块，检查重依赖是否被提前加载。
+
+用法:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 10 --json import_time.json
+    python benchmarks/import_time.py --baseline import_time.json --max-regression 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# API worker 只处理 CRUD 时不应加载的模块
+HEAVY_MODULES = ('pandas', 'numpy', 'matplotlib', 'seaborn')
+
+# 子进程中执行：导入入口并输出耗时、内存峰值和已加载模块
+_PROBE = '''
+import importlib, json, resource, sys, time
+module_name, _, attr = sys.argv[1].partition(':')
+start = time.perf_counter()
+module = importlib.import_module(module_name)
+if attr:
+    getattr(module, attr)
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': sorted(sys.modules)
+}))
+'''
+
+
+def _probe(entry: str, importtime: bool = False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', _PROBE, entry]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {entry} 失败:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(stderr: str):
+    """解析 -X importtime 输出，返回 [(模块, 自身微秒, 累计微秒)]"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure(entry: str = 'main:app', runs: int = 5, top: int = 15):
+    """多次冷启动取中位数，再用一次 -X importtime 拆分各模块耗时"""
+    samples = [_probe(entry)[0] for _ in range(runs)]
+    probe, stderr = _probe(entry, importtime=True)
+    modules = parse_importtime(stderr)
+    slowest = sorted(modules, key=lambda module: module[2], reverse=True)
+    top_level = [module for module in slowest if '.' not in module[0]]
+    return {
+        'entry': entry,
+        'runs': runs,
+        'import_seconds': round(statistics.median(sample['seconds'] for sample in samples), 4),
+        'max_rss_mb': round(statistics.median(sample['max_rss_kb'] for sample in samples) / 1024, 1),
+        'module_count': len(probe['modules']),
+        'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in probe['modules']],
+        'top_modules': [
+            {'module': name, 'self_ms': round(self_us / 1000, 1), 'cumulative_ms': round(cumulative_us / 1000, 1)}
+            for name, self_us, cumulative_us in top_level[:top]
+        ]
+    }
+
+
+def compare(result: dict, baseline: dict, max_regression: float):
+    """与基线对比，返回超出允许增幅的指标说明"""
+    failures = []
+    for metric in ('import_seconds', 'max_rss_mb'):
+        before, after = baseline.get(metric), result[metric]
+        if before and (after - before) / before * 100 > max_regression:
+            failures.append(f"{metric}: {before} -> {after}（增幅超过 {max_regression}%）")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量 API worker 导入耗时和内存占用')
+    parser.add_argument('--entry', default='main:app', help='导入入口，格式 模块[:属性] (默认: main:app)')
+    parser.add_argument('--runs', type=int, default=5, help='冷启动次数，取中位数 (默认: 5)')
+    parser.add_argument('--top', type=int, default=15, help='列出累计耗时最多的顶层模块数 (默认: 15)')
+    parser.add_argument('--json', help='把结果写入 JSON 文件，可作为之后对比的基线')
+    parser.add_argument('--baseline', help='基线 JSON 文件，超出允许增幅时以非零状态退出')
+    parser.add_argument('--max-regression', type=float, default=20.0, help='允许的增幅百分比 (默认: 20)')
+    args = parser.parse_args()
+
+    result = measure(args.entry, args.runs, args.top)
+
+    print(f"入口: {result['entry']}（{result['runs']} 次冷启动中位数）")
+    print(f"导入耗时: {result['import_seconds'] * 1000:.1f} ms")
+    print(f"内存峰值: {result['max_rss_mb']} MB")
+    print(f"已加载模块: {result['module_count']}")
+    print(f"已加载的重依赖: {', '.join(result['heavy_modules_loaded']) or '无'}")
+    print("\n累计耗时最多的顶层模块:")
+    for module in result['top_modules']:
+        print(f"  {module['module']:<30} {module['cumulative_ms']:>8.1f} ms（自身 {module['self_ms']:.1f} ms）")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            failures = compare(result, json.load(f), args.max_regression)
+        if failures:
+            print("\n与基线相比出现退化:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("\n与基线相比未出现退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+分析结果缓存
+
+/analytics/* 的结果按请求参数缓存在进程内：条目超过 TTL 失效，条目数超过上限时
+按最近最少使用（LRU）淘汰。crud 中写 users/devices/usage_records 的函数提交后调用
+invalidate() 清空缓存，保证写入后的下一次分析请求看到新数据。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+from config import CACHE_CONFIG
+
+
+class AnalyticsCache:
+    """带 TTL 和 LRU 淘汰的线程安全结果缓存"""
+
+    def __init__(self, ttl_seconds: float = 30, max_entries: int = 128, enabled: bool = True):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 每次失效递增；计算开始前记下的代数与写回时不一致，说明期间发生过写入，结果不再缓存
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """命中则返回缓存结果，否则调用 compute() 计算并写入缓存"""
+        if not self.enabled:
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self):
+        """清空全部缓存条目"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """命中/未命中等计数，用于调整 TTL 和容量"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'ttl_seconds': self.ttl_seconds,
+                'max_entries': self.max_entries,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+analytics_cache = AnalyticsCache(
+    ttl_seconds=CACHE_CONFIG['ttl_seconds'],
+    max_entries=CACHE_CONFIG['max_entries'],
+    enabled=CACHE_CONFIG['enabled']
+)
@@ -0,0 +1,315 @@
+"""
+使用记录列式快照
+
+把 usage_records（附带设备类型 ID）按开始时间的月份分区导出到磁盘：每个分区一个目录，
+每列一个定长二进制文件 <月份>/<列名>.bin，读取时用 np.memmap 只读映射，离线分析不再访问数据库。
+加载时只映射与日期区间重叠的分区，逐分区只复制区间内的行，合并成 DataFrame 的列时再复制一次。
+users / devices / device_types 较小，每次刷新整表重写到 dimensions/ 下的 .npy 文件。
+
+manifest.json 记录各列的 dtype、各分区的行数和已导出的最大 record_id（水位线）。
+refresh 只把水位线之后的新记录追加到对应分区，每批写完列文件后原子替换 manifest；
+中途失败时列文件可能比 manifest 记录的长，下次刷新先截断到 manifest 的行数再继续。
+已导出记录的修改和删除不会同步，需要时执行 rebuild。
+
+首次导出和定时增量刷新:
+    python columnar.py refresh
+清空后全量重建:
+    python columnar.py rebuild
+查看分区和水位线:
+    python columnar.py info
+
+离线分析:
+    snapshot = ColumnarSnapshot('columnar_data', start_date=date(2024, 1, 1))
+    analytics = SmartHomeAnalytics(None, snapshot=snapshot)
+"""
+
+import argparse
+import json
+import os
+import shutil
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from config import COLUMNAR_CONFIG
+import database
+from snapshot import DataSnapshot, device_types_frame, devices_frame, users_frame
+
+VERSION = 1
+MANIFEST = 'manifest.json'
+DIMENSIONS = 'dimensions'
+
+# 使用记录的列及其磁盘类型（小端定长）；end_time 为空时存 NaT，时长和能耗为空时存 NaN
+USAGE_COLUMNS = {
+    'record_id': '<i8',
+    'user_id': '<i4',
+    'device_id': '<i4',
+    'device_type_id': '<i4',
+    'start_time': '<M8[us]',
+    'end_time': '<M8[us]',
+    'duration_minutes': '<f8',
+    'energy_consumed': '<f8'
+}
+
+DIMENSION_COLUMNS = {
+    'users': ['user_id', 'username', 'house_area'],
+    'device_types': ['type_id', 'type_name', 'avg_power_consumption'],
+    'devices': ['device_id', 'user_id', 'device_type_id', 'device_name', 'actual_power_consumption']
+}
+
+
+def _empty_manifest() -> dict:
+    return {
+        'version': VERSION,
+        'columns': USAGE_COLUMNS,
+        'last_record_id': 0,
+        'rows': 0,
+        'partitions': {},
+        'updated_at': None
+    }
+
+
+def read_manifest(path: str) -> dict:
+    """读取快照目录的 manifest，目录尚未导出过时返回空 manifest"""
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return _empty_manifest()
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != VERSION or manifest.get('columns') != USAGE_COLUMNS:
+        raise ValueError(f"列式快照 {path} 的格式与当前版本不一致，请执行 python columnar.py rebuild")
+    return manifest
+
+
+def _write_manifest(path: str, manifest: dict):
+    """先写临时文件再原子替换，读取方不会看到写了一半的 manifest"""
+    manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    tmp_path = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def _column_path(path: str, partition: str, column: str) -> str:
+    return os.path.join(path, partition, f'{column}.bin')
+
+
+def _partition_dirs(path: str) -> List[str]:
+    """磁盘上已有的分区目录名（YYYY-MM）"""
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path)
+                  if len(name) == 7 and name[4] == '-' and os.path.isdir(os.path.join(path, name)))
+
+
+def _repair(path: str, manifest: dict):
+    """把列文件截断到 manifest 记录的行数，丢弃上次中断时多写的部分"""
+    for partition in _partition_dirs(path):
+        rows = manifest['partitions'].get(partition, 0)
+        for column, dtype in USAGE_COLUMNS.items():
+            column_path = _column_path(path, partition, column)
+            size = rows * np.dtype(dtype).itemsize
+            if os.path.exists(column_path) and os.path.getsize(column_path) > size:
+                with open(column_path, 'r+b') as f:
+                    f.truncate(size)
+
+
+def _write_dimensions(db: Session, path: str):
+    """整表重写用户、设备和设备类型，每个文件先写临时文件再替换"""
+    models = {'users': database.User, 'device_types': database.DeviceType, 'devices': database.Device}
+    directory = os.path.join(path, DIMENSIONS)
+    os.makedirs(directory, exist_ok=True)
+    for name, columns in DIMENSION_COLUMNS.items():
+        model = models[name]
+        rows = db.execute(select(*[getattr(model, column) for column in columns])).all()
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        for column, column_values in zip(columns, values):
+            array = np.array([np.nan if value is None else value for value in column_values])
+            if array.dtype.kind == 'O':
+                array = array.astype(str)
+            tmp_path = os.path.join(directory, f'{name}.{column}.tmp.npy')
+            np.save(tmp_path, array, allow_pickle=False)
+            os.replace(tmp_path, os.path.join(directory, f'{name}.{column}.npy'))
+
+
+def _append(path: str, manifest: dict, rows: list):
+    """把一批按 record_id 排序的记录按开始月份追加到各分区的列文件"""
+    values = list(zip(*rows))
+    arrays = {}
+    for column, column_values in zip(USAGE_COLUMNS, values):
+        dtype = USAGE_COLUMNS[column]
+        if dtype.startswith('<f'):
+            column_values = [np.nan if value is None else value for value in column_values]
+        arrays[column] = np.array(column_values, dtype=dtype)
+
+    months = arrays['start_time'].astype('datetime64[M]')
+    for month in np.unique(months):
+        partition = str(month)
+        mask = months == month
+        os.makedirs(os.path.join(path, partition), exist_ok=True)
+        for column, array in arrays.items():
+            with open(_column_path(path, partition, column), 'ab') as f:
+                f.write(np.ascontiguousarray(array[mask]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        manifest['partitions'][partition] = manifest['partitions'].get(partition, 0) + int(mask.sum())
+
+    manifest['rows'] += len(rows)
+    manifest['last_record_id'] = int(arrays['record_id'][-1])
+
+
+def refresh(db: Session, path: str = None, batch_size: int = None) -> dict:
+    """把水位线之后新增的使用记录追加到列式快照并重写维度表，返回新的 manifest"""
+    path = path or COLUMNAR_CONFIG['path']
+    batch_size = batch_size or COLUMNAR_CONFIG['batch_size']
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+    _repair(path, manifest)
+
+    _write_dimensions(db, path)
+    record = database.UsageRecord
+    stmt = select(
+        record.record_id, record.user_id, record.device_id, database.Device.device_type_id,
+        record.start_time, record.end_time, record.duration_minutes, record.energy_consumed
+    ).join(database.Device, database.Device.device_id == record.device_id).where(
+        record.record_id > manifest['last_record_id']
+    ).order_by(record.record_id).execution_options(yield_per=batch_size)
+
+    for rows in db.execute(stmt).partitions():
+        _append(path, manifest, rows)
+        _write_manifest(path, manifest)
+    _write_manifest(path, manifest)
+    return manifest
+
+
+def rebuild(db: Session, path: str = None, batch_size: int = None) -> dict:
+    """删除已有的分区、维度表和 manifest 后全量导出"""
+    path = path or COLUMNAR_CONFIG['path']
+    for name in _partition_dirs(path) + [DIMENSIONS]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    return refresh(db, path, batch_size)
+
+
+class ColumnarSnapshot(DataSnapshot):
+    """从列式快照目录加载的 DataSnapshot，分析时不访问数据库
+
+    指定 start_date / end_date 时只映射覆盖该区间的月份分区，并只保留使用日期在区间内的记录。
+    """
+
+    def __init__(self, path: str = None, start_date: Optional[date] = None, end_date: Optional[date] = None):
+        super().__init__(db=None)
+        self.path = path or COLUMNAR_CONFIG['path']
+        self.manifest = read_manifest(self.path)
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def _dimension(self, name: str) -> pd.DataFrame:
+        directory = os.path.join(self.path, DIMENSIONS)
+        return pd.DataFrame({
+            column: np.load(os.path.join(directory, f'{name}.{column}.npy'), allow_pickle=False)
+            for column in DIMENSION_COLUMNS[name]
+        })
+
+    def _load_users(self) -> pd.DataFrame:
+        return users_frame(self._dimension('users'))
+
+    def _load_device_types(self) -> pd.DataFrame:
+        return device_types_frame(self._dimension('device_types'))
+
+    def _load_devices(self) -> pd.DataFrame:
+        return devices_frame(self._dimension('devices'))
+
+    def partitions(self) -> List[str]:
+        """与日期区间有重叠的分区"""
+        first = self.start_date.strftime('%Y-%m') if self.start_date else None
+        last = self.end_date.strftime('%Y-%m') if self.end_date else None
+        return [partition for partition, rows in sorted(self.manifest['partitions'].items())
+                if rows and (first is None or partition >= first) and (last is None or partition <= last)]
+
+    def _column(self, partition: str, column: str) -> np.ndarray:
+        return np.memmap(_column_path(self.path, partition, column), dtype=USAGE_COLUMNS[column], mode='r',
+                         shape=(self.manifest['partitions'][partition],))
+
+    def _partition_arrays(self, partition: str) -> Dict[str, np.ndarray]:
+        """映射一个分区的各列，只把日期区间内的行复制出来并转换成快照使用的类型"""
+        columns = {column: self._column(partition, column) for column in USAGE_COLUMNS}
+        start_time = columns['start_time']
+        keep = None
+        # 只有区间首尾两个月的分区需要逐行比较，中间的分区整段保留
+        if self.start_date is not None and partition == self.start_date.strftime('%Y-%m'):
+            keep = start_time >= np.datetime64(datetime.combine(self.start_date, time.min), 'us')
+        if self.end_date is not None and partition == self.end_date.strftime('%Y-%m'):
+            before_end = start_time < np.datetime64(datetime.combine(self.end_date + timedelta(days=1), time.min), 'us')
+            keep = before_end if keep is None else keep & before_end
+
+        def take(column, dtype):
+            values = columns[column] if keep is None else columns[column][keep]
+            return values.astype(dtype)
+
+        return {
+            'record_id': take('record_id', np.int32),
+            'user_id': take('user_id', np.int32),
+            'device_id': take('device_id', np.int32),
+            'device_type_id': take('device_type_id', np.int32),
+            'start_time': take('start_time', 'datetime64[ns]'),
+            'end_time': take('end_time', 'datetime64[ns]'),
+            'duration_minutes': take('duration_minutes', np.float64),
+            'energy_consumed': take('energy_consumed', np.float64)
+        }
+
+    def _load_usage(self) -> pd.DataFrame:
+        parts = [self._partition_arrays(partition) for partition in self.partitions()]
+        if parts:
+            arrays = {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+        else:
+            arrays = self._empty_usage()
+        del parts
+
+        # 分区按月份排列，迟到的记录会让 record_id 在分区之间乱序，只有这时才重新排序
+        record_ids = arrays['record_id']
+        if len(record_ids) > 1 and (record_ids[1:] < record_ids[:-1]).any():
+            order = np.argsort(record_ids, kind='stable')
+            arrays = {column: values[order] for column, values in arrays.items()}
+        return pd.DataFrame(arrays, copy=False)
+
+    @staticmethod
+    def _empty_usage() -> Dict[str, np.ndarray]:
+        dtypes = {'start_time': 'datetime64[ns]', 'end_time': 'datetime64[ns]',
+                  'duration_minutes': np.float64, 'energy_consumed': np.float64}
+        return {column: np.empty(0, dtype=dtypes.get(column, np.int32)) for column in USAGE_COLUMNS}
+
+def main():
+    parser = argparse.ArgumentParser(description='导出使用记录列式快照')
+    parser.add_argument('command', choices=['refresh', 'rebuild', 'info'],
+                        help='refresh: 增量导出水位线之后的使用记录; rebuild: 清空后全量导出; info: 查看分区')
+    parser.add_argument('--path', default=COLUMNAR_CONFIG['path'],
+                        help=f"快照目录 (默认 {COLUMNAR_CONFIG['path']})")
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        manifest = read_manifest(args.path)
+        for partition, rows in sorted(manifest['partitions'].items()):
+            print(f"{partition}: {rows} 条")
+        print(f"共 {manifest['rows']} 条，水位线 record_id {manifest['last_record_id']}，"
+              f"更新于 {manifest['updated_at']}")
+        return
+
+    with Session(database.engine) as db:
+        before = read_manifest(args.path)['last_record_id'] if args.command == 'refresh' else 0
+        if args.command == 'rebuild':
+            manifest = rebuild(db, args.path)
+        else:
+            manifest = refresh(db, args.path)
+        print(f"列式快照导出完成，水位线 record_id {before} -> {manifest['last_record_id']}，"
+              f"共 {manifest['rows']} 条，{len(manifest['partitions'])} 个分区")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,88 @@ DATABASE_CONFIG = {
 # MySQL连接URL
 DATABASE_URL = f"mysql+pymysql://{DATABASE_CONFIG['user']}:{DATABASE_CONFIG['password']}@{DATABASE_CONFIG['host']}:{DATABASE_CONFIG['port']}/{DATABASE_CONFIG['database']}?charset={DATABASE_CONFIG['charset']}"
 
+# 连接池配置（同步和异步引擎共用，每个 worker 进程各自持有一个连接池）
+POOL_CONFIG = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),            # 常驻连接数
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),     # 高峰时额外允许的连接数
+    'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),   # 等待空闲连接的超时秒数
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),   # 连接最长复用秒数，应小于 MySQL wait_timeout
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')  # 借出前探活，剔除失效连接
+}
+
+# 异步数据库配置
+# 启用后 API 路由通过 aiomysql 异步访问数据库（可选依赖，需要 pip install aiomysql），
+# 分析和批量写入等 CPU 密集的操作仍在线程池中使用同步引擎，generate_charts.py 等脚本也使用同步引擎
+ASYNC_DB_CONFIG = {
+    'enabled': os.getenv('DB_ASYNC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+}
+
+ASYNC_DATABASE_URL = DATABASE_URL.replace('mysql+pymysql://', 'mysql+aiomysql://', 1)
+
+# 启动时表结构处理方式
+# check: 比对表结构指纹，一致则跳过建表（默认）; init: 每次启动都建表; skip: 不检查
+# 建表也可以单独执行 python database.py init
+SCHEMA_CONFIG = {
+    'startup_mode': os.getenv('DB_SCHEMA_STARTUP', 'check')
+}
+
+# 请求级 SQL 统计配置
+QUERY_TRACKER_CONFIG = {
+    # 同一请求内同一语句形态执行超过该次数时记录 N+1 警告
+    'n_plus_one_threshold': int(os.getenv('QUERY_REPEAT_WARN_THRESHOLD', '10')),
+    # 响应头附带 X-DB-Statements / X-DB-Time-Ms / X-DB-Max-Repeats / X-DB-Top-Repeats，便于排查和测试断言
+    'debug_headers': os.getenv('QUERY_DEBUG_HEADERS', 'false').lower() in ('1', 'true', 'yes')
+}
+
 # API配置
 API_CONFIG = {
     'host': '0.0.0.0',
     'port': 8000,
     'debug': True
-} 
\ No newline at end of file
+}
+
+# 批量写入配置
+BULK_INGEST_CONFIG = {
+    'max_rows': 10000,   # 单次请求最多条数
+    'batch_size': 1000   # 每条多行 INSERT 的行数
+}
+
+# 使用记录小时汇总表配置
+# 启用前先执行 python rollup.py backfill 回填历史数据
+ROLLUP_CONFIG = {
+    'enabled': os.getenv('USAGE_ROLLUP_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+}
+
+# 能耗统计表配置
+# 启用前先执行 python energy_stats.py refresh 物化历史数据，之后定时执行同一命令增量刷新
+ENERGY_STATS_CONFIG = {
+    'enabled': os.getenv('ENERGY_STATS_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    'price_per_kwh': float(os.getenv('ELECTRICITY_PRICE', '0.56')),  # 电价（元/度）
+    'batch_size': 100000  # 每批处理的使用记录数，每批一个事务
+}
+
+# 分析结果缓存配置
+CACHE_CONFIG = {
+    'enabled': os.getenv('ANALYTICS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+    'ttl_seconds': float(os.getenv('ANALYTICS_CACHE_TTL', '30')),      # 条目存活秒数
+    'max_entries': int(os.getenv('ANALYTICS_CACHE_MAX_ENTRIES', '128'))  # 超出后按 LRU 淘汰
+}
+
+# 房屋面积分析的区间边界（平米，左闭右开，最后一个区间无上限）
+HOUSE_AREA_CONFIG = {
+    'edges': [float(edge) for edge in os.getenv('HOUSE_AREA_EDGES', '0,50,100,150').split(',')]
+}
+
+# 使用记录列式快照配置
+# 执行 python columnar.py refresh 导出或增量追加，之后可用 ColumnarSnapshot 离线分析
+COLUMNAR_CONFIG = {
+    'path': os.getenv('COLUMNAR_PATH', 'columnar_data'),  # 快照目录
+    'batch_size': 100000  # 每批读取并追加的使用记录数
+}
+
+# 级联删除任务配置（删除用户/设备时在后台分批删除关联数据）
+PURGE_CONFIG = {
+    'batch_size': int(os.getenv('PURGE_BATCH_SIZE', '5000')),          # 每个事务删除的行数
+    'pause_seconds': float(os.getenv('PURGE_PAUSE_SECONDS', '0')),     # 批之间的间隔，给写入让出锁
+    'stale_seconds': float(os.getenv('PURGE_STALE_SECONDS', '300'))    # 执行中的任务超过该时间无进展视为中断
+}
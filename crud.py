@@ -1,26 +1,66 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from datetime import datetime, timedelta
+from sqlalchemy import func, and_, or_, select
+from datetime import date, datetime, timedelta
 from typing import List, Optional
+from types import SimpleNamespace
 import database
 import models
+import rollup
+import energy_stats
+import pagination
+import purge
+from cache import analytics_cache
+
+def _page(query, keys, skip: int, limit: int, cursor: Optional[str]):
+    """分页查询：有游标时按排序键定位（键集分页），否则按 skip 偏移"""
+    query = pagination.seek(query, keys, cursor)
+    if not cursor:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
 # 用户CRUD操作
 def create_user(db: Session, user: models.UserCreate):
     db_user = database.User(**user.dict())
     db.add(db_user)
     db.commit()
+    analytics_cache.invalidate()
     db.refresh(db_user)
     return db_user
 
+# 正在级联删除的用户和设备对读接口不可见
+def _visible_users(db: Session):
+    return db.query(database.User).filter(database.User.user_id.notin_(purge.purging_ids('user')))
+
+def _visible_devices(db: Session):
+    return db.query(database.Device).filter(
+        database.Device.device_id.notin_(purge.purging_ids('device')),
+        database.Device.user_id.notin_(purge.purging_ids('user'))
+    )
+
+def _not_purging(db: Session, model) -> list:
+    """排除正在删除的用户和设备的关联行，没有未完成的删除任务时为空列表"""
+    return purge.visible_filters(purge.hidden_ids(db), user_id=model.user_id,
+                                 device_id=getattr(model, 'device_id', None))
+
+def _export_not_purging(model) -> list:
+    """导出查询在独立会话中执行，用子查询排除正在删除的用户和设备的关联行"""
+    criteria = [model.user_id.notin_(purge.purging_ids('user'))]
+    if hasattr(model, 'device_id'):
+        condition = model.device_id.notin_(purge.purging_ids('device'))
+        criteria.append(or_(model.device_id.is_(None), condition) if model.device_id.expression.nullable else condition)
+    return criteria
+
 def get_user(db: Session, user_id: int):
-    return db.query(database.User).filter(database.User.user_id == user_id).first()
+    return _visible_users(db).filter(database.User.user_id == user_id).first()
 
 def get_user_by_username(db: Session, username: str):
     return db.query(database.User).filter(database.User.username == username).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.User).offset(skip).limit(limit).all()
+# 列表分页排序键（键集分页按这些列定位下一页）
+USER_PAGE_KEYS = (database.User.user_id,)
+
+def get_users(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return _page(_visible_users(db), USER_PAGE_KEYS, skip, limit, cursor)
 
 def update_user(db: Session, user_id: int, user_update: models.UserUpdate):
     db_user = get_user(db, user_id)
@@ -30,28 +70,15 @@ def update_user(db: Session, user_id: int, user_update: models.UserUpdate):
             setattr(db_user, field, value)
         db_user.updated_at = datetime.now()
         db.commit()
+        analytics_cache.invalidate()
         db.refresh(db_user)
     return db_user
 
 def delete_user(db: Session, user_id: int):
-    db_user = get_user(db, user_id)
-    if db_user:
-        # 先删除相关的使用记录
-        db.query(database.UsageRecord).filter(database.UsageRecord.user_id == user_id).delete()
-        
-        # 删除相关的安防事件
-        db.query(database.SecurityEvent).filter(database.SecurityEvent.user_id == user_id).delete()
-        
-        # 删除相关的用户反馈
-        db.query(database.UserFeedback).filter(database.UserFeedback.user_id == user_id).delete()
-        
-        # 删除用户的设备
-        db.query(database.Device).filter(database.Device.user_id == user_id).delete()
-        
-        # 最后删除用户
-        db.delete(db_user)
-        db.commit()
-    return db_user
+    """登记用户的级联删除任务并返回，用户不存在时返回 None；关联数据由 purge.run 在后台分批删除"""
+    if get_user(db, user_id) is None:
+        return None
+    return purge.start(db, 'user', user_id)
 
 # 设备类型CRUD操作
 def create_device_type(db: Session, device_type: models.DeviceTypeCreate):
@@ -94,17 +121,20 @@ def create_device(db: Session, device: models.DeviceCreate):
     db_device = database.Device(**device.dict())
     db.add(db_device)
     db.commit()
+    analytics_cache.invalidate()
     db.refresh(db_device)
     return db_device
 
 def get_device(db: Session, device_id: int):
-    return db.query(database.Device).filter(database.Device.device_id == device_id).first()
+    return _visible_devices(db).filter(database.Device.device_id == device_id).first()
 
-def get_devices(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.Device).offset(skip).limit(limit).all()
+DEVICE_PAGE_KEYS = (database.Device.device_id,)
+
+def get_devices(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return _page(_visible_devices(db), DEVICE_PAGE_KEYS, skip, limit, cursor)
 
 def get_user_devices(db: Session, user_id: int):
-    return db.query(database.Device).filter(database.Device.user_id == user_id).all()
+    return _visible_devices(db).filter(database.Device.user_id == user_id).all()
 
 def update_device(db: Session, device_id: int, device_update: models.DeviceUpdate):
     db_device = get_device(db, device_id)
@@ -113,68 +143,227 @@ def update_device(db: Session, device_id: int, device_update: models.DeviceUpdat
         for field, value in update_data.items():
             setattr(db_device, field, value)
         db.commit()
+        analytics_cache.invalidate()
         db.refresh(db_device)
     return db_device
 
 def delete_device(db: Session, device_id: int):
-    db_device = get_device(db, device_id)
-    if db_device:
-        # 先删除相关的使用记录
-        db.query(database.UsageRecord).filter(database.UsageRecord.device_id == device_id).delete()
-        
-        # 删除相关的安防事件
-        db.query(database.SecurityEvent).filter(database.SecurityEvent.device_id == device_id).delete()
-        
-        # 最后删除设备
-        db.delete(db_device)
-        db.commit()
-    return db_device
+    """登记设备的级联删除任务并返回，设备不存在时返回 None；关联数据由 purge.run 在后台分批删除"""
+    if get_device(db, device_id) is None:
+        return None
+    return purge.start(db, 'device', device_id)
+
+def get_purge_job(db: Session, job_id: int):
+    return purge.get_job(db, job_id)
 
 # 使用记录CRUD操作
 def create_usage_record(db: Session, usage_record: models.UsageRecordCreate):
+    """创建使用记录，用户或设备不存在（包括正在删除）时返回 None"""
+    device = get_device(db, usage_record.device_id)
+    if device is None or get_user(db, usage_record.user_id) is None:
+        return None
     db_record = database.UsageRecord(**usage_record.dict())
     if db_record.end_time and db_record.start_time:
         duration = db_record.end_time - db_record.start_time
         db_record.duration_minutes = int(duration.total_seconds() / 60)
-        device = get_device(db, db_record.device_id)
-        if device:
-            hours = duration.total_seconds() / 3600
-            db_record.energy_consumed = device.actual_power_consumption * hours / 1000  # 转换为度
+        hours = duration.total_seconds() / 3600
+        db_record.energy_consumed = device.actual_power_consumption * hours / 1000  # 转换为度
     
     db.add(db_record)
+    if rollup.is_enabled():
+        rollup.apply_record(db, db_record)
     db.commit()
+    analytics_cache.invalidate()
     db.refresh(db_record)
     return db_record
 
-def get_usage_records(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.UsageRecord).offset(skip).limit(limit).all()
+def create_usage_records_bulk(db: Session, usage_records: List[models.UsageRecordCreate],
+                              batch_size: int = 1000):
+    """批量创建使用记录，在一个事务内分批多行插入
+
+    设备功耗和用户存在性各用一次 IN 查询解析，使用时长和能耗用 pandas 向量化计算。
+    返回 (成功插入条数, [(行号, 错误原因), ...])，行号为 usage_records 中的下标。
+    """
+    import pandas as pd
 
-def get_user_usage_records(db: Session, user_id: int):
-    return db.query(database.UsageRecord).filter(database.UsageRecord.user_id == user_id).all()
+    if not usage_records:
+        return 0, []
 
-def get_device_usage_records(db: Session, device_id: int):
-    return db.query(database.UsageRecord).filter(database.UsageRecord.device_id == device_id).all()
+    df = pd.DataFrame([record.dict() for record in usage_records])
+    device_ids = df['device_id'].unique().tolist()
+    user_ids = df['user_id'].unique().tolist()
+
+    power_by_device = dict(_visible_devices(db).with_entities(
+        database.Device.device_id, database.Device.actual_power_consumption
+    ).filter(database.Device.device_id.in_(device_ids)).all())
+    known_users = {row.user_id for row in _visible_users(db).with_entities(database.User.user_id).filter(
+        database.User.user_id.in_(user_ids)
+    )}
+
+    errors = []
+    device_found = df['device_id'].isin(list(power_by_device))
+    user_found = df['user_id'].isin(list(known_users))
+    for index in df.index[~user_found]:
+        errors.append((int(index), f"用户不存在: {df.at[index, 'user_id']}"))
+    for index in df.index[user_found & ~device_found]:
+        errors.append((int(index), f"设备不存在: {df.at[index, 'device_id']}"))
+    df = df[device_found & user_found]
+    if df.empty:
+        return 0, sorted(errors)
+
+    # 向量化计算使用时长（分钟，向零取整）和能耗（度）
+    seconds = (pd.to_datetime(df['end_time']) - pd.to_datetime(df['start_time'])).dt.total_seconds()
+    power = df['device_id'].map(power_by_device).fillna(0.0).astype(float)
+    has_end = df['end_time'].notna()
+    duration_minutes = (seconds / 60).where(has_end)
+    energy_consumed = (power * seconds / 3600 / 1000).where(has_end, 0.0)
+
+    rows = []
+    for index, minutes, energy in zip(df.index, duration_minutes, energy_consumed):
+        record = usage_records[index]
+        rows.append({
+            'user_id': record.user_id,
+            'device_id': record.device_id,
+            'start_time': record.start_time,
+            'end_time': record.end_time,
+            'duration_minutes': None if pd.isna(minutes) else int(minutes),
+            'energy_consumed': float(energy),
+            'operation_type': record.operation_type
+        })
+
+    table = database.UsageRecord.__table__
+    for start in range(0, len(rows), batch_size):
+        db.execute(table.insert(), rows[start:start + batch_size])
+    if rollup.is_enabled():
+        rollup.apply_records(db, [SimpleNamespace(**row) for row in rows])
+    db.commit()
+    analytics_cache.invalidate()
+    return len(rows), sorted(errors)
+
+USAGE_RECORD_PAGE_KEYS = (database.UsageRecord.start_time, database.UsageRecord.record_id)
+
+def get_usage_records(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    query = db.query(database.UsageRecord).filter(*_not_purging(db, database.UsageRecord))
+    return _page(query, USAGE_RECORD_PAGE_KEYS, skip, limit, cursor)
+
+def _filter_usage_records(query, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                          operation_type: Optional[str] = None):
+    """按开始时间范围 [since, until) 和操作类型筛选使用记录"""
+    if since is not None:
+        query = query.filter(database.UsageRecord.start_time >= since)
+    if until is not None:
+        query = query.filter(database.UsageRecord.start_time < until)
+    if operation_type is not None:
+        query = query.filter(database.UsageRecord.operation_type == operation_type)
+    return query
+
+def get_user_usage_records(db: Session, user_id: int, since: Optional[datetime] = None,
+                           until: Optional[datetime] = None, operation_type: Optional[str] = None):
+    query = db.query(database.UsageRecord).filter(
+        database.UsageRecord.user_id == user_id, *_not_purging(db, database.UsageRecord)
+    )
+    query = _filter_usage_records(query, since, until, operation_type)
+    return query.order_by(database.UsageRecord.start_time).all()
+
+def get_device_usage_records(db: Session, device_id: int, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None, operation_type: Optional[str] = None):
+    query = db.query(database.UsageRecord).filter(
+        database.UsageRecord.device_id == device_id, *_not_purging(db, database.UsageRecord)
+    )
+    query = _filter_usage_records(query, since, until, operation_type)
+    return query.order_by(database.UsageRecord.start_time).all()
 
 def delete_usage_record(db: Session, record_id: int):
     db_record = db.query(database.UsageRecord).filter(database.UsageRecord.record_id == record_id).first()
     if db_record:
         db.delete(db_record)
+        if rollup.is_enabled():
+            rollup.apply_record(db, db_record, sign=-1)
+        # 已物化到能耗统计表的记录，重算其所在的设备日
+        if db_record.record_id <= energy_stats.get_watermark(db):
+            db.flush()
+            energy_stats.refresh_device_day(db, db_record.device_id, db_record.start_time.date())
         db.commit()
+        analytics_cache.invalidate()
     return db_record
 
+# 能耗统计查询
+def _filter_energy_statistics(query, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    """按统计日期闭区间 [start_date, end_date] 筛选"""
+    if start_date is not None:
+        query = query.filter(database.EnergyStatistic.stat_date >= start_date)
+    if end_date is not None:
+        query = query.filter(database.EnergyStatistic.stat_date <= end_date)
+    return query
+
+def get_user_energy_statistics(db: Session, user_id: int, start_date: Optional[date] = None,
+                               end_date: Optional[date] = None, device_id: Optional[int] = None):
+    query = db.query(database.EnergyStatistic).filter(
+        database.EnergyStatistic.user_id == user_id, *_not_purging(db, database.EnergyStatistic)
+    )
+    if device_id is not None:
+        query = query.filter(database.EnergyStatistic.device_id == device_id)
+    query = _filter_energy_statistics(query, start_date, end_date)
+    return query.order_by(database.EnergyStatistic.stat_date, database.EnergyStatistic.device_id).all()
+
+def get_daily_energy_summary(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                             user_id: Optional[int] = None):
+    """按日期汇总所有用户（指定 user_id 时为该用户）的总耗电量、总电费和有耗电的设备数
+
+    与 daily_energy_summary 视图不同，结果不按用户分行，也不带用户名和城市，每个日期一行。
+    """
+    stat = database.EnergyStatistic
+    query = db.query(
+        stat.stat_date,
+        func.sum(stat.daily_consumption).label('total_consumption'),
+        func.sum(stat.cost).label('total_cost'),
+        func.count(func.distinct(stat.device_id)).label('active_devices')
+    ).filter(*_not_purging(db, stat))
+    if user_id is not None:
+        query = query.filter(stat.user_id == user_id)
+    query = _filter_energy_statistics(query, start_date, end_date)
+    return query.group_by(stat.stat_date).order_by(stat.stat_date.desc()).all()
+
 # 安防事件CRUD操作
 def create_security_event(db: Session, security_event: models.SecurityEventCreate):
+    """创建安防事件，用户或指定的设备不存在（包括正在删除）时返回 None"""
+    if get_user(db, security_event.user_id) is None:
+        return None
+    if security_event.device_id is not None and get_device(db, security_event.device_id) is None:
+        return None
     db_event = database.SecurityEvent(**security_event.dict())
     db.add(db_event)
     db.commit()
     db.refresh(db_event)
     return db_event
 
-def get_security_events(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.SecurityEvent).offset(skip).limit(limit).all()
+SECURITY_EVENT_PAGE_KEYS = (database.SecurityEvent.occurred_at, database.SecurityEvent.event_id)
+
+def get_security_events(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    query = db.query(database.SecurityEvent).filter(*_not_purging(db, database.SecurityEvent))
+    return _page(query, SECURITY_EVENT_PAGE_KEYS, skip, limit, cursor)
+
+def _filter_security_events(query, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                            severity_level: Optional[str] = None, is_resolved: Optional[bool] = None):
+    """按发生时间范围 [since, until)、严重程度和处理状态筛选安防事件"""
+    if since is not None:
+        query = query.filter(database.SecurityEvent.occurred_at >= since)
+    if until is not None:
+        query = query.filter(database.SecurityEvent.occurred_at < until)
+    if severity_level is not None:
+        query = query.filter(database.SecurityEvent.severity_level == severity_level)
+    if is_resolved is not None:
+        query = query.filter(database.SecurityEvent.is_resolved == is_resolved)
+    return query
 
-def get_user_security_events(db: Session, user_id: int):
-    return db.query(database.SecurityEvent).filter(database.SecurityEvent.user_id == user_id).all()
+def get_user_security_events(db: Session, user_id: int, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None, severity_level: Optional[str] = None,
+                             is_resolved: Optional[bool] = None):
+    query = db.query(database.SecurityEvent).filter(
+        database.SecurityEvent.user_id == user_id, *_not_purging(db, database.SecurityEvent)
+    )
+    query = _filter_security_events(query, since, until, severity_level, is_resolved)
+    return query.order_by(database.SecurityEvent.occurred_at).all()
 
 def update_security_event(db: Session, event_id: int, event_update: models.SecurityEventUpdate):
     db_event = db.query(database.SecurityEvent).filter(database.SecurityEvent.event_id == event_id).first()
@@ -195,17 +384,25 @@ def delete_security_event(db: Session, event_id: int):
 
 # 用户反馈CRUD操作
 def create_user_feedback(db: Session, feedback: models.UserFeedbackCreate):
+    """创建用户反馈，用户不存在（包括正在删除）时返回 None"""
+    if get_user(db, feedback.user_id) is None:
+        return None
     db_feedback = database.UserFeedback(**feedback.dict())
     db.add(db_feedback)
     db.commit()
     db.refresh(db_feedback)
     return db_feedback
 
-def get_user_feedbacks(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.UserFeedback).offset(skip).limit(limit).all()
+FEEDBACK_PAGE_KEYS = (database.UserFeedback.feedback_id,)
+
+def get_user_feedbacks(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    query = db.query(database.UserFeedback).filter(*_not_purging(db, database.UserFeedback))
+    return _page(query, FEEDBACK_PAGE_KEYS, skip, limit, cursor)
 
 def get_user_feedback_by_user(db: Session, user_id: int):
-    return db.query(database.UserFeedback).filter(database.UserFeedback.user_id == user_id).all()
+    return db.query(database.UserFeedback).filter(
+        database.UserFeedback.user_id == user_id, *_not_purging(db, database.UserFeedback)
+    ).all()
 
 def update_user_feedback(db: Session, feedback_id: int, feedback_update: models.UserFeedbackUpdate):
     db_feedback = db.query(database.UserFeedback).filter(database.UserFeedback.feedback_id == feedback_id).first()
@@ -222,4 +419,31 @@ def delete_user_feedback(db: Session, feedback_id: int):
     if db_feedback:
         db.delete(db_feedback)
         db.commit()
-    return db_feedback
\ No newline at end of file
+    return db_feedback
+
+# 流式导出查询（按主键顺序，配合 export.stream_export 使用）
+def select_usage_records(user_id: Optional[int] = None, device_id: Optional[int] = None,
+                         since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         operation_type: Optional[str] = None):
+    stmt = select(database.UsageRecord.__table__).where(*_export_not_purging(database.UsageRecord))
+    if user_id is not None:
+        stmt = stmt.where(database.UsageRecord.user_id == user_id)
+    if device_id is not None:
+        stmt = stmt.where(database.UsageRecord.device_id == device_id)
+    stmt = _filter_usage_records(stmt, since, until, operation_type)
+    return stmt.order_by(database.UsageRecord.record_id)
+
+def select_security_events(user_id: Optional[int] = None, since: Optional[datetime] = None,
+                           until: Optional[datetime] = None, severity_level: Optional[str] = None,
+                           is_resolved: Optional[bool] = None):
+    stmt = select(database.SecurityEvent.__table__).where(*_export_not_purging(database.SecurityEvent))
+    if user_id is not None:
+        stmt = stmt.where(database.SecurityEvent.user_id == user_id)
+    stmt = _filter_security_events(stmt, since, until, severity_level, is_resolved)
+    return stmt.order_by(database.SecurityEvent.event_id)
+
+def select_user_feedbacks(user_id: Optional[int] = None):
+    stmt = select(database.UserFeedback.__table__).where(*_export_not_purging(database.UserFeedback))
+    if user_id is not None:
+        stmt = stmt.where(database.UserFeedback.user_id == user_id)
+    return stmt.order_by(database.UserFeedback.feedback_id)
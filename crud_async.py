@@ -0,0 +1,158 @@
+"""
+crud 的异步版本
+
+每个函数与 crud 中的同名函数参数一致，传入的会话决定执行方式：
+- AsyncSession（启用异步数据库时）：通过 run_sync 在事件循环上执行 crud 逻辑，
+  数据库读写由 aiomysql 异步完成，等待数据库期间不占用线程；
+- Session（默认同步模式）：放到线程池执行，行为与同步路由相同。
+查询和写入逻辑（汇总表维护、缓存失效等）只在 crud 中实现一份。
+
+run_sync 会在事件循环线程上执行整个函数，只有等待数据库时让出。分析（pandas 计算）和批量写入（pandas 校验）
+这类 CPU 密集的操作改用 run_blocking：两种模式下都放到线程池，异步模式下在线程中另开同步会话。
+"""
+
+from datetime import date, datetime
+from typing import Callable, List, Optional, Union
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import crud
+import database
+import models
+
+DBSession = Union[AsyncSession, Session]
+
+
+async def run(db: DBSession, fn: Callable, *args, **kwargs):
+    """以同步会话为第一个参数执行 fn(session, *args, **kwargs)"""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def run_blocking(db: DBSession, fn: Callable, *args, **kwargs):
+    """在线程池中以同步会话执行 fn(session, *args, **kwargs)，不占用事件循环线程"""
+    if isinstance(db, AsyncSession):
+        def call():
+            with database.SessionLocal() as session:
+                return fn(session, *args, **kwargs)
+        return await run_in_threadpool(call)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+# 用户CRUD操作
+async def create_user(db: DBSession, user: models.UserCreate):
+    return await run(db, crud.create_user, user)
+
+async def get_user(db: DBSession, user_id: int):
+    return await run(db, crud.get_user, user_id)
+
+async def get_user_by_username(db: DBSession, username: str):
+    return await run(db, crud.get_user_by_username, username)
+
+async def get_users(db: DBSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await run(db, crud.get_users, skip, limit, cursor)
+
+async def update_user(db: DBSession, user_id: int, user_update: models.UserUpdate):
+    return await run(db, crud.update_user, user_id, user_update)
+
+async def delete_user(db: DBSession, user_id: int):
+    return await run(db, crud.delete_user, user_id)
+
+# 设备类型CRUD操作
+async def create_device_type(db: DBSession, device_type: models.DeviceTypeCreate):
+    return await run(db, crud.create_device_type, device_type)
+
+async def get_device_types(db: DBSession):
+    return await run(db, crud.get_device_types)
+
+async def get_device_type(db: DBSession, type_id: int):
+    return await run(db, crud.get_device_type, type_id)
+
+async def delete_device_type(db: DBSession, type_id: int):
+    return await run(db, crud.delete_device_type, type_id)
+
+# 设备CRUD操作
+async def create_device(db: DBSession, device: models.DeviceCreate):
+    return await run(db, crud.create_device, device)
+
+async def get_device(db: DBSession, device_id: int):
+    return await run(db, crud.get_device, device_id)
+
+async def get_devices(db: DBSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await run(db, crud.get_devices, skip, limit, cursor)
+
+async def get_user_devices(db: DBSession, user_id: int):
+    return await run(db, crud.get_user_devices, user_id)
+
+async def update_device(db: DBSession, device_id: int, device_update: models.DeviceUpdate):
+    return await run(db, crud.update_device, device_id, device_update)
+
+async def delete_device(db: DBSession, device_id: int):
+    return await run(db, crud.delete_device, device_id)
+
+async def get_purge_job(db: DBSession, job_id: int):
+    return await run(db, crud.get_purge_job, job_id)
+
+# 使用记录CRUD操作
+async def create_usage_record(db: DBSession, usage_record: models.UsageRecordCreate):
+    return await run(db, crud.create_usage_record, usage_record)
+
+async def create_usage_records_bulk(db: DBSession, usage_records: List[models.UsageRecordCreate],
+                                    batch_size: int = 1000):
+    return await run_blocking(db, crud.create_usage_records_bulk, usage_records, batch_size)
+
+async def get_usage_records(db: DBSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await run(db, crud.get_usage_records, skip, limit, cursor)
+
+async def get_user_usage_records(db: DBSession, user_id: int, since: Optional[datetime] = None,
+                                 until: Optional[datetime] = None, operation_type: Optional[str] = None):
+    return await run(db, crud.get_user_usage_records, user_id, since, until, operation_type)
+
+async def get_device_usage_records(db: DBSession, device_id: int, since: Optional[datetime] = None,
+                                   until: Optional[datetime] = None, operation_type: Optional[str] = None):
+    return await run(db, crud.get_device_usage_records, device_id, since, until, operation_type)
+
+async def delete_usage_record(db: DBSession, record_id: int):
+    return await run(db, crud.delete_usage_record, record_id)
+
+# 能耗统计查询
+async def get_user_energy_statistics(db: DBSession, user_id: int, start_date: Optional[date] = None,
+                                     end_date: Optional[date] = None, device_id: Optional[int] = None):
+    return await run(db, crud.get_user_energy_statistics, user_id, start_date, end_date, device_id)
+
+async def get_daily_energy_summary(db: DBSession, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                   user_id: Optional[int] = None):
+    return await run(db, crud.get_daily_energy_summary, start_date, end_date, user_id)
+
+# 安防事件CRUD操作
+async def create_security_event(db: DBSession, security_event: models.SecurityEventCreate):
+    return await run(db, crud.create_security_event, security_event)
+
+async def get_security_events(db: DBSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await run(db, crud.get_security_events, skip, limit, cursor)
+
+async def get_user_security_events(db: DBSession, user_id: int, since: Optional[datetime] = None,
+                                   until: Optional[datetime] = None, severity_level: Optional[str] = None,
+                                   is_resolved: Optional[bool] = None):
+    return await run(db, crud.get_user_security_events, user_id, since, until, severity_level, is_resolved)
+
+async def update_security_event(db: DBSession, event_id: int, event_update: models.SecurityEventUpdate):
+    return await run(db, crud.update_security_event, event_id, event_update)
+
+async def delete_security_event(db: DBSession, event_id: int):
+    return await run(db, crud.delete_security_event, event_id)
+
+# 用户反馈CRUD操作
+async def create_user_feedback(db: DBSession, feedback: models.UserFeedbackCreate):
+    return await run(db, crud.create_user_feedback, feedback)
+
+async def get_user_feedbacks(db: DBSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await run(db, crud.get_user_feedbacks, skip, limit, cursor)
+
+async def get_user_feedback_by_user(db: DBSession, user_id: int):
+    return await run(db, crud.get_user_feedback_by_user, user_id)
+
+async def update_user_feedback(db: DBSession, feedback_id: int, feedback_update: models.UserFeedbackUpdate):
+    return await run(db, crud.update_user_feedback, feedback_id, feedback_update)
+
+async def delete_user_feedback(db: DBSession, feedback_id: int):
+    return await run(db, crud.delete_user_feedback, feedback_id)
@@ -1,9 +1,14 @@
+import argparse
+import hashlib
 import pymysql
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, ForeignKey, Text
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, Float, Boolean, ForeignKey, Text, Index, Numeric, select
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
-from config import DATABASE_CONFIG, DATABASE_URL
+from config import DATABASE_CONFIG, DATABASE_URL, ASYNC_DATABASE_URL, POOL_CONFIG
+from db_pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool
+import query_tracker
 
 Base = declarative_base()
 
@@ -76,6 +81,13 @@ class UsageRecord(Base):
     # 关系
     user = relationship("User", back_populates="usage_records")
     device = relationship("Device", back_populates="usage_records")
+    
+    # 按用户/设备查询某段时间的记录走复合索引，只扫描对应时间范围
+    __table_args__ = (
+        Index('idx_usage_records_user_time', 'user_id', 'start_time'),
+        Index('idx_usage_records_device_time', 'device_id', 'start_time'),
+        Index('idx_usage_records_date', 'start_time'),
+    )
 
 # 安防事件表
 class SecurityEvent(Base):
@@ -94,6 +106,11 @@ class SecurityEvent(Base):
     # 关系
     user = relationship("User", back_populates="security_events")
     device = relationship("Device", back_populates="security_events")
+    
+    __table_args__ = (
+        Index('idx_security_events_user_time', 'user_id', 'occurred_at'),
+        Index('occurred_at', 'occurred_at'),
+    )
 
 # 用户反馈表
 class UserFeedback(Base):
@@ -110,9 +127,81 @@ class UserFeedback(Base):
     # 关系
     user = relationship("User", back_populates="feedbacks")
 
+# 使用记录小时汇总表（按 用户/设备/日期/小时 预聚合，由 crud 写入时增量维护）
+class UsageHourlyRollup(Base):
+    __tablename__ = 'usage_hourly_rollup'
+    
+    user_id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, primary_key=True)
+    usage_date = Column(Date, primary_key=True)
+    usage_hour = Column(Integer, primary_key=True)  # 开始时间所在小时 0-23
+    usage_count = Column(Integer, nullable=False, default=0)  # 使用记录数
+    timed_count = Column(Integer, nullable=False, default=0)  # 有使用时长的记录数，用于计算平均时长
+    total_minutes = Column(Integer, nullable=False, default=0)  # 使用时长合计（分钟）
+    total_energy = Column(Float, nullable=False, default=0.0)  # 消耗电量合计（度）
+
+# 能耗统计表（按 设备/日期 汇总使用记录，由 energy_stats.py 增量物化）
+class EnergyStatistic(Base):
+    __tablename__ = 'energy_statistics'
+    
+    stat_id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
+    device_id = Column(Integer, ForeignKey('devices.device_id'))
+    stat_date = Column(Date, nullable=False)
+    daily_consumption = Column(Float)  # 日耗电量（千瓦时）
+    peak_power = Column(Float)  # 峰值功率（瓦）
+    avg_power = Column(Float)  # 平均功率（瓦）
+    usage_duration = Column(Integer)  # 使用时长（分钟）
+    cost = Column(Numeric(10, 2))  # 电费成本（元）
+    
+    __table_args__ = (
+        Index('idx_energy_statistics_user_date', 'user_id', 'stat_date'),
+        Index('idx_energy_statistics_device_date', 'device_id', 'stat_date'),
+        Index('idx_energy_stats_date', 'stat_date'),
+    )
+
+# 物化任务水位线（各物化表已处理到的 usage_records.record_id）
+class MaterializerWatermark(Base):
+    __tablename__ = 'materializer_watermarks'
+    
+    name = Column(String(50), primary_key=True)
+    last_record_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+# 级联删除任务（删除用户/设备时登记，由 purge.py 在后台分批删除关联数据）
+class PurgeJob(Base):
+    __tablename__ = 'purge_jobs'
+    
+    job_id = Column(Integer, primary_key=True, autoincrement=True)
+    entity_type = Column(String(20), nullable=False)  # user 或 device
+    entity_id = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default='pending')  # pending、running、failed、completed
+    current_step = Column(String(50))  # 正在清理的表
+    total_rows = Column(Integer)  # 开始执行时统计的待删除关联行数
+    deleted_rows = Column(Integer, nullable=False, default=0)  # 已删除的关联行数
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('idx_purge_jobs_entity', 'entity_type', 'entity_id'),
+        Index('idx_purge_jobs_status', 'status'),
+    )
+
+# 表结构版本（记录最近一次建表时模型的指纹，启动时比对以跳过建表）
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    
+    version_id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now)
+
 # 数据库引擎和会话
-engine = create_engine(DATABASE_URL, echo=False)
+engine = create_engine(DATABASE_URL, echo=False, poolclass=InstrumentedQueuePool, **POOL_CONFIG)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 统计每个请求执行的 SQL 条数和耗时
+query_tracker.install(engine)
 
 def get_db():
     """获取数据库会话"""
@@ -122,6 +211,62 @@ def get_db():
     finally:
         db.close()
 
+# 异步引擎和会话（首次使用时创建，只有启用异步数据库时才需要安装 aiomysql）
+async_engine = None
+AsyncSessionLocal = None
+
+def get_async_sessionmaker():
+    """获取异步会话工厂"""
+    global async_engine, AsyncSessionLocal
+    if AsyncSessionLocal is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False,
+                                           poolclass=InstrumentedAsyncQueuePool, **POOL_CONFIG)
+        query_tracker.install(async_engine.sync_engine)
+        # 提交后不过期对象属性，避免在事件循环中序列化响应时触发隐式查询
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return AsyncSessionLocal
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def dispose_async_engine():
+    """关闭异步引擎的连接池"""
+    if async_engine is not None:
+        await async_engine.dispose()
+
+def schema_fingerprint() -> str:
+    """根据模型定义（表、列、索引）计算表结构指纹，模型变化后指纹随之变化"""
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(f"table {table.name}")
+        for column in table.columns:
+            parts.append(f"column {column.name} {column.type} nullable={column.nullable} pk={column.primary_key}")
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            columns = ','.join(column.name for column in index.columns)
+            parts.append(f"index {index.name} ({columns}) unique={index.unique}")
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+def schema_is_current() -> bool:
+    """用一次查询比对数据库中记录的表结构指纹，表不存在或连接失败都视为不一致"""
+    try:
+        with engine.connect() as connection:
+            stored = connection.execute(
+                select(SchemaVersion.fingerprint).where(SchemaVersion.version_id == 1)
+            ).scalar()
+    except SQLAlchemyError:
+        return False
+    return stored == schema_fingerprint()
+
+def _record_schema_fingerprint():
+    with engine.begin() as connection:
+        connection.execute(SchemaVersion.__table__.delete())
+        connection.execute(SchemaVersion.__table__.insert().values(
+            version_id=1, fingerprint=schema_fingerprint(), applied_at=datetime.now()
+        ))
+
 def init_database():
     """初始化数据库"""
     try:
@@ -139,8 +284,45 @@ def init_database():
         
         # 创建表
         Base.metadata.create_all(bind=engine)
+        
+        # 已存在的表不会被 create_all 修改，补建模型中新增的索引
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        
+        _record_schema_fingerprint()
         print("数据库初始化成功！")
         return True
     except Exception as e:
         print(f"数据库初始化失败: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def ensure_schema(mode: str = 'check'):
+    """应用启动时的表结构处理
+
+    check: 指纹一致则跳过建表，不一致（首次启动或模型有变化）时执行 init_database()
+    init:  每次启动都执行 init_database()
+    skip:  不做任何检查，表结构由 python database.py init 单独维护
+    """
+    if mode == 'skip':
+        return True
+    if mode == 'check' and schema_is_current():
+        return True
+    return init_database()
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库表结构维护')
+    parser.add_argument('command', choices=['init', 'check'],
+                        help='init: 创建数据库、表和索引并记录表结构指纹; check: 检查表结构指纹是否与模型一致')
+    args = parser.parse_args()
+    
+    if args.command == 'init':
+        raise SystemExit(0 if init_database() else 1)
+    if schema_is_current():
+        print("表结构与模型一致")
+    else:
+        print("表结构与模型不一致，请执行 python database.py init")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+连接池统计
+
+InstrumentedQueuePool 在 SQLAlchemy 默认的 QueuePool 上记录取连接的等待时间，
+pool_stats() 汇总连接池当前占用（已借出、溢出、空闲）和等待时间直方图，
+用于按实际负载为每个 worker 调整 pool_size / max_overflow。
+"""
+
+import threading
+import time
+from typing import Any, Dict
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# 等待时间直方图上界（秒），最后一档为 +Inf
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class PoolWaitStats:
+    """取连接等待时间的累计直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def observe(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            index = next((i for i, bound in enumerate(WAIT_BUCKETS) if seconds <= bound), len(WAIT_BUCKETS))
+            self.bucket_counts[index] += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observed = self.checkouts + self.timeouts
+            cumulative, histogram = 0, {}
+            for bound, count in zip(list(WAIT_BUCKETS) + ['+Inf'], self.bucket_counts):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_seconds': round(self.total_wait / observed, 6) if observed else 0.0,
+                'max_wait_seconds': round(self.max_wait, 6),
+                'wait_histogram': histogram
+            }
+
+
+class _WaitTimingMixin:
+    """给 QueuePool 加上取连接等待计时"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.wait_stats.observe(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.observe(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() 会重建连接池，保留累计统计
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+class InstrumentedQueuePool(_WaitTimingMixin, QueuePool):
+    """记录等待时间的同步连接池"""
+
+
+class InstrumentedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    """记录等待时间的异步连接池"""
+
+
+def pool_stats(engine) -> Dict[str, Any]:
+    """连接池当前状态和累计等待统计"""
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'pool_size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout_seconds': pool.timeout()
+        })
+    wait_stats = getattr(pool, 'wait_stats', None)
+    if wait_stats is not None:
+        stats.update(wait_stats.snapshot())
+    return stats
@@ -0,0 +1,179 @@
+"""
+能耗统计表物化
+
+energy_statistics 按 (设备, 日期) 汇总已结束的使用记录：日耗电量、使用时长、平均/峰值功率和电费。
+以 usage_records.record_id 为水位线增量刷新：每批找出水位线之后新增记录涉及的 (设备, 日期)，
+删除这些日期的旧统计后从使用记录重新汇总，迟到的记录和重复执行都不会重复计数。
+删除使用记录时 crud 会重算对应的 (设备, 日期)。
+
+首次物化和定时增量刷新:
+    python energy_stats.py refresh
+清空后全量重建:
+    python energy_stats.py rebuild
+"""
+
+import argparse
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import Date, and_, case, func, select, tuple_
+from sqlalchemy.orm import Session
+from config import ENERGY_STATS_CONFIG
+import database
+
+WATERMARK = 'energy_statistics'
+
+_COLUMNS = ['user_id', 'device_id', 'stat_date', 'daily_consumption', 'peak_power', 'avg_power',
+            'usage_duration', 'cost']
+
+
+def is_enabled() -> bool:
+    """能耗报告是否改读能耗统计表"""
+    return ENERGY_STATS_CONFIG['enabled']
+
+
+def _record_day():
+    return func.date(database.UsageRecord.start_time, type_=Date)
+
+
+def get_watermark(db: Session) -> int:
+    """已物化到的最大 record_id，从未物化时为 0"""
+    watermark = db.get(database.MaterializerWatermark, WATERMARK)
+    return watermark.last_record_id if watermark else 0
+
+
+def set_watermark(db: Session, record_id: int):
+    """更新水位线，不提交事务"""
+    watermark = db.get(database.MaterializerWatermark, WATERMARK)
+    if watermark is None:
+        db.add(database.MaterializerWatermark(name=WATERMARK, last_record_id=record_id))
+    else:
+        watermark.last_record_id = record_id
+        watermark.updated_at = datetime.now()
+    db.flush()
+
+
+def _aggregate(*criteria):
+    """按 (用户, 设备, 日期) 汇总满足条件且已结束的使用记录，列顺序与 _COLUMNS 一致"""
+    record = database.UsageRecord
+    day = _record_day()
+    energy = func.coalesce(func.sum(record.energy_consumed), 0.0)
+    minutes = func.sum(record.duration_minutes)
+    # 单次使用的平均功率（瓦），当天各次使用中的最大值作为峰值功率
+    session_power = case(
+        (record.duration_minutes > 0, record.energy_consumed * 60000.0 / record.duration_minutes)
+    )
+    return select(
+        record.user_id,
+        record.device_id,
+        day,
+        energy,
+        func.max(session_power),
+        energy * 60000.0 / func.nullif(minutes, 0),
+        minutes,
+        func.round(energy * ENERGY_STATS_CONFIG['price_per_kwh'], 2)
+    ).where(record.end_time.isnot(None), *criteria).group_by(record.user_id, record.device_id, day)
+
+
+def _replace(db: Session, stat_criteria, record_criteria):
+    """删除匹配的统计行，再从匹配的使用记录重新汇总写入，不提交事务"""
+    db.query(database.EnergyStatistic).filter(*stat_criteria).delete(synchronize_session=False)
+    db.execute(database.EnergyStatistic.__table__.insert().from_select(_COLUMNS, _aggregate(*record_criteria)))
+
+
+def refresh(db: Session, batch_size: int = None) -> int:
+    """把水位线之后新增的使用记录物化到能耗统计表，每批一个事务，返回最新水位线
+
+    从未物化过时按设备分批全量重建。
+    注意：并发写入中尚未提交的较小 record_id 可能被跳过，建议在写入低峰执行，或定期 rebuild。
+    """
+    batch_size = batch_size or ENERGY_STATS_CONFIG['batch_size']
+    record = database.UsageRecord
+    last = get_watermark(db)
+    if last == 0:
+        return rebuild(db)
+
+    while True:
+        # 本批处理到第 batch_size 条新记录；record_id 不连续时也能按条数分批
+        high = db.query(record.record_id).filter(record.record_id > last).order_by(
+            record.record_id
+        ).offset(batch_size - 1).limit(1).scalar()
+        if high is None:
+            high = db.query(func.max(record.record_id)).scalar()
+            if high is None or high <= last:
+                break
+
+        window = and_(record.record_id > last, record.record_id <= high)
+        touched = select(record.device_id, _record_day()).where(window).distinct()
+        # 只汇总到 high 为止的记录：之后提交的记录留给下一批，未物化前删除时 crud 才不必重算
+        _replace(
+            db,
+            [tuple_(database.EnergyStatistic.device_id, database.EnergyStatistic.stat_date).in_(touched)],
+            [record.device_id.in_(select(record.device_id).where(window)),
+             tuple_(record.device_id, _record_day()).in_(touched),
+             record.record_id <= high]
+        )
+        set_watermark(db, high)
+        db.commit()
+        last = high
+    return last
+
+
+def rebuild(db: Session, device_batch: int = 1000) -> int:
+    """清空能耗统计表后按设备 ID 分批全量重建，返回最新水位线
+
+    重建完成前水位线保持为 0，中途失败时下次 refresh 会重新全量重建，不会漏掉未重建的设备。
+    """
+    record = database.UsageRecord
+    high = db.query(func.max(record.record_id)).scalar() or 0
+    db.query(database.EnergyStatistic).delete(synchronize_session=False)
+    set_watermark(db, 0)
+    db.commit()
+
+    last_device = 0
+    while True:
+        device_ids = [row.device_id for row in db.query(database.Device.device_id).filter(
+            database.Device.device_id > last_device
+        ).order_by(database.Device.device_id).limit(device_batch)]
+        if not device_ids:
+            break
+        _replace(db, [database.EnergyStatistic.device_id.in_(device_ids)],
+                 [record.device_id.in_(device_ids), record.record_id <= high])
+        db.commit()
+        last_device = device_ids[-1]
+    set_watermark(db, high)
+    db.commit()
+    return high
+
+
+def refresh_device_day(db: Session, device_id: int, day: date):
+    """重算一个设备一天的统计（删除已物化的使用记录后调用），不提交事务"""
+    start = datetime.combine(day, time.min)
+    record = database.UsageRecord
+    _replace(
+        db,
+        [database.EnergyStatistic.device_id == device_id, database.EnergyStatistic.stat_date == day],
+        [record.device_id == device_id, record.start_time >= start, record.start_time < start + timedelta(days=1),
+         record.record_id <= get_watermark(db)]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='物化能耗统计表')
+    parser.add_argument('command', choices=['refresh', 'rebuild'],
+                        help='refresh: 增量物化水位线之后的使用记录; rebuild: 清空后全量重建')
+    args = parser.parse_args()
+
+    database.Base.metadata.create_all(bind=database.engine, tables=[
+        database.EnergyStatistic.__table__, database.MaterializerWatermark.__table__
+    ])
+    with Session(database.engine) as db:
+        before = get_watermark(db)
+        if args.command == 'rebuild':
+            watermark = rebuild(db)
+        else:
+            watermark = refresh(db)
+        rows = db.query(func.count()).select_from(database.EnergyStatistic).scalar()
+        print(f"能耗统计物化完成，水位线 record_id {before} -> {watermark}，共 {rows} 行")
+
+
+if __name__ == "__main__":
+    main()
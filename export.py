@@ -0,0 +1,63 @@
+"""
+流式导出
+
+用服务端游标（yield_per）分批读取查询结果，逐块编码为 NDJSON 或 CSV，
+配合 StreamingResponse 使用：内存占用与导出行数无关，首批数据读出即开始发送。
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+import database
+
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"无法序列化类型: {type(value).__name__}")
+
+
+def _encode_ndjson(columns, rows) -> str:
+    return ''.join(
+        json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + '\n'
+        for row in rows
+    )
+
+
+def _encode_csv(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        [value.isoformat() if isinstance(value, (datetime, date)) else value for value in row]
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+def stream_export(stmt, fmt: str = 'ndjson', batch_size: int = 1000):
+    """按批次流式执行查询并输出编码后的文本块
+
+    使用独立会话，生成器结束（或客户端断开）时关闭，不依赖请求级会话的生命周期。
+    """
+    db = database.SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        columns = list(result.keys())
+        if fmt == 'csv':
+            yield _encode_csv([columns])
+        for partition in result.partitions():
+            if fmt == 'csv':
+                yield _encode_csv(partition)
+            else:
+                yield _encode_ndjson(columns, partition)
+    finally:
+        db.close()
@@ -2,6 +2,7 @@ import argparse
 import sys
 from sqlalchemy.orm import Session
 import database
+from snapshot import DataSnapshot
 from visual import SmartHomeVisualizer
 
 def main():
@@ -17,6 +18,27 @@ def main():
         default='visualizations',
         help='图表输出目录 (默认: visualizations)'
     )
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help='生成所有图表时先查询全部数据，再用多进程并行绘图'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='并行绘图的进程数 (默认: CPU 核数)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='忽略数据指纹，总是重新查询并绘制图表'
+    )
+    parser.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='各表只扫描一次读入内存快照，所有图表在快照上统计'
+    )
     
     args = parser.parse_args()
     
@@ -24,7 +46,9 @@ def main():
     try:
         engine = database.engine
         with Session(engine) as db:
-            visualizer = SmartHomeVisualizer(db)
+            # 快照按需加载，所有图表都复用已有结果时不会读取任何表
+            snapshot = DataSnapshot(db) if args.snapshot else None
+            visualizer = SmartHomeVisualizer(db, force=args.force, snapshot=snapshot)
             visualizer.output_dir = args.output_dir
             
             print("智能家居数据可视化图表生成器")
@@ -32,12 +56,15 @@ def main():
             
             if args.chart_type == 'all':
                 print("生成所有图表...")
-                results = visualizer.generate_all_visualizations()
+                results = visualizer.generate_all_visualizations(parallel=args.parallel, workers=args.workers)
+                timings = results.pop('timings')
                 
                 print("\n生成结果:")
                 for chart_type, result in results.items():
                     status = "成功" if result else "失败"
-                    print(f"{status} {chart_type}: {result if result else '生成失败'}")
+                    timing = timings.get(chart_type, {})
+                    cost = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timing.items())
+                    print(f"{status} {chart_type}: {result if result else '生成失败'}" + (f" ({cost})" if cost else ""))
                     
             elif args.chart_type == 'device':
                 print("生成设备使用分析图表...")
@@ -0,0 +1,474 @@
+"""
+按规模因子生成合成数据
+
+规模因子 1 约为 1,000 个用户、每户 3~40 台设备、每户约 1,000 条使用记录，
+另有安防事件、用户反馈和按 (设备, 日期) 汇总的能耗统计；规模因子 1000 即约 100 万用户、10 亿条使用记录。
+数据按用户分块用 NumPy 向量化生成：
+- 房屋面积服从对数正态分布（中位数约 90 平米），面积越大设备越多；
+- 使用时段按设备类型的作息曲线抽样（灯光/电视晚间、厨电三餐、冰箱摄像头全天等），
+  同一用户的多台设备时间独立抽样，自然产生重叠使用；
+- 使用时长按设备类型的日均使用时长做对数正态抽样，约 3% 的记录为未结束的会话。
+
+写入方式:
+    python generate_data.py --scale-factor 1                     # 直接写入数据库（多行 INSERT）
+    python generate_data.py --scale-factor 100 --output files    # 生成 TSV 文件和 LOAD DATA 脚本
+    mysql --local-infile=1 smart_home_db < seed_data/load.sql
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from config import ENERGY_STATS_CONFIG
+import database
+import energy_stats
+
+USERS_PER_SCALE = 1000
+
+# 作息曲线（24 小时的相对权重）
+HOUR_PROFILES = {
+    'evening': [1, 1, 1, 1, 1, 1, 3, 5, 3, 2, 2, 2, 2, 2, 2, 2, 3, 5, 9, 12, 12, 10, 6, 3],
+    'meals': [0, 0, 0, 0, 0, 1, 4, 8, 4, 1, 2, 8, 10, 3, 1, 1, 2, 8, 10, 4, 1, 1, 0, 0],
+    'daytime': [0, 0, 0, 0, 0, 0, 1, 3, 6, 9, 10, 9, 6, 6, 8, 9, 8, 6, 4, 3, 2, 1, 0, 0],
+    'cooling': [4, 3, 2, 2, 1, 1, 1, 1, 2, 3, 5, 7, 9, 10, 10, 9, 8, 7, 7, 8, 9, 9, 8, 6],
+    'morning_evening': [0, 0, 0, 0, 1, 3, 9, 10, 5, 2, 1, 1, 1, 1, 1, 1, 2, 4, 8, 10, 9, 6, 3, 1],
+    'night': [8, 8, 7, 6, 5, 4, 3, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 3, 4, 6, 8, 9, 9],
+    'allday': [1] * 24,
+}
+
+# 设备类型目录：(名称, 描述, 平均功耗W, 日均使用小时, 作息曲线)
+DEVICE_CATALOG = [
+    ('智能LED灯泡', '9.5W智能LED灯泡，支持调光调色', 9.5, 6, 'evening'),
+    ('变频空调1.5匹', '1.5匹变频空调，适合18平米房间', 800, 8, 'cooling'),
+    ('智能音响', '智能AI音响，支持语音控制', 15, 4, 'evening'),
+    ('智能摄像头', '1080P智能安防摄像头，支持夜视和移动侦测', 8, 24, 'allday'),
+    ('智能门锁', '指纹+密码智能门锁', 3, 0.5, 'morning_evening'),
+    ('智能插座', '16A智能插座，支持远程控制和定时开关', 2, 24, 'allday'),
+    ('智能窗帘', '电动智能窗帘，支持手机和语音控制', 45, 0.5, 'morning_evening'),
+    ('智能冰箱300L', '300升变频智能冰箱，一级能效', 150, 8, 'allday'),
+    ('滚筒洗衣机8KG', '8公斤滚筒洗衣机，变频电机', 500, 1.5, 'daytime'),
+    ('55寸智能电视', '55寸4K智能液晶电视', 120, 6, 'evening'),
+    ('65寸智能电视', '65寸4K智能液晶电视', 200, 6, 'evening'),
+    ('变频空调1匹', '1匹变频空调，适合12平米房间', 600, 8, 'cooling'),
+    ('变频空调2匹', '2匹变频空调，适合28平米房间', 1200, 8, 'cooling'),
+    ('波轮洗衣机7KG', '7公斤波轮洗衣机', 350, 1, 'daytime'),
+    ('智能冰箱500L', '500升对开门智能冰箱', 180, 8, 'allday'),
+    ('43寸智能电视', '43寸智能液晶电视', 75, 6, 'evening'),
+    ('智能热水器60L', '60升电热水器，智能预约加热', 2000, 2, 'morning_evening'),
+    ('智能电饭煲', '5L智能电饭煲，IH加热', 1200, 1, 'meals'),
+    ('智能加湿器', '超声波加湿器，静音运行', 25, 8, 'night'),
+    ('智能扫地机器人', '激光导航扫地机器人', 30, 1.5, 'daytime'),
+]
+
+ROOMS = ['客厅', '主卧', '次卧', '厨房', '卫生间', '书房', '阳台', '门厅']
+BRANDS = ['小米', '格力', '美的', '海尔', '华为', '飞利浦', '海康威视', '松下']
+OPERATION_TYPES = (['开机', '调节', '定时', '远程控制', '语音控制'], [0.45, 0.2, 0.15, 0.12, 0.08])
+SECURITY_EVENT_TYPES = ['移动检测', '门锁异常', '设备离线', '设备故障', '夜视激活', '烟雾报警', '入侵警报']
+SECURITY_EVENT_WEIGHTS = [0.35, 0.15, 0.2, 0.12, 0.12, 0.03, 0.03]
+SEVERITY_LEVELS = (['低', '中', '高'], [0.7, 0.24, 0.06])
+FEEDBACK_TYPES = ['功能建议', '使用体验', 'Bug报告', '性能问题', '界面优化']
+FEEDBACK_CONTENT = {
+    '功能建议': '希望能增加更多场景模式，一键控制多个设备',
+    '使用体验': '设备联动很方便，整体使用体验不错',
+    'Bug报告': '设备偶尔离线，需要重新配网',
+    '性能问题': 'APP 打开设备列表有时比较慢',
+    '界面优化': '手机APP界面可以更简洁一些，功能分类不够清晰',
+}
+
+TABLES = {
+    'users': database.User.__table__,
+    'devices': database.Device.__table__,
+    'usage_records': database.UsageRecord.__table__,
+    'security_events': database.SecurityEvent.__table__,
+    'user_feedbacks': database.UserFeedback.__table__,
+    'energy_statistics': database.EnergyStatistic.__table__,
+}
+
+
+def _format_times(seconds: np.ndarray, epoch: np.datetime64) -> np.ndarray:
+    """秒偏移 -> 'YYYY-MM-DD HH:MM:SS' 字符串（MySQL 与 SQLite 都能直接解析）"""
+    stamps = np.datetime_as_string(epoch + seconds.astype('timedelta64[s]'), unit='s')
+    return np.char.replace(stamps, 'T', ' ')
+
+
+def _with_nulls(values: np.ndarray, null_mask: np.ndarray) -> np.ndarray:
+    column = values.astype(object)
+    column[null_mask] = None
+    return column
+
+
+class DataGenerator:
+    """按用户分块生成各表数据，每块产出 {表名: (列名, 列数组)}"""
+
+    def __init__(self, records_per_user: int = 1000, days: int = 365, start_date: str = '2024-01-01',
+                 seed: int = 42, type_ids=None):
+        self.records_per_user = records_per_user
+        self.days = days
+        self.epoch = np.datetime64(start_date, 's')
+        self.rng = np.random.default_rng(seed)
+        self.type_ids = np.asarray(type_ids if type_ids is not None else range(1, len(DEVICE_CATALOG) + 1))
+        self.type_power = np.array([item[2] for item in DEVICE_CATALOG])
+        self.type_hours = np.array([item[3] for item in DEVICE_CATALOG])
+        profile_names = list(HOUR_PROFILES)
+        self.type_profile = np.array([profile_names.index(item[4]) for item in DEVICE_CATALOG])
+        self.profile_weights = [np.array(HOUR_PROFILES[name], dtype=float) / sum(HOUR_PROFILES[name])
+                                for name in profile_names]
+
+    def chunk(self, first_user_id: int, n_users: int, first_device_id: int, first_record_id: int,
+              first_event_id: int, first_feedback_id: int, first_stat_id: int):
+        rng = self.rng
+        span = self.days * 86400
+
+        # 用户
+        user_ids = np.arange(first_user_id, first_user_id + n_users)
+        house_area = np.clip(rng.lognormal(np.log(90), 0.4, n_users), 30, 400).round(1)
+        created = rng.integers(-2 * 365 * 86400, 0, n_users)
+        users = {
+            'user_id': user_ids,
+            'username': np.char.add('user', user_ids.astype(str)),
+            'email': np.char.add(np.char.add('user', user_ids.astype(str)), '@example.com'),
+            'phone': np.char.add('138', np.char.zfill(rng.integers(0, 10 ** 8, n_users).astype(str), 8)),
+            'house_area': house_area,
+            'created_at': _format_times(created, self.epoch),
+            'updated_at': _format_times(created + rng.integers(0, 180 * 86400, n_users), self.epoch),
+        }
+
+        # 设备：面积越大设备越多
+        device_counts = np.clip(3 + rng.poisson(house_area / 15), 3, 40)
+        n_devices = int(device_counts.sum())
+        device_ids = np.arange(first_device_id, first_device_id + n_devices)
+        device_user = np.repeat(user_ids, device_counts)
+        device_type = rng.integers(0, len(DEVICE_CATALOG), n_devices)
+        device_power = (self.type_power[device_type] * rng.uniform(0.9, 1.15, n_devices)).round(1)
+        room = rng.integers(0, len(ROOMS), n_devices)
+        catalog_names = np.array([item[0] for item in DEVICE_CATALOG])
+        installed = rng.integers(-2 * 365 * 86400, 0, n_devices)
+        devices = {
+            'device_id': device_ids,
+            'device_name': np.char.add(np.array(ROOMS)[room], catalog_names[device_type]),
+            'device_type_id': self.type_ids[device_type],
+            'user_id': device_user,
+            'room_location': np.array(ROOMS)[room],
+            'status': rng.random(n_devices) < 0.9,
+            'actual_power_consumption': device_power,
+            'installation_date': _format_times(installed, self.epoch),
+            'brand': np.array(BRANDS)[rng.integers(0, len(BRANDS), n_devices)],
+        }
+
+        # 使用记录：先定每户条数，再按设备权重分给该户的设备
+        record_counts = rng.poisson(self.records_per_user, n_users)
+        n_records = int(record_counts.sum())
+        record_user_index = np.repeat(np.arange(n_users), record_counts)
+        weights = rng.gamma(1.0, 1.0, n_devices) * np.sqrt(self.type_hours[device_type] + 0.5)
+        device_user_index = np.repeat(np.arange(n_users), device_counts)
+        user_weight_total = np.bincount(device_user_index, weights=weights, minlength=n_users)
+        # 每户设备的累计权重落在 [户序号, 户序号 + 1] 区间内，一次 searchsorted 完成按户加权抽样；
+        # 减去每户起点的累计值，使各户从自己的序号重新累加，全局 cumsum 的浮点误差不会逐户累积
+        normalized = weights / user_weight_total[device_user_index]
+        cumulative = np.cumsum(normalized)
+        user_starts = np.concatenate(([0.0], cumulative))[np.cumsum(device_counts) - device_counts]
+        cumulative = cumulative - np.repeat(user_starts - np.arange(n_users), device_counts)
+        record_device = np.searchsorted(cumulative, record_user_index + rng.random(n_records))
+        record_device = np.minimum(record_device, np.repeat(np.cumsum(device_counts) - 1, record_counts))
+        record_type = device_type[record_device]
+
+        hours = np.empty(n_records, dtype=np.int64)
+        record_profile = self.type_profile[record_type]
+        for profile, weights_by_hour in enumerate(self.profile_weights):
+            mask = record_profile == profile
+            hours[mask] = rng.choice(24, size=int(mask.sum()), p=weights_by_hour)
+        start = rng.integers(0, self.days, n_records) * 86400 + hours * 3600 + rng.integers(0, 3600, n_records)
+        median_minutes = np.clip(self.type_hours[record_type] * 30, 5, 600)
+        duration = np.clip(rng.lognormal(np.log(median_minutes), 0.6), 1, 1440).astype(np.int64)
+        open_session = rng.random(n_records) < 0.03
+        energy = (device_power[record_device] * duration / 60 / 1000).round(4)
+        order = np.argsort(start, kind='stable')
+        start, duration, open_session, energy = start[order], duration[order], open_session[order], energy[order]
+        record_device, record_user_index = record_device[order], record_user_index[order]
+        operations = np.array(OPERATION_TYPES[0])[rng.choice(len(OPERATION_TYPES[0]), n_records, p=OPERATION_TYPES[1])]
+        usage_records = {
+            'record_id': np.arange(first_record_id, first_record_id + n_records),
+            'user_id': user_ids[record_user_index],
+            'device_id': device_ids[record_device],
+            'start_time': _format_times(start, self.epoch),
+            'end_time': _with_nulls(_format_times(start + duration * 60, self.epoch), open_session),
+            'duration_minutes': _with_nulls(duration, open_session),
+            'energy_consumed': np.where(open_session, 0.0, energy),
+            'operation_type': operations,
+        }
+
+        # 能耗统计：已结束会话按 (设备, 日期) 汇总，各列口径与 energy_stats._aggregate 一致，
+        # 之后删除使用记录重算设备日时得到相同的值
+        closed = ~open_session
+        day = start[closed] // 86400
+        keys, inverse = np.unique(record_device[closed] * self.days + day, return_inverse=True)
+        stat_device, stat_day = keys // self.days, keys % self.days
+        consumption = np.bincount(inverse, weights=energy[closed], minlength=len(keys))
+        stat_minutes = np.bincount(inverse, weights=duration[closed], minlength=len(keys)).astype(np.int64)
+        peak_power = np.zeros(len(keys))
+        np.maximum.at(peak_power, inverse, energy[closed] * 60000.0 / duration[closed])
+        daily_stats = {
+            'stat_id': np.arange(first_stat_id, first_stat_id + len(keys)),
+            'user_id': device_user[stat_device],
+            'device_id': device_ids[stat_device],
+            'stat_date': np.datetime_as_string(self.epoch.astype('datetime64[D]') + stat_day, unit='D'),
+            'daily_consumption': consumption,
+            'peak_power': peak_power,
+            'avg_power': consumption * 60000.0 / stat_minutes,
+            'usage_duration': stat_minutes,
+            # 与 SQL ROUND 一样四舍五入（np.round 对 .5 取偶）
+            'cost': np.floor(consumption * ENERGY_STATS_CONFIG['price_per_kwh'] * 100 + 0.5) / 100,
+        }
+
+        # 安防事件：夜间偏多，约 85% 已处理
+        event_counts = rng.poisson(20, n_users)
+        n_events = int(event_counts.sum())
+        event_user_index = np.repeat(np.arange(n_users), event_counts)
+        first_device = np.cumsum(device_counts) - device_counts
+        event_device = first_device[event_user_index] + (rng.random(n_events) * device_counts[event_user_index]).astype(np.int64)
+        occurred = (rng.integers(0, self.days, n_events) * 86400
+                    + rng.choice(24, n_events, p=self.profile_weights[list(HOUR_PROFILES).index('night')]) * 3600
+                    + rng.integers(0, 3600, n_events))
+        resolved = rng.random(n_events) < 0.85
+        event_type = rng.choice(len(SECURITY_EVENT_TYPES), n_events, p=SECURITY_EVENT_WEIGHTS)
+        security_events = {
+            'event_id': np.arange(first_event_id, first_event_id + n_events),
+            'user_id': user_ids[event_user_index],
+            'device_id': _with_nulls(device_ids[event_device], rng.random(n_events) < 0.1),
+            'event_type': np.array(SECURITY_EVENT_TYPES)[event_type],
+            'severity_level': np.array(SEVERITY_LEVELS[0])[rng.choice(3, n_events, p=SEVERITY_LEVELS[1])],
+            'description': np.char.add(np.array(ROOMS)[room[event_device]], np.array(SECURITY_EVENT_TYPES)[event_type]),
+            'occurred_at': _format_times(occurred, self.epoch),
+            'resolved_at': _with_nulls(
+                _format_times(occurred + rng.exponential(1800, n_events).astype(np.int64) + 60, self.epoch), ~resolved
+            ),
+            'is_resolved': resolved,
+        }
+
+        # 用户反馈
+        feedback_counts = rng.poisson(1.0, n_users)
+        n_feedbacks = int(feedback_counts.sum())
+        feedback_type = np.array(FEEDBACK_TYPES)[rng.integers(0, len(FEEDBACK_TYPES), n_feedbacks)]
+        user_feedbacks = {
+            'feedback_id': np.arange(first_feedback_id, first_feedback_id + n_feedbacks),
+            'user_id': np.repeat(user_ids, feedback_counts),
+            'feedback_type': feedback_type,
+            'rating': rng.choice(np.arange(1, 6), n_feedbacks, p=[0.05, 0.1, 0.2, 0.35, 0.3]),
+            'content': np.array([FEEDBACK_CONTENT[name] for name in feedback_type], dtype=object),
+            'submitted_at': _format_times(rng.integers(0, span, n_feedbacks), self.epoch),
+            'is_processed': rng.random(n_feedbacks) < 0.7,
+        }
+
+        return {
+            'users': users,
+            'devices': devices,
+            'usage_records': usage_records,
+            'security_events': security_events,
+            'user_feedbacks': user_feedbacks,
+            'energy_statistics': daily_stats,
+        }
+
+
+def _rows(columns: dict, start: int, stop: int):
+    """列数组切片 -> 行元组列表"""
+    return list(zip(*(values[start:stop].tolist() for values in columns.values())))
+
+
+class DatabaseWriter:
+    """通过 DB-API executemany 写入（PyMySQL 会把 INSERT ... VALUES 改写为多行 INSERT）"""
+
+    def __init__(self, engine, batch_size: int = 5000):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.placeholder = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+        self.is_mysql = engine.dialect.name == 'mysql'
+
+    def prepare(self, truncate: bool = False):
+        database.Base.metadata.create_all(bind=self.engine)
+        if truncate:
+            with self.engine.begin() as connection:
+                for name in reversed(list(TABLES)):
+                    connection.execute(TABLES[name].delete())
+        with Session(self.engine) as db:
+            if truncate:
+                energy_stats.set_watermark(db, 0)
+                db.commit()
+            # 能耗统计已物化到最新时，生成的统计与新记录一致，结束后可直接推进水位线
+            max_record_id = db.query(func.max(database.UsageRecord.record_id)).scalar() or 0
+            self.energy_stats_current = energy_stats.get_watermark(db) >= max_record_id
+        return self._ensure_device_types()
+
+    def _ensure_device_types(self):
+        """补齐设备类型目录，返回与 DEVICE_CATALOG 对应的 type_id"""
+        table = database.DeviceType.__table__
+        with self.engine.begin() as connection:
+            existing = dict(connection.execute(select(table.c.type_name, table.c.type_id)).all())
+            missing = [
+                {'type_name': name, 'description': description, 'avg_power_consumption': power,
+                 'avg_daily_usage_hours': hours}
+                for name, description, power, hours, _ in DEVICE_CATALOG if name not in existing
+            ]
+            if missing:
+                connection.execute(table.insert(), missing)
+                existing = dict(connection.execute(select(table.c.type_name, table.c.type_id)).all())
+        return [existing[item[0]] for item in DEVICE_CATALOG]
+
+    def next_ids(self):
+        with self.engine.connect() as connection:
+            return {
+                name: (connection.execute(select(func.max(list(table.primary_key.columns)[0]))).scalar() or 0) + 1
+                for name, table in TABLES.items()
+            }
+
+    def finish(self):
+        if not self.energy_stats_current:
+            return
+        with Session(self.engine) as db:
+            energy_stats.set_watermark(db, db.query(func.max(database.UsageRecord.record_id)).scalar() or 0)
+            db.commit()
+
+    def write(self, chunk: dict):
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            if self.is_mysql:
+                # 数据本身满足外键和唯一约束，装载期间跳过逐行检查
+                cursor.execute('SET foreign_key_checks = 0, unique_checks = 0')
+            for name, columns in chunk.items():
+                sql = (f"INSERT INTO {name} ({', '.join(columns)}) "
+                       f"VALUES ({', '.join([self.placeholder] * len(columns))})")
+                total = len(next(iter(columns.values())))
+                for start in range(0, total, self.batch_size):
+                    cursor.executemany(sql, _rows(columns, start, start + self.batch_size))
+            raw.commit()
+        finally:
+            if self.is_mysql:
+                # 出错时也要恢复约束检查：连接归还连接池时只会回滚，不会重置会话变量
+                try:
+                    raw.cursor().execute('SET foreign_key_checks = 1, unique_checks = 1')
+                except Exception:
+                    raw.invalidate()
+            raw.close()
+
+
+class FileWriter:
+    """写出 LOAD DATA 可直接装载的 TSV 文件（NULL 写作 \\N）和 load.sql"""
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.columns = {}
+
+    def prepare(self, truncate: bool = False):
+        for name in list(TABLES) + ['device_types']:
+            path = os.path.join(self.out_dir, f'{name}.tsv')
+            if os.path.exists(path):
+                os.remove(path)
+        types = {
+            'type_id': np.arange(1, len(DEVICE_CATALOG) + 1),
+            'type_name': np.array([item[0] for item in DEVICE_CATALOG]),
+            'description': np.array([item[1] for item in DEVICE_CATALOG]),
+            'avg_power_consumption': np.array([item[2] for item in DEVICE_CATALOG]),
+            'avg_daily_usage_hours': np.array([item[3] for item in DEVICE_CATALOG], dtype=float),
+        }
+        self._append('device_types', types)
+        return list(types['type_id'])
+
+    def next_ids(self):
+        return {name: 1 for name in TABLES}
+
+    def _append(self, name: str, columns: dict):
+        self.columns.setdefault(name, list(columns))
+        total = len(next(iter(columns.values())))
+        with open(os.path.join(self.out_dir, f'{name}.tsv'), 'a', encoding='utf-8') as f:
+            for start in range(0, total, 100000):
+                rows = _rows(columns, start, start + 100000)
+                f.writelines(
+                    '\t'.join('\\N' if value is None else str(int(value)) if isinstance(value, bool) else str(value)
+                              for value in row) + '\n'
+                    for row in rows
+                )
+
+    def write(self, chunk: dict):
+        for name, columns in chunk.items():
+            self._append(name, columns)
+
+    def finish(self):
+        order = ['device_types'] + list(TABLES)
+        with open(os.path.join(self.out_dir, 'load.sql'), 'w', encoding='utf-8') as f:
+            f.write('SET foreign_key_checks = 0;\nSET unique_checks = 0;\n')
+            for name in order:
+                path = os.path.abspath(os.path.join(self.out_dir, f'{name}.tsv')).replace('\\', '/')
+                f.write(f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {name} CHARACTER SET utf8mb4 "
+                        f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join(self.columns[name])});\n")
+            f.write('SET unique_checks = 1;\nSET foreign_key_checks = 1;\n')
+
+
+def generate(writer, scale_factor: float = 1.0, records_per_user: int = 1000, days: int = 365,
+             start_date: str = '2024-01-01', seed: int = 42, chunk_users: int = 2000,
+             truncate: bool = False, verbose: bool = True) -> dict:
+    """按规模因子生成全部数据，返回各表写入行数"""
+    type_ids = writer.prepare(truncate)
+    ids = writer.next_ids()
+    generator = DataGenerator(records_per_user, days, start_date, seed, type_ids)
+    total_users = max(int(round(scale_factor * USERS_PER_SCALE)), 1)
+    counts = {name: 0 for name in TABLES}
+    started = time.perf_counter()
+
+    for offset in range(0, total_users, chunk_users):
+        n_users = min(chunk_users, total_users - offset)
+        chunk = generator.chunk(
+            ids['users'], n_users, ids['devices'], ids['usage_records'],
+            ids['security_events'], ids['user_feedbacks'], ids['energy_statistics']
+        )
+        writer.write(chunk)
+        for name, columns in chunk.items():
+            rows = len(next(iter(columns.values())))
+            counts[name] += rows
+            ids[name] += rows
+        if verbose:
+            elapsed = time.perf_counter() - started
+            print(f"已生成 {offset + n_users}/{total_users} 个用户，"
+                  f"{counts['usage_records']} 条使用记录，用时 {elapsed:.1f} 秒")
+
+    if hasattr(writer, 'finish'):
+        writer.finish()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按规模因子生成智能家居合成数据')
+    parser.add_argument('--scale-factor', type=float, default=1.0,
+                        help=f'规模因子，1 约为 {USERS_PER_SCALE} 个用户 (默认: 1)')
+    parser.add_argument('--records-per-user', type=int, default=1000, help='每户平均使用记录数 (默认: 1000)')
+    parser.add_argument('--days', type=int, default=365, help='数据覆盖的天数 (默认: 365)')
+    parser.add_argument('--start-date', default='2024-01-01', help='数据起始日期 (默认: 2024-01-01)')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子 (默认: 42)')
+    parser.add_argument('--chunk-users', type=int, default=2000, help='每块生成的用户数 (默认: 2000)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='每次多行 INSERT 的行数 (默认: 5000)')
+    parser.add_argument('--output', choices=['db', 'files'], default='db',
+                        help='db: 直接写入数据库; files: 生成 TSV 和 LOAD DATA 脚本 (默认: db)')
+    parser.add_argument('--out-dir', default='seed_data', help='files 模式的输出目录 (默认: seed_data)')
+    parser.add_argument('--truncate', action='store_true', help='db 模式下先清空要生成的表')
+    args = parser.parse_args()
+
+    if args.output == 'files':
+        writer = FileWriter(args.out_dir)
+    else:
+        writer = DatabaseWriter(database.engine, args.batch_size)
+
+    started = time.perf_counter()
+    counts = generate(writer, args.scale_factor, args.records_per_user, args.days, args.start_date,
+                      args.seed, args.chunk_users, args.truncate)
+    print(f"\n生成完成，用时 {time.perf_counter() - started:.1f} 秒")
+    for name, rows in counts.items():
+        print(f"  {name}: {rows} 行")
+    if args.output == 'files':
+        print(f"\n装载: mysql --local-infile=1 {database.DATABASE_CONFIG['database']} < {args.out_dir}/load.sql")
+
+
+if __name__ == "__main__":
+    main()
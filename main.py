@@ -1,12 +1,29 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from typing import List, Optional
+from datetime import date, datetime
+import asyncio
+import contextvars
+import json
+import logging
 import uvicorn
 
 import database
 import models
 import crud
+import crud_async
+import export
+import pagination
+import db_pool
+import metrics
+import purge
 from analytics import SmartHomeAnalytics
+from cache import analytics_cache
+from config import BULK_INGEST_CONFIG, ASYNC_DB_CONFIG, SCHEMA_CONFIG
+from crud_async import DBSession
+
+logger = logging.getLogger(__name__)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -15,81 +32,139 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 请求指标：按路由模板统计耗时、数据库耗时和序列化耗时，由 GET /metrics 输出
+app.router.route_class = metrics.TimedRoute
+app.add_middleware(metrics.MetricsMiddleware)
+
+# 正在执行的删除任务 future，保留引用以便记录异常
+purge_futures: set = set()
+
+def _purge_done(future: asyncio.Future):
+    """删除任务结束时移除引用，失败时记录异常"""
+    purge_futures.discard(future)
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("执行删除任务失败", exc_info=error)
+
+def _start_purge(fn, *args) -> asyncio.Future:
+    """在线程池中用空的 contextvars 上下文执行删除任务，不计入发起请求的指标和查询统计"""
+    future = asyncio.get_running_loop().run_in_executor(None, contextvars.Context().run, fn, *args)
+    purge_futures.add(future)
+    future.add_done_callback(_purge_done)
+    return future
+
 # 初始化数据库
 @app.on_event("startup")
 async def startup_event():
-    """应用启动时初始化数据库"""
-    database.init_database()
-
-def get_db():
-    db = database.SessionLocal()
+    """应用启动时检查表结构，与模型一致时跳过建表"""
+    database.ensure_schema(SCHEMA_CONFIG['startup_mode'])
+    # 在后台继续上次退出前未完成的级联删除任务
+    _start_purge(purge.resume)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放异步连接池"""
+    await database.dispose_async_engine()
+
+# 启用异步数据库时路由拿到 AsyncSession，否则拿到同步 Session，
+# 两种会话都通过 crud_async 访问数据库
+if ASYNC_DB_CONFIG['enabled']:
+    get_db = database.get_async_db
+else:
+    def get_db():
+        db = database.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+def export_response(stmt, fmt: str, filename: str) -> StreamingResponse:
+    """把导出查询包装成流式响应"""
+    return StreamingResponse(
+        export.stream_export(stmt, fmt),
+        media_type=export.EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
+
+async def paginate(response: Response, fetch, keys, db: DBSession, skip: int, limit: int, cursor: Optional[str]):
+    """执行列表查询，取满一页时在 X-Next-Cursor 响应头返回下一页游标"""
     try:
-        yield db
-    finally:
-        db.close()
+        items = await fetch(db, skip=skip, limit=limit, cursor=cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    next_cursor = pagination.next_cursor(items, keys, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+EXPORT_FORMAT = Query('ndjson', alias='format', pattern='^(ndjson|csv)$')
 
 # ==================== 用户管理 API ====================
 
 @app.post("/users/", response_model=models.UserResponse, tags=["用户管理"])
-def create_user(user: models.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: models.UserCreate, db: DBSession = Depends(get_db)):
     """创建新用户"""
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await crud_async.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="用户名已存在")
-    return crud.create_user(db=db, user=user)
+    return await crud_async.create_user(db=db, user=user)
 
 @app.get("/users/", response_model=List[models.UserResponse], tags=["用户管理"])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """获取用户列表"""
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+async def read_users(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                     db: DBSession = Depends(get_db)):
+    """获取用户列表（传入上一页的 X-Next-Cursor 作为 cursor 翻页）"""
+    return await paginate(response, crud_async.get_users, crud.USER_PAGE_KEYS, db, skip, limit, cursor)
 
 @app.get("/users/{user_id}", response_model=models.UserResponse, tags=["用户管理"])
-def read_user(user_id: int, db: Session = Depends(get_db)):
+async def read_user(user_id: int, db: DBSession = Depends(get_db)):
     """获取指定用户信息"""
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = await crud_async.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="用户不存在")
     return db_user
 
 @app.put("/users/{user_id}", response_model=models.UserResponse, tags=["用户管理"])
-def update_user(user_id: int, user_update: models.UserUpdate, db: Session = Depends(get_db)):
+async def update_user(user_id: int, user_update: models.UserUpdate, db: DBSession = Depends(get_db)):
     """更新用户信息"""
-    db_user = crud.update_user(db, user_id=user_id, user_update=user_update)
+    db_user = await crud_async.update_user(db, user_id=user_id, user_update=user_update)
     if db_user is None:
         raise HTTPException(status_code=404, detail="用户不存在")
     return db_user
 
-@app.delete("/users/{user_id}", tags=["用户管理"])
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    """删除用户"""
-    db_user = crud.delete_user(db, user_id=user_id)
-    if db_user is None:
+@app.delete("/users/{user_id}", response_model=models.PurgeJobResponse, status_code=202, tags=["用户管理"])
+async def delete_user(user_id: int, response: Response, db: DBSession = Depends(get_db)):
+    """删除用户：用户立即不可见，关联数据在后台分批删除，通过返回的任务查询进度"""
+    job = await crud_async.delete_user(db, user_id=user_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="用户不存在")
-    return {"message": "用户删除成功"}
+    _start_purge(purge.run, job.job_id)
+    response.headers["Location"] = f"/purge-jobs/{job.job_id}"
+    return job
 
 # ==================== 设备类型管理 API ====================
 
 @app.post("/device-types/", response_model=models.DeviceTypeResponse, tags=["设备类型管理"])
-def create_device_type(device_type: models.DeviceTypeCreate, db: Session = Depends(get_db)):
+async def create_device_type(device_type: models.DeviceTypeCreate, db: DBSession = Depends(get_db)):
     """创建设备类型"""
-    return crud.create_device_type(db=db, device_type=device_type)
+    return await crud_async.create_device_type(db=db, device_type=device_type)
 
 @app.get("/device-types/", response_model=List[models.DeviceTypeResponse], tags=["设备类型管理"])
-def read_device_types(db: Session = Depends(get_db)):
+async def read_device_types(db: DBSession = Depends(get_db)):
     """获取所有设备类型"""
-    return crud.get_device_types(db)
+    return await crud_async.get_device_types(db)
 
 @app.delete("/device-types/{type_id}", tags=["设备类型管理"])
-def delete_device_type(type_id: int, db: Session = Depends(get_db)):
+async def delete_device_type(type_id: int, db: DBSession = Depends(get_db)):
     """删除设备类型"""
     # 先检查设备类型是否存在
-    device_type = crud.get_device_type(db, type_id)
+    device_type = await crud_async.get_device_type(db, type_id)
     if not device_type:
         raise HTTPException(status_code=404, detail="设备类型不存在")
     
     # 尝试删除
-    db_device_type = crud.delete_device_type(db, type_id=type_id)
+    db_device_type = await crud_async.delete_device_type(db, type_id=type_id)
     if db_device_type is None:
         raise HTTPException(status_code=400, detail="无法删除：该设备类型正被设备使用")
     return {"message": "设备类型删除成功"}
@@ -97,81 +172,159 @@ def delete_device_type(type_id: int, db: Session = Depends(get_db)):
 # ==================== 设备管理 API ====================
 
 @app.post("/devices/", response_model=models.DeviceResponse, tags=["设备管理"])
-def create_device(device: models.DeviceCreate, db: Session = Depends(get_db)):
+async def create_device(device: models.DeviceCreate, db: DBSession = Depends(get_db)):
     """创建新设备"""
     # 验证用户存在
-    user = crud.get_user(db, device.user_id)
+    user = await crud_async.get_user(db, device.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
     # 验证设备类型存在
-    device_type = crud.get_device_type(db, device.device_type_id)
+    device_type = await crud_async.get_device_type(db, device.device_type_id)
     if not device_type:
         raise HTTPException(status_code=404, detail="设备类型不存在")
     
-    return crud.create_device(db=db, device=device)
+    return await crud_async.create_device(db=db, device=device)
 
 @app.get("/devices/", response_model=List[models.DeviceResponse], tags=["设备管理"])
-def read_devices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """获取设备列表"""
-    devices = crud.get_devices(db, skip=skip, limit=limit)
-    return devices
+async def read_devices(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                       db: DBSession = Depends(get_db)):
+    """获取设备列表（传入上一页的 X-Next-Cursor 作为 cursor 翻页）"""
+    return await paginate(response, crud_async.get_devices, crud.DEVICE_PAGE_KEYS, db, skip, limit, cursor)
 
 @app.get("/devices/{device_id}", response_model=models.DeviceResponse, tags=["设备管理"])
-def read_device(device_id: int, db: Session = Depends(get_db)):
+async def read_device(device_id: int, db: DBSession = Depends(get_db)):
     """获取指定设备信息"""
-    db_device = crud.get_device(db, device_id=device_id)
+    db_device = await crud_async.get_device(db, device_id=device_id)
     if db_device is None:
         raise HTTPException(status_code=404, detail="设备不存在")
     return db_device
 
 @app.get("/users/{user_id}/devices", response_model=List[models.DeviceResponse], tags=["设备管理"])
-def read_user_devices(user_id: int, db: Session = Depends(get_db)):
+async def read_user_devices(user_id: int, db: DBSession = Depends(get_db)):
     """获取用户的所有设备"""
-    return crud.get_user_devices(db, user_id=user_id)
+    return await crud_async.get_user_devices(db, user_id=user_id)
 
 @app.put("/devices/{device_id}", response_model=models.DeviceResponse, tags=["设备管理"])
-def update_device(device_id: int, device_update: models.DeviceUpdate, db: Session = Depends(get_db)):
+async def update_device(device_id: int, device_update: models.DeviceUpdate, db: DBSession = Depends(get_db)):
     """更新设备信息"""
-    db_device = crud.update_device(db, device_id=device_id, device_update=device_update)
+    db_device = await crud_async.update_device(db, device_id=device_id, device_update=device_update)
     if db_device is None:
         raise HTTPException(status_code=404, detail="设备不存在")
     return db_device
 
-@app.delete("/devices/{device_id}", tags=["设备管理"])
-def delete_device(device_id: int, db: Session = Depends(get_db)):
-    """删除设备"""
-    db_device = crud.delete_device(db, device_id=device_id)
-    if db_device is None:
+@app.delete("/devices/{device_id}", response_model=models.PurgeJobResponse, status_code=202, tags=["设备管理"])
+async def delete_device(device_id: int, response: Response, db: DBSession = Depends(get_db)):
+    """删除设备：设备立即不可见，关联数据在后台分批删除，通过返回的任务查询进度"""
+    job = await crud_async.delete_device(db, device_id=device_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="设备不存在")
-    return {"message": "设备删除成功"}
+    _start_purge(purge.run, job.job_id)
+    response.headers["Location"] = f"/purge-jobs/{job.job_id}"
+    return job
+
+@app.get("/purge-jobs/{job_id}", response_model=models.PurgeJobResponse, tags=["删除任务"])
+async def read_purge_job(job_id: int, db: DBSession = Depends(get_db)):
+    """查询用户/设备级联删除任务的进度"""
+    job = await crud_async.get_purge_job(db, job_id=job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="删除任务不存在")
+    return job
 
 # ==================== 使用记录管理 API ====================
 
 @app.post("/usage-records/", response_model=models.UsageRecordResponse, tags=["使用记录管理"])
-def create_usage_record(usage_record: models.UsageRecordCreate, db: Session = Depends(get_db)):
+async def create_usage_record(usage_record: models.UsageRecordCreate, db: DBSession = Depends(get_db)):
     """创建使用记录"""
-    return crud.create_usage_record(db=db, usage_record=usage_record)
+    db_record = await crud_async.create_usage_record(db=db, usage_record=usage_record)
+    if db_record is None:
+        raise HTTPException(status_code=404, detail="用户或设备不存在")
+    return db_record
+
+def _parse_bulk_body(body: bytes, content_type: str) -> list:
+    """解析批量请求体：NDJSON 逐行解析（坏行记为 ValueError），否则按 JSON 数组解析"""
+    if 'ndjson' in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ValueError(f"JSON 解析失败: {e}"))
+        return items
+    
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="请求体必须是 JSON 数组")
+    return items
+
+@app.post("/usage-records/bulk", response_model=models.UsageRecordBulkResult, tags=["使用记录管理"])
+async def create_usage_records_bulk(request: Request, db: DBSession = Depends(get_db)):
+    """批量创建使用记录（JSON 数组，或 Content-Type 为 application/x-ndjson 的逐行 JSON）"""
+    items = _parse_bulk_body(await request.body(), request.headers.get('content-type', ''))
+    if len(items) > BULK_INGEST_CONFIG['max_rows']:
+        raise HTTPException(status_code=413, detail=f"单次最多提交 {BULK_INGEST_CONFIG['max_rows']} 条记录")
+    
+    # 逐行校验，校验失败的行不影响其余行写入
+    records, positions, errors = [], [], []
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            errors.append(models.BulkRowError(index=index, detail=str(item)))
+            continue
+        if not isinstance(item, dict):
+            errors.append(models.BulkRowError(index=index, detail="每条记录必须是 JSON 对象"))
+            continue
+        try:
+            records.append(models.UsageRecordCreate(**item))
+            positions.append(index)
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors())
+            errors.append(models.BulkRowError(index=index, detail=detail))
+    
+    inserted, row_errors = await crud_async.create_usage_records_bulk(
+        db, records, BULK_INGEST_CONFIG['batch_size']
+    )
+    errors.extend(models.BulkRowError(index=positions[i], detail=detail) for i, detail in row_errors)
+    errors.sort(key=lambda error: error.index)
+    return models.UsageRecordBulkResult(inserted=inserted, failed=len(errors), errors=errors)
 
 @app.get("/usage-records/", response_model=List[models.UsageRecordResponse], tags=["使用记录管理"])
-def read_usage_records(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """获取使用记录列表"""
-    return crud.get_usage_records(db, skip=skip, limit=limit)
+async def read_usage_records(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                             db: DBSession = Depends(get_db)):
+    """获取使用记录列表（按开始时间排序，传入上一页的 X-Next-Cursor 作为 cursor 翻页）"""
+    return await paginate(response, crud_async.get_usage_records, crud.USAGE_RECORD_PAGE_KEYS, db, skip, limit, cursor)
+
+@app.get("/usage-records/export", tags=["使用记录管理"])
+def export_usage_records(user_id: Optional[int] = None, device_id: Optional[int] = None,
+                         since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         operation_type: Optional[str] = None, fmt: str = EXPORT_FORMAT):
+    """流式导出使用记录（NDJSON 或 CSV，可按用户/设备、时间范围和操作类型筛选）"""
+    stmt = crud.select_usage_records(user_id=user_id, device_id=device_id, since=since, until=until,
+                                     operation_type=operation_type)
+    return export_response(stmt, fmt, "usage_records")
 
 @app.get("/users/{user_id}/usage-records", response_model=List[models.UsageRecordResponse], tags=["使用记录管理"])
-def read_user_usage_records(user_id: int, db: Session = Depends(get_db)):
-    """获取用户的使用记录"""
-    return crud.get_user_usage_records(db, user_id=user_id)
+async def read_user_usage_records(user_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                  operation_type: Optional[str] = None, db: DBSession = Depends(get_db)):
+    """获取用户的使用记录（可按开始时间 [since, until) 和操作类型筛选）"""
+    return await crud_async.get_user_usage_records(db, user_id=user_id, since=since, until=until,
+                                       operation_type=operation_type)
 
 @app.get("/devices/{device_id}/usage-records", response_model=List[models.UsageRecordResponse], tags=["使用记录管理"])
-def read_device_usage_records(device_id: int, db: Session = Depends(get_db)):
-    """获取设备的使用记录"""
-    return crud.get_device_usage_records(db, device_id=device_id)
+async def read_device_usage_records(device_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                    operation_type: Optional[str] = None, db: DBSession = Depends(get_db)):
+    """获取设备的使用记录（可按开始时间 [since, until) 和操作类型筛选）"""
+    return await crud_async.get_device_usage_records(db, device_id=device_id, since=since, until=until,
+                                         operation_type=operation_type)
 
 @app.delete("/usage-records/{record_id}", tags=["使用记录管理"])
-def delete_usage_record(record_id: int, db: Session = Depends(get_db)):
+async def delete_usage_record(record_id: int, db: DBSession = Depends(get_db)):
     """删除使用记录"""
-    db_record = crud.delete_usage_record(db, record_id=record_id)
+    db_record = await crud_async.delete_usage_record(db, record_id=record_id)
     if db_record is None:
         raise HTTPException(status_code=404, detail="使用记录不存在")
     return {"message": "使用记录删除成功"}
@@ -179,32 +332,48 @@ def delete_usage_record(record_id: int, db: Session = Depends(get_db)):
 # ==================== 安防事件管理 API ====================
 
 @app.post("/security-events/", response_model=models.SecurityEventResponse, tags=["安防事件管理"])
-def create_security_event(security_event: models.SecurityEventCreate, db: Session = Depends(get_db)):
+async def create_security_event(security_event: models.SecurityEventCreate, db: DBSession = Depends(get_db)):
     """创建安防事件"""
-    return crud.create_security_event(db=db, security_event=security_event)
+    db_event = await crud_async.create_security_event(db=db, security_event=security_event)
+    if db_event is None:
+        raise HTTPException(status_code=404, detail="用户或设备不存在")
+    return db_event
 
 @app.get("/security-events/", response_model=List[models.SecurityEventResponse], tags=["安防事件管理"])
-def read_security_events(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """获取安防事件列表"""
-    return crud.get_security_events(db, skip=skip, limit=limit)
+async def read_security_events(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                               db: DBSession = Depends(get_db)):
+    """获取安防事件列表（按发生时间排序，传入上一页的 X-Next-Cursor 作为 cursor 翻页）"""
+    return await paginate(response, crud_async.get_security_events, crud.SECURITY_EVENT_PAGE_KEYS, db, skip, limit, cursor)
+
+@app.get("/security-events/export", tags=["安防事件管理"])
+def export_security_events(user_id: Optional[int] = None, since: Optional[datetime] = None,
+                           until: Optional[datetime] = None, severity_level: Optional[str] = None,
+                           is_resolved: Optional[bool] = None, fmt: str = EXPORT_FORMAT):
+    """流式导出安防事件（NDJSON 或 CSV，可按用户、时间范围、严重程度和处理状态筛选）"""
+    stmt = crud.select_security_events(user_id=user_id, since=since, until=until,
+                                       severity_level=severity_level, is_resolved=is_resolved)
+    return export_response(stmt, fmt, "security_events")
 
 @app.get("/users/{user_id}/security-events", response_model=List[models.SecurityEventResponse], tags=["安防事件管理"])
-def read_user_security_events(user_id: int, db: Session = Depends(get_db)):
-    """获取用户的安防事件"""
-    return crud.get_user_security_events(db, user_id=user_id)
+async def read_user_security_events(user_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                    severity_level: Optional[str] = None, is_resolved: Optional[bool] = None,
+                                    db: DBSession = Depends(get_db)):
+    """获取用户的安防事件（可按发生时间 [since, until)、严重程度和处理状态筛选）"""
+    return await crud_async.get_user_security_events(db, user_id=user_id, since=since, until=until,
+                                         severity_level=severity_level, is_resolved=is_resolved)
 
 @app.put("/security-events/{event_id}", response_model=models.SecurityEventResponse, tags=["安防事件管理"])
-def update_security_event(event_id: int, event_update: models.SecurityEventUpdate, db: Session = Depends(get_db)):
+async def update_security_event(event_id: int, event_update: models.SecurityEventUpdate, db: DBSession = Depends(get_db)):
     """更新安防事件"""
-    db_event = crud.update_security_event(db, event_id=event_id, event_update=event_update)
+    db_event = await crud_async.update_security_event(db, event_id=event_id, event_update=event_update)
     if db_event is None:
         raise HTTPException(status_code=404, detail="安防事件不存在")
     return db_event
 
 @app.delete("/security-events/{event_id}", tags=["安防事件管理"])
-def delete_security_event(event_id: int, db: Session = Depends(get_db)):
+async def delete_security_event(event_id: int, db: DBSession = Depends(get_db)):
     """删除安防事件"""
-    db_event = crud.delete_security_event(db, event_id=event_id)
+    db_event = await crud_async.delete_security_event(db, event_id=event_id)
     if db_event is None:
         raise HTTPException(status_code=404, detail="安防事件不存在")
     return {"message": "安防事件删除成功"}
@@ -212,61 +381,108 @@ def delete_security_event(event_id: int, db: Session = Depends(get_db)):
 # ==================== 用户反馈管理 API ====================
 
 @app.post("/user-feedbacks/", response_model=models.UserFeedbackResponse, tags=["用户反馈管理"])
-def create_user_feedback(feedback: models.UserFeedbackCreate, db: Session = Depends(get_db)):
+async def create_user_feedback(feedback: models.UserFeedbackCreate, db: DBSession = Depends(get_db)):
     """创建用户反馈"""
-    return crud.create_user_feedback(db=db, feedback=feedback)
+    db_feedback = await crud_async.create_user_feedback(db=db, feedback=feedback)
+    if db_feedback is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return db_feedback
 
 @app.get("/user-feedbacks/", response_model=List[models.UserFeedbackResponse], tags=["用户反馈管理"])
-def read_user_feedbacks(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """获取用户反馈列表"""
-    return crud.get_user_feedbacks(db, skip=skip, limit=limit)
+async def read_user_feedbacks(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                              db: DBSession = Depends(get_db)):
+    """获取用户反馈列表（传入上一页的 X-Next-Cursor 作为 cursor 翻页）"""
+    return await paginate(response, crud_async.get_user_feedbacks, crud.FEEDBACK_PAGE_KEYS, db, skip, limit, cursor)
+
+@app.get("/user-feedbacks/export", tags=["用户反馈管理"])
+def export_user_feedbacks(user_id: Optional[int] = None, fmt: str = EXPORT_FORMAT):
+    """流式导出用户反馈（NDJSON 或 CSV，可按用户筛选）"""
+    return export_response(crud.select_user_feedbacks(user_id=user_id), fmt, "user_feedbacks")
 
 @app.get("/users/{user_id}/feedbacks", response_model=List[models.UserFeedbackResponse], tags=["用户反馈管理"])
-def read_user_feedback_by_user(user_id: int, db: Session = Depends(get_db)):
+async def read_user_feedback_by_user(user_id: int, db: DBSession = Depends(get_db)):
     """获取用户的反馈"""
-    return crud.get_user_feedback_by_user(db, user_id=user_id)
+    return await crud_async.get_user_feedback_by_user(db, user_id=user_id)
 
 @app.put("/user-feedbacks/{feedback_id}", response_model=models.UserFeedbackResponse, tags=["用户反馈管理"])
-def update_user_feedback(feedback_id: int, feedback_update: models.UserFeedbackUpdate, db: Session = Depends(get_db)):
+async def update_user_feedback(feedback_id: int, feedback_update: models.UserFeedbackUpdate, db: DBSession = Depends(get_db)):
     """处理用户反馈"""
-    db_feedback = crud.update_user_feedback(db, feedback_id=feedback_id, feedback_update=feedback_update)
+    db_feedback = await crud_async.update_user_feedback(db, feedback_id=feedback_id, feedback_update=feedback_update)
     if db_feedback is None:
         raise HTTPException(status_code=404, detail="用户反馈不存在")
     return db_feedback
 
 @app.delete("/user-feedbacks/{feedback_id}", tags=["用户反馈管理"])
-def delete_user_feedback(feedback_id: int, db: Session = Depends(get_db)):
+async def delete_user_feedback(feedback_id: int, db: DBSession = Depends(get_db)):
     """删除用户反馈"""
-    db_feedback = crud.delete_user_feedback(db, feedback_id=feedback_id)
+    db_feedback = await crud_async.delete_user_feedback(db, feedback_id=feedback_id)
     if db_feedback is None:
         raise HTTPException(status_code=404, detail="用户反馈不存在")
     return {"message": "用户反馈删除成功"}
 
+# ==================== 能耗统计 API ====================
+
+@app.get("/users/{user_id}/energy-statistics", response_model=List[models.EnergyStatisticResponse], tags=["能耗统计"])
+async def read_user_energy_statistics(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                      device_id: Optional[int] = None, db: DBSession = Depends(get_db)):
+    """获取用户按设备、日期汇总的能耗统计（统计日期闭区间 [start_date, end_date]）"""
+    return await crud_async.get_user_energy_statistics(db, user_id=user_id, start_date=start_date,
+                                                       end_date=end_date, device_id=device_id)
+
+@app.get("/analytics/energy-daily", response_model=List[models.DailyEnergySummary], tags=["能耗统计"])
+async def read_daily_energy_summary(start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                    user_id: Optional[int] = None, db: DBSession = Depends(get_db)):
+    """按日期汇总所有用户的总耗电量、总电费和有耗电的设备数，每个日期一行（可按用户筛选）"""
+    return await crud_async.get_daily_energy_summary(db, start_date=start_date, end_date=end_date, user_id=user_id)
+
 # ==================== 数据分析 API ====================
 
+async def cached_analytics(db: DBSession, key: tuple, compute):
+    """在线程池中用同步会话执行分析（compute 接收 SmartHomeAnalytics 实例），结果经过分析缓存
+
+    pandas 计算不能放在事件循环线程上，异步模式下同样走线程池，避免慢分析阻塞其他请求。
+    """
+    def run(session):
+        return analytics_cache.get_or_compute(key, lambda: compute(SmartHomeAnalytics(session)))
+    return await crud_async.run_blocking(db, run)
+
 @app.get("/analytics/device-usage", response_model=List[models.DeviceUsageAnalysis], tags=["数据分析"])
-def analyze_device_usage(db: Session = Depends(get_db)):
+async def analyze_device_usage(db: DBSession = Depends(get_db)):
     """分析设备使用频率和使用时间段"""
-    analytics = SmartHomeAnalytics(db)
-    return analytics.analyze_device_usage_frequency()
+    return await cached_analytics(db, ("device-usage",), SmartHomeAnalytics.analyze_device_usage_frequency)
 
 @app.get("/analytics/user-habits", response_model=List[models.UserHabitAnalysis], tags=["数据分析"])
-def analyze_user_habits(db: Session = Depends(get_db)):
-    """分析用户使用习惯"""
-    analytics = SmartHomeAnalytics(db)
-    return analytics.analyze_user_habits()
+async def analyze_user_habits(user_ids: Optional[List[int]] = Query(None), skip: int = 0,
+                              limit: Optional[int] = None, db: DBSession = Depends(get_db)):
+    """分析用户使用习惯（可按 user_ids 或 skip/limit 只分析一页用户）"""
+    key = ("user-habits", tuple(user_ids) if user_ids else None, skip, limit)
+    return await cached_analytics(
+        db, key, lambda analytics: analytics.analyze_user_habits(user_ids=user_ids, skip=skip, limit=limit)
+    )
 
 @app.get("/analytics/house-area-impact", response_model=List[models.HouseAreaAnalysis], tags=["数据分析"])
-def analyze_house_area_impact(db: Session = Depends(get_db)):
-    """分析房屋面积对设备使用行为的影响"""
-    analytics = SmartHomeAnalytics(db)
-    return analytics.analyze_house_area_impact()
+async def analyze_house_area_impact(edges: Optional[List[float]] = Query(None),
+                                    quantiles: Optional[int] = Query(None, ge=2, le=20),
+                                    db: DBSession = Depends(get_db)):
+    """分析房屋面积对设备使用行为的影响（可用 edges 指定区间边界，或用 quantiles 按面积分布等分）"""
+    key = ("house-area-impact", tuple(edges) if edges else None, quantiles)
+    return await cached_analytics(
+        db, key, lambda analytics: analytics.analyze_house_area_impact(edges=edges, quantiles=quantiles)
+    )
 
 @app.get("/analytics/energy-consumption", tags=["数据分析"])
-def get_energy_consumption_report(db: Session = Depends(get_db)):
-    """获取能耗分析报告"""
-    analytics = SmartHomeAnalytics(db)
-    return analytics.generate_energy_consumption_report()
+async def get_energy_consumption_report(start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                        db: DBSession = Depends(get_db)):
+    """获取能耗分析报告（可按日期闭区间 [start_date, end_date] 统计）"""
+    key = ("energy-consumption", start_date, end_date)
+    return await cached_analytics(
+        db, key, lambda analytics: analytics.generate_energy_consumption_report(start_date=start_date, end_date=end_date)
+    )
+
+@app.get("/analytics/cache-stats", tags=["数据分析"])
+def get_analytics_cache_stats():
+    """分析结果缓存的命中/未命中统计"""
+    return analytics_cache.stats()
 
 
 
@@ -292,6 +508,19 @@ def read_root():
 def health_check():
     return {"status": "healthy", "message": "系统运行正常"}
 
+@app.get("/metrics", response_class=PlainTextResponse, tags=["系统信息"])
+def get_metrics():
+    """Prometheus 文本格式的请求指标（当前 worker 进程）"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/health/pool", tags=["系统信息"])
+def get_pool_stats():
+    """数据库连接池占用和取连接等待时间统计（当前 worker 进程）"""
+    stats = {"sync": db_pool.pool_stats(database.engine)}
+    if database.async_engine is not None:
+        stats["async"] = db_pool.pool_stats(database.async_engine)
+    return stats
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app", 
@@ -0,0 +1,219 @@
+"""
+Prometheus 文本格式指标
+
+MetricsMiddleware 按路由模板（如 /users/{user_id}）统计请求数、耗时、进行中的请求数和响应大小，
+并结合 query_tracker 拆分出每个请求的数据库耗时和处理函数返回后的序列化/发送耗时；
+开启 QUERY_TRACKER_CONFIG['debug_headers'] 时在响应头中附带本次请求的 SQL 条数和耗时。
+render() 输出 text/plain; version=0.0.4 格式，供 GET /metrics 抓取。
+"""
+
+import functools
+import inspect
+import threading
+import time
+from typing import Dict, Sequence, Tuple
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+import query_tracker
+from config import QUERY_TRACKER_CONFIG
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._render_series(labels, value))
+        return '\n'.join(lines)
+
+    def _render_series(self, labels, value):
+        return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels: Tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, labels: Tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: Tuple, amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float]):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: Tuple, value: float):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # 各桶计数（非累计）、总和、次数
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, labels, series):
+        counts, total, count = series
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+            cumulative += bucket_count
+            le = 'le="{}"'.format(bound if bound == '+Inf' else _format_value(bound))
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+REQUESTS = Counter('http_requests_total', '按路由和状态码统计的请求数', ('method', 'route', 'status'))
+LATENCY = Histogram('http_request_duration_seconds', '请求总耗时', ('method', 'route'), LATENCY_BUCKETS)
+IN_PROGRESS = Gauge('http_requests_in_progress', '正在处理的请求数', ('method', 'route'))
+RESPONSE_SIZE = Histogram('http_response_size_bytes', '响应体大小', ('method', 'route'), SIZE_BUCKETS)
+DB_TIME = Histogram('http_request_db_seconds', '请求内执行 SQL 的累计耗时', ('method', 'route'), LATENCY_BUCKETS)
+DB_STATEMENTS = Histogram('http_request_db_statements', '请求内执行的 SQL 语句数', ('method', 'route'), COUNT_BUCKETS)
+SERIALIZATION_TIME = Histogram(
+    'http_request_serialization_seconds', '处理函数返回后到响应发送完毕的耗时（响应校验、序列化和发送）',
+    ('method', 'route'), LATENCY_BUCKETS
+)
+
+REGISTRY = (REQUESTS, LATENCY, IN_PROGRESS, RESPONSE_SIZE, DB_TIME, DB_STATEMENTS, SERIALIZATION_TIME)
+
+
+def render() -> str:
+    """所有指标的 Prometheus 文本格式"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def _route_template(scope) -> str:
+    """按路由模板归类请求，未匹配任何路由的请求归为同一类，避免标签数量随路径无限增长"""
+    app = scope.get('app')
+    partial = None
+    for route in getattr(app, 'routes', ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            # 路径匹配但方法不允许（405）
+            partial = route.path
+    return partial or '<unmatched>'
+
+
+def _mark_endpoint_finished():
+    stats = query_tracker.current()
+    if stats is not None:
+        stats.endpoint_finished = time.perf_counter()
+
+
+def _timed_endpoint(endpoint):
+    """包装路由处理函数，记录其返回时刻；签名和同步/异步属性保持不变"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_finished()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_finished()
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """记录处理函数返回时刻的路由类，用于把序列化耗时从请求耗时中拆出来"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：记录每个 HTTP 请求的指标"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        labels = (scope['method'], _route_template(scope))
+        response = {'status': 500, 'size': 0, 'finished': None}
+        debug_headers = QUERY_TRACKER_CONFIG['debug_headers']
+
+        with query_tracker.track_request(' '.join(labels)) as stats:
+            async def send_wrapper(message):
+                if message['type'] == 'http.response.start':
+                    response['status'] = message['status']
+                    if debug_headers:
+                        message['headers'] = list(message.get('headers', [])) + [
+                            (name.lower().encode(), value.encode()) for name, value in stats.headers().items()
+                        ]
+                elif message['type'] == 'http.response.body':
+                    response['size'] += len(message.get('body', b''))
+                    if not message.get('more_body', False):
+                        response['finished'] = time.perf_counter()
+                await send(message)
+
+            IN_PROGRESS.inc(labels)
+            started = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                finished = response['finished'] or time.perf_counter()
+                IN_PROGRESS.dec(labels)
+                REQUESTS.inc(labels + (str(response['status']),))
+                LATENCY.observe(labels, finished - started)
+                RESPONSE_SIZE.observe(labels, response['size'])
+                DB_TIME.observe(labels, stats.db_seconds)
+                DB_STATEMENTS.observe(labels, stats.statements)
+                if stats.endpoint_finished is not None:
+                    SERIALIZATION_TIME.observe(labels, max(finished - stats.endpoint_finished, 0.0))
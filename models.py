@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List
 
 # 用户相关模型
@@ -94,6 +94,15 @@ class UsageRecordResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkRowError(BaseModel):
+    index: int
+    detail: str
+
+class UsageRecordBulkResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkRowError]
+
 # 安防事件相关模型
 class SecurityEventCreate(BaseModel):
     user_id: int
@@ -144,6 +153,47 @@ class UserFeedbackResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# 能耗统计相关模型
+class EnergyStatisticResponse(BaseModel):
+    stat_id: int
+    user_id: int
+    device_id: Optional[int]
+    stat_date: date
+    daily_consumption: Optional[float]
+    peak_power: Optional[float]
+    avg_power: Optional[float]
+    usage_duration: Optional[int]
+    cost: Optional[float]
+
+    class Config:
+        from_attributes = True
+
+class DailyEnergySummary(BaseModel):
+    stat_date: date
+    total_consumption: float
+    total_cost: float
+    active_devices: int
+
+    class Config:
+        from_attributes = True
+
+# 级联删除任务模型
+class PurgeJobResponse(BaseModel):
+    job_id: int
+    entity_type: str
+    entity_id: int
+    status: str
+    current_step: Optional[str]
+    total_rows: Optional[int]
+    deleted_rows: int
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
 # 分析结果模型
 class DeviceUsageAnalysis(BaseModel):
     device_name: str
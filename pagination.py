@@ -0,0 +1,66 @@
+"""
+键集（游标）分页
+
+列表按一组唯一的排序键升序返回，下一页从上一页最后一行的键值之后开始查找，
+每页都只走索引定位，不随页码增大而变慢。游标对客户端不透明（base64 编码的键值）。
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+from sqlalchemy import and_, or_, DateTime
+
+
+class InvalidCursor(ValueError):
+    """游标无法解析或与排序键不匹配"""
+
+
+def encode_cursor(values: Sequence) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(cursor)
+    try:
+        return [
+            datetime.fromisoformat(value) if value is not None and isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def _after(columns: Sequence, values: Sequence):
+    """构造 (columns) > (values) 的条件，按 MySQL 升序 NULL 在前的规则处理空值"""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column.isnot(None) if value is None else column > value
+    rest = _after(columns[1:], values[1:])
+    if value is None:
+        return or_(and_(column.is_(None), rest), column.isnot(None))
+    return or_(column > value, and_(column == value, rest))
+
+
+def seek(query, columns: Sequence, cursor: Optional[str]):
+    """按排序键排序，并在给出游标时跳到游标之后"""
+    query = query.order_by(*columns)
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, columns)))
+    return query
+
+
+def next_cursor(items: Sequence, columns: Sequence, limit: int) -> Optional[str]:
+    """本页取满时返回下一页游标，否则说明已到末页"""
+    if not items or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor([getattr(last, column.key) for column in columns])
@@ -0,0 +1,240 @@
+"""
+用户/设备级联删除任务
+
+删除用户或设备时 crud 只在 purge_jobs 中登记任务，实体立即对读接口不可见：crud 取用户/设备时排除有未完成任务的实体，
+按用户/设备读取关联数据前先确认实体可见；导出、全表列表和分析报告等跨实体的查询用 visible_filters 排除关联行，
+没有未完成的任务时这些查询不附加任何条件。
+关联数据由后台任务分批删除：每批按主键删除至多 batch_size 行并在同一个短事务中更新任务进度，
+避免一条 DELETE 删除数百万行、长时间持有行锁阻塞写入。
+删除顺序与外键依赖一致：使用记录、安防事件、用户反馈、能耗统计、设备，最后在一个事务中清理
+期间新写入的零星关联行并删除实体本身。启用汇总表时先删除实体的小时汇总数据。
+
+任务失败或进程退出后，应用启动时会继续执行未完成的任务，也可以手动执行:
+    python purge.py resume
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+from config import PURGE_CONFIG
+from cache import analytics_cache
+import database
+import rollup
+
+logger = logging.getLogger(__name__)
+
+# 未完成的任务，对应实体对读接口不可见
+UNFINISHED = ('pending', 'running', 'failed')
+
+ENTITY_MODELS = {
+    'user': (database.User, database.User.user_id),
+    'device': (database.Device, database.Device.device_id)
+}
+
+
+def purging_ids(entity_type: str):
+    """有未完成删除任务的实体 ID 子查询"""
+    job = database.PurgeJob
+    return select(job.entity_id).where(job.entity_type == entity_type, job.status.in_(UNFINISHED))
+
+
+def hidden_ids(db: Session) -> Dict[str, List[int]]:
+    """有未完成删除任务的用户和设备 ID：{'user': [...], 'device': [...]}"""
+    job = database.PurgeJob
+    hidden = {entity_type: [] for entity_type in ENTITY_MODELS}
+    for row in db.query(job.entity_type, job.entity_id).filter(job.status.in_(UNFINISHED)):
+        hidden[row.entity_type].append(row.entity_id)
+    return hidden
+
+
+def visible_filters(hidden: Dict[str, List[int]], user_id=None, device_id=None) -> list:
+    """排除正在删除的用户和设备的关联行的条件，hidden 为 hidden_ids 的结果，没有未完成的任务时为空列表
+
+    user_id / device_id 传入查询中引用用户和设备的列，可为空的设备列为空时视为可见。
+    """
+    criteria = []
+    if user_id is not None and hidden['user']:
+        criteria.append(user_id.notin_(hidden['user']))
+    if device_id is not None and hidden['device']:
+        condition = device_id.notin_(hidden['device'])
+        criteria.append(or_(device_id.is_(None), condition) if device_id.expression.nullable else condition)
+    return criteria
+
+
+def start(db: Session, entity_type: str, entity_id: int) -> database.PurgeJob:
+    """登记删除任务并提交，返回任务"""
+    job = database.PurgeJob(entity_type=entity_type, entity_id=entity_id, status='pending')
+    db.add(job)
+    db.commit()
+    analytics_cache.invalidate()
+    db.refresh(job)
+    return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[database.PurgeJob]:
+    return db.get(database.PurgeJob, job_id)
+
+
+def _steps(job: database.PurgeJob) -> list:
+    """(步骤名, 主键列, 过滤条件) 列表，按外键依赖顺序排列"""
+    record = database.UsageRecord
+    event = database.SecurityEvent
+    feedback = database.UserFeedback
+    stat = database.EnergyStatistic
+    if job.entity_type == 'user':
+        user_id = job.entity_id
+        return [
+            ('usage_records', record.record_id, [record.user_id == user_id]),
+            ('security_events', event.event_id, [event.user_id == user_id]),
+            ('user_feedbacks', feedback.feedback_id, [feedback.user_id == user_id]),
+            ('energy_statistics', stat.stat_id, [stat.user_id == user_id]),
+            ('devices', database.Device.device_id, [database.Device.user_id == user_id])
+        ]
+    device_id = job.entity_id
+    return [
+        ('usage_records', record.record_id, [record.device_id == device_id]),
+        ('security_events', event.event_id, [event.device_id == device_id]),
+        ('energy_statistics', stat.stat_id, [stat.device_id == device_id])
+    ]
+
+
+def _touch(job: database.PurgeJob, step: Optional[str] = None):
+    job.current_step = step
+    job.updated_at = datetime.now()
+
+
+def _claim(db: Session, job_id: int) -> bool:
+    """把待执行、失败或长时间无进展的任务标记为执行中，多个进程同时认领时只有一个成功"""
+    job = database.PurgeJob
+    stale = datetime.now() - timedelta(seconds=PURGE_CONFIG['stale_seconds'])
+    claimed = db.query(job).filter(
+        job.job_id == job_id,
+        or_(job.status.in_(('pending', 'failed')), and_(job.status == 'running', job.updated_at < stale))
+    ).update({'status': 'running', 'error': None, 'updated_at': datetime.now()}, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def _remove_rollup(db: Session, job: database.PurgeJob):
+    """删除实体的小时汇总数据，删除用户时按设备分批提交"""
+    _touch(job, 'usage_hourly_rollup')
+    db.commit()
+    hourly = database.UsageHourlyRollup
+    if job.entity_type == 'device':
+        rollup.remove_device(db, job.entity_id)
+        db.commit()
+        return
+    device_ids = [row.device_id for row in db.query(hourly.device_id).filter(
+        hourly.user_id == job.entity_id
+    ).distinct()]
+    for device_id in device_ids:
+        db.query(hourly).filter(
+            hourly.user_id == job.entity_id, hourly.device_id == device_id
+        ).delete(synchronize_session=False)
+        db.commit()
+
+
+def _delete_in_batches(db: Session, job: database.PurgeJob, step: str, key, criteria: list):
+    """按主键分批删除匹配的行，每批一个事务并同时更新任务进度"""
+    model = key.class_
+    _touch(job, step)
+    db.commit()
+    while True:
+        ids = [row[0] for row in db.query(key).filter(*criteria).order_by(key).limit(PURGE_CONFIG['batch_size'])]
+        if not ids:
+            break
+        deleted = db.query(model).filter(key.in_(ids)).delete(synchronize_session=False)
+        job.deleted_rows += deleted
+        _touch(job, step)
+        db.commit()
+        if PURGE_CONFIG['pause_seconds']:
+            time.sleep(PURGE_CONFIG['pause_seconds'])
+    analytics_cache.invalidate()
+
+
+def _execute(db: Session, job: database.PurgeJob):
+    steps = _steps(job)
+    if job.total_rows is None:
+        job.total_rows = sum(
+            db.query(func.count(key)).filter(*criteria).scalar() for _, key, criteria in steps
+        )
+        db.commit()
+
+    if rollup.is_enabled():
+        _remove_rollup(db, job)
+    for step, key, criteria in steps:
+        _delete_in_batches(db, job, step, key, criteria)
+
+    # 分批删除期间新写入的关联行与实体在同一个事务中删除
+    for _, key, criteria in steps:
+        job.deleted_rows += db.query(key.class_).filter(*criteria).delete(synchronize_session=False)
+    if rollup.is_enabled():
+        if job.entity_type == 'user':
+            rollup.remove_user(db, job.entity_id)
+        else:
+            rollup.remove_device(db, job.entity_id)
+    model, key = ENTITY_MODELS[job.entity_type]
+    db.query(model).filter(key == job.entity_id).delete(synchronize_session=False)
+    job.status = 'completed'
+    job.finished_at = datetime.now()
+    _touch(job)
+    db.commit()
+    analytics_cache.invalidate()
+
+
+def run(job_id: int, db: Session = None) -> Optional[database.PurgeJob]:
+    """认领并执行删除任务，返回任务；任务已完成或正由其他进程执行时返回 None
+
+    失败时回滚当前批次，任务标记为 failed 并记录错误，已提交的批次不受影响，重新执行会从剩余数据继续。
+    """
+    if db is None:
+        with database.SessionLocal() as db:
+            return run(job_id, db)
+    if not _claim(db, job_id):
+        return None
+    job = get_job(db, job_id)
+    try:
+        _execute(db, job)
+    except Exception as e:
+        logger.exception("删除任务 %s 失败", job_id)
+        db.rollback()
+        job = get_job(db, job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        _touch(job, job.current_step)
+        db.commit()
+    db.refresh(job)
+    return job
+
+
+def resume(db: Session = None) -> List[int]:
+    """执行所有未完成的任务（执行中的任务只在长时间无进展时接手），返回执行过的任务 ID"""
+    if db is None:
+        with database.SessionLocal() as db:
+            return resume(db)
+    job = database.PurgeJob
+    job_ids = [row.job_id for row in db.query(job.job_id).filter(job.status.in_(UNFINISHED)).order_by(job.job_id)]
+    return [job_id for job_id in job_ids if run(job_id, db) is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='执行用户/设备级联删除任务')
+    parser.add_argument('command', choices=['resume'], help='resume: 继续执行未完成的删除任务')
+    parser.parse_args()
+
+    database.Base.metadata.create_all(bind=database.engine, tables=[database.PurgeJob.__table__])
+    with Session(database.engine) as db:
+        job_ids = resume(db)
+        for job_id in job_ids:
+            job = get_job(db, job_id)
+            print(f"删除任务 {job_id}（{job.entity_type} {job.entity_id}）: {job.status}，"
+                  f"已删除 {job.deleted_rows}/{job.total_rows} 行")
+        print(f"共执行 {len(job_ids)} 个删除任务")
+
+
+if __name__ == "__main__":
+    main()
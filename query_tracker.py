@@ -0,0 +1,176 @@
+"""
+请求级 SQL 统计
+
+在引擎上挂 before/after_cursor_execute 事件，把每条语句的次数和耗时累加到当前请求的
+RequestStats（通过 contextvar 传递，线程池和 run_sync 中执行的查询同样计入）。
+请求之外执行的查询（脚本、后台任务）不做统计。
+
+同一请求内同一语句形态（参数和 IN 列表归一化后的 SQL）重复超过阈值时记录 N+1 警告；
+query_budget() / assert_response_budget() 供测试断言代码路径或接口的查询预算。
+"""
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from config import QUERY_TRACKER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional['RequestStats']] = ContextVar('request_stats', default=None)
+
+# 调试响应头
+HEADER_STATEMENTS = 'X-DB-Statements'
+HEADER_DB_TIME = 'X-DB-Time-Ms'
+HEADER_MAX_REPEATS = 'X-DB-Max-Repeats'
+HEADER_TOP_REPEATS = 'X-DB-Top-Repeats'
+
+# X-DB-Top-Repeats 中列出的语句形态数和每个形态的最大长度
+TOP_REPEATS = 3
+TOP_REPEAT_SHAPE_CHARS = 200
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    """把 SQL 归一化为语句形态：字面量和占位符替换为 ?，IN 列表折叠为 (?)"""
+    shape = _STRING_LITERAL.sub('?', statement)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _WHITESPACE.sub(' ', shape).strip()
+    return _PLACEHOLDER_LIST.sub('(?)', shape)
+
+
+def _abbreviate(shape: str) -> str:
+    """过长的语句形态保留开头和结尾（结尾通常是区分语句的 WHERE 条件）"""
+    if len(shape) <= TOP_REPEAT_SHAPE_CHARS:
+        return shape
+    head = TOP_REPEAT_SHAPE_CHARS // 3
+    return f"{shape[:head]} ... {shape[head - TOP_REPEAT_SHAPE_CHARS:]}"
+
+
+class RequestStats:
+    """单个请求内的数据库访问统计"""
+
+    def __init__(self, label: str = ''):
+        self.label = label
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.shapes = Counter()
+        # 路由处理函数返回的时刻，之后的耗时计为响应序列化和发送
+        self.endpoint_finished: Optional[float] = None
+
+    @property
+    def max_repeats(self) -> int:
+        """重复次数最多的语句形态执行了几次"""
+        return max(self.shapes.values(), default=0)
+
+    def top_repeats(self) -> list:
+        """重复执行的语句形态中次数最多的几个：[[次数, 形态], ...]"""
+        return [[count, _abbreviate(shape)]
+                for shape, count in self.shapes.most_common(TOP_REPEATS) if count > 1]
+
+    def headers(self) -> dict:
+        """调试响应头（X-DB-Top-Repeats 为 ASCII 转义的 JSON）"""
+        return {
+            HEADER_STATEMENTS: str(self.statements),
+            HEADER_DB_TIME: f'{self.db_seconds * 1000:.2f}',
+            HEADER_MAX_REPEATS: str(self.max_repeats),
+            HEADER_TOP_REPEATS: json.dumps(self.top_repeats())
+        }
+
+
+@contextmanager
+def track_request(label: str = ''):
+    """在 with 块内统计数据库访问，产出本次的 RequestStats"""
+    stats = RequestStats(label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[RequestStats]:
+    """当前请求的统计，不在请求中时为 None"""
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = getattr(context, '_query_started', None)
+    if stats is None or started is None:
+        return
+    stats.statements += 1
+    stats.db_seconds += time.perf_counter() - started
+
+    shape = statement_shape(statement)
+    stats.shapes[shape] += 1
+    # 每个语句形态在刚超过阈值时警告一次
+    if stats.shapes[shape] == QUERY_TRACKER_CONFIG['n_plus_one_threshold'] + 1:
+        logger.warning(
+            "可能存在 N+1 查询：%s 中同一语句已执行超过 %d 次: %s",
+            stats.label or '当前请求', QUERY_TRACKER_CONFIG['n_plus_one_threshold'], shape
+        )
+
+
+def install(engine):
+    """在同步引擎（异步引擎传 sync_engine）上注册统计事件"""
+    if not event.contains(engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _check_budget(statements: int, max_repeats: int, shapes: Counter,
+                  max_statements: int, max_repeats_allowed: Optional[int], what: str):
+    problems = []
+    if statements > max_statements:
+        problems.append(f"执行了 {statements} 条 SQL，预算 {max_statements} 条")
+    if max_repeats_allowed is not None and max_repeats > max_repeats_allowed:
+        problems.append(f"同一语句最多重复 {max_repeats} 次，预算 {max_repeats_allowed} 次")
+    if problems:
+        detail = '; '.join(problems)
+        if shapes:
+            worst = '\n'.join(f"  {count} x {shape}" for shape, count in shapes.most_common(5))
+            detail += f"\n重复最多的语句:\n{worst}"
+        raise AssertionError(f"{what}超出查询预算: {detail}")
+
+
+@contextmanager
+def query_budget(max_statements: int, max_repeats: Optional[int] = None):
+    """测试用：断言 with 块内执行的 SQL 条数（以及同一语句的重复次数）不超过预算
+
+        with query_budget(5, max_repeats=1):
+            SmartHomeAnalytics(db).analyze_user_habits()
+    """
+    with track_request('query_budget') as stats:
+        yield stats
+    _check_budget(stats.statements, stats.max_repeats, stats.shapes, max_statements, max_repeats, '代码块')
+
+
+def assert_response_budget(response, max_statements: int, max_repeats: Optional[int] = None):
+    """测试用：按调试响应头断言一次接口调用的查询预算（需开启 QUERY_DEBUG_HEADERS）
+
+    超出预算时列出 X-DB-Top-Repeats 中重复最多的语句形态。
+    """
+    if HEADER_STATEMENTS not in response.headers:
+        raise AssertionError(f"响应缺少 {HEADER_STATEMENTS} 头，请开启 QUERY_TRACKER_CONFIG['debug_headers']")
+    shapes = Counter({shape: count for count, shape in json.loads(response.headers.get(HEADER_TOP_REPEATS, '[]'))})
+    _check_budget(
+        int(response.headers[HEADER_STATEMENTS]), int(response.headers.get(HEADER_MAX_REPEATS, 0)), shapes,
+        max_statements, max_repeats, f"{response.request.method} {response.request.url.path} "
+    )
@@ -0,0 +1,188 @@
+"""
+使用记录小时汇总表维护
+
+usage_hourly_rollup 按 (用户, 设备, 日期, 小时) 预聚合使用次数、时长和能耗，
+crud 写入/删除使用记录时增量更新，分析和可视化查询在启用后改读汇总表。
+
+回填历史数据:
+    python rollup.py backfill
+"""
+
+import argparse
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from sqlalchemy import func, extract, select, tuple_
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+from config import ROLLUP_CONFIG
+import database
+
+
+def is_enabled() -> bool:
+    """汇总表是否启用"""
+    return ROLLUP_CONFIG['enabled']
+
+
+def _record_key(record):
+    start_time = record.start_time
+    return (record.user_id, record.device_id, start_time.date(), start_time.hour)
+
+
+def apply_records(db: Session, records, sign: int = 1):
+    """把一批使用记录累加（sign=1）或扣减（sign=-1）到汇总表，不提交事务"""
+    deltas = {}
+    for record in records:
+        key = _record_key(record)
+        delta = deltas.setdefault(key, [0, 0, 0, 0.0])
+        delta[0] += 1
+        if record.duration_minutes is not None:
+            delta[1] += 1
+            delta[2] += record.duration_minutes
+        delta[3] += record.energy_consumed or 0.0
+
+    if not deltas:
+        return
+
+    rows = [
+        {
+            'user_id': user_id, 'device_id': device_id, 'usage_date': usage_date, 'usage_hour': usage_hour,
+            'usage_count': sign * count, 'timed_count': sign * timed, 'total_minutes': sign * minutes,
+            'total_energy': sign * energy
+        }
+        for (user_id, device_id, usage_date, usage_hour), (count, timed, minutes, energy) in deltas.items()
+    ]
+    table = database.UsageHourlyRollup.__table__
+    stmt = insert(table)
+    stmt = stmt.on_duplicate_key_update(
+        usage_count=table.c.usage_count + stmt.inserted.usage_count,
+        timed_count=table.c.timed_count + stmt.inserted.timed_count,
+        total_minutes=table.c.total_minutes + stmt.inserted.total_minutes,
+        total_energy=table.c.total_energy + stmt.inserted.total_energy
+    )
+    db.execute(stmt, rows)
+
+    if sign < 0:
+        # 清理本次扣减为零的小时
+        rollup = database.UsageHourlyRollup
+        db.query(rollup).filter(
+            tuple_(rollup.user_id, rollup.device_id, rollup.usage_date, rollup.usage_hour).in_(list(deltas)),
+            rollup.usage_count <= 0
+        ).delete(synchronize_session=False)
+
+
+def apply_record(db: Session, record, sign: int = 1):
+    """把单条使用记录累加或扣减到汇总表，不提交事务"""
+    apply_records(db, [record], sign)
+
+
+def remove_user(db: Session, user_id: int):
+    """删除用户的全部汇总数据，不提交事务"""
+    db.query(database.UsageHourlyRollup).filter(
+        database.UsageHourlyRollup.user_id == user_id
+    ).delete(synchronize_session=False)
+
+
+def remove_device(db: Session, device_id: int):
+    """删除设备的全部汇总数据，不提交事务"""
+    db.query(database.UsageHourlyRollup).filter(
+        database.UsageHourlyRollup.device_id == device_id
+    ).delete(synchronize_session=False)
+
+
+def backfill(db: Session) -> int:
+    """清空汇总表并从 usage_records 全量重建，返回写入的小时行数"""
+    record = database.UsageRecord
+    usage_date = func.date(record.start_time)
+    usage_hour = extract('hour', record.start_time)
+    grouped = select(
+        record.user_id,
+        record.device_id,
+        usage_date,
+        usage_hour,
+        func.count(record.record_id),
+        func.count(record.duration_minutes),
+        func.coalesce(func.sum(record.duration_minutes), 0),
+        func.coalesce(func.sum(record.energy_consumed), 0.0)
+    ).group_by(record.user_id, record.device_id, usage_date, usage_hour)
+
+    table = database.UsageHourlyRollup.__table__
+    db.query(database.UsageHourlyRollup).delete(synchronize_session=False)
+    db.execute(table.insert().from_select(
+        ['user_id', 'device_id', 'usage_date', 'usage_hour',
+         'usage_count', 'timed_count', 'total_minutes', 'total_energy'],
+        grouped
+    ))
+    db.commit()
+    return db.query(func.count()).select_from(database.UsageHourlyRollup).scalar()
+
+
+class UsageMeasures:
+    """使用记录的分组维度和聚合表达式
+
+    同一个分析查询既可以扫原始 usage_records，也可以扫汇总表：
+    维度列（user_id/device_id/hour）和聚合（usage_count/timed_count/total_minutes/total_energy）
+    在两种数据源上含义一致，调用方只需按需 join 和 group_by。
+    """
+
+    def __init__(self, use_rollup: bool):
+        self.use_rollup = use_rollup
+        if use_rollup:
+            rollup = database.UsageHourlyRollup
+            self.entity = rollup
+            self.user_id = rollup.user_id
+            self.device_id = rollup.device_id
+            self.hour = rollup.usage_hour
+            self.usage_count = func.sum(rollup.usage_count)
+            self.timed_count = func.sum(rollup.timed_count)
+            self.total_minutes = func.sum(rollup.total_minutes)
+            self.total_energy = func.sum(rollup.total_energy)
+        else:
+            record = database.UsageRecord
+            self.entity = record
+            self.user_id = record.user_id
+            self.device_id = record.device_id
+            self.hour = extract('hour', record.start_time)
+            self.usage_count = func.count(record.record_id)
+            self.timed_count = func.count(record.duration_minutes)
+            self.total_minutes = func.sum(record.duration_minutes)
+            self.total_energy = func.sum(record.energy_consumed)
+
+    def date_filters(self, start_date: Optional[date] = None, end_date: Optional[date] = None) -> list:
+        """按使用日期闭区间 [start_date, end_date] 筛选的条件"""
+        filters = []
+        if self.use_rollup:
+            column = database.UsageHourlyRollup.usage_date
+            if start_date is not None:
+                filters.append(column >= start_date)
+            if end_date is not None:
+                filters.append(column <= end_date)
+        else:
+            column = database.UsageRecord.start_time
+            if start_date is not None:
+                filters.append(column >= datetime.combine(start_date, time.min))
+            if end_date is not None:
+                filters.append(column < datetime.combine(end_date + timedelta(days=1), time.min))
+        return filters
+
+
+def usage_measures(use_rollup: bool = None) -> UsageMeasures:
+    """按配置（或显式指定）选择汇总表或原始表作为数据源"""
+    if use_rollup is None:
+        use_rollup = is_enabled()
+    return UsageMeasures(use_rollup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='维护使用记录小时汇总表')
+    parser.add_argument('command', choices=['backfill'], help='backfill: 从 usage_records 全量重建汇总表')
+    args = parser.parse_args()
+
+    database.Base.metadata.create_all(bind=database.engine, tables=[database.UsageHourlyRollup.__table__])
+    with Session(database.engine) as db:
+        if args.command == 'backfill':
+            rows = backfill(db)
+            print(f"汇总表回填完成，共 {rows} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -151,7 +151,7 @@ CREATE TABLE `security_events`  (
   `is_resolved` tinyint(1) NULL DEFAULT NULL,
   `location` varchar(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL DEFAULT NULL,
   PRIMARY KEY (`event_id`) USING BTREE,
-  INDEX `user_id`(`user_id` ASC) USING BTREE,
+  INDEX `idx_security_events_user_time`(`user_id` ASC, `occurred_at` ASC) USING BTREE,
   INDEX `device_id`(`device_id` ASC) USING BTREE,
   INDEX `occurred_at`(`occurred_at` ASC) USING BTREE,
   INDEX `idx_security_events_resolved`(`is_resolved` ASC) USING BTREE,
@@ -184,9 +184,8 @@ CREATE TABLE `usage_records`  (
   `ambient_temperature` float NULL DEFAULT NULL COMMENT '环境温度',
   `humidity` float NULL DEFAULT NULL COMMENT '湿度百分比',
   PRIMARY KEY (`record_id`) USING BTREE,
-  INDEX `user_id`(`user_id` ASC) USING BTREE,
-  INDEX `device_id`(`device_id` ASC) USING BTREE,
-  INDEX `start_time`(`start_time` ASC) USING BTREE,
+  INDEX `idx_usage_records_user_time`(`user_id` ASC, `start_time` ASC) USING BTREE,
+  INDEX `idx_usage_records_device_time`(`device_id` ASC, `start_time` ASC) USING BTREE,
   INDEX `idx_usage_records_date`(`start_time` ASC) USING BTREE,
   CONSTRAINT `usage_records_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`user_id`) ON DELETE RESTRICT ON UPDATE RESTRICT,
   CONSTRAINT `usage_records_ibfk_2` FOREIGN KEY (`device_id`) REFERENCES `devices` (`device_id`) ON DELETE RESTRICT ON UPDATE RESTRICT
@@ -0,0 +1,391 @@
+"""
+共享数据快照
+
+一次完整的报告（generate_all_visualizations 或依次调用多个分析方法）会对同几张表做多次重叠的分组扫描。
+DataSnapshot 把分析用到的列每张表只扫描一次读入内存：ID 列用 int32，名称列用 category，
+之后 SmartHomeAnalytics 和 SmartHomeVisualizer 的分组统计都在这些 DataFrame 上完成。
+每张表在首次用到时才加载；快照反映的是加载时刻的数据，之后的写入不会出现在快照中。
+正在级联删除的用户和设备及其关联数据不加载。
+
+    snapshot = DataSnapshot(db)
+    analytics = SmartHomeAnalytics(db, snapshot=snapshot)
+    visualizer = SmartHomeVisualizer(db, snapshot=snapshot)
+
+usage_records 每行约 44 字节（三个 int32 ID、两个时间戳、时长和能耗），一千万条记录约占 440MB 内存。
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import database
+import purge
+
+
+def _ids(values) -> np.ndarray:
+    """ID 列统一用 int32 存储"""
+    return np.asarray(values, dtype=np.int32)
+
+
+def _rows(frame: pd.DataFrame) -> list:
+    """把 DataFrame 转成与 SQL 查询结果同样按属性访问的行"""
+    return list(frame.itertuples(index=False, name='Row'))
+
+
+def users_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """把用户列转换成快照使用的紧凑类型"""
+    return pd.DataFrame({
+        'user_id': _ids(frame['user_id']),
+        'username': frame['username'].astype('category'),
+        'house_area': pd.to_numeric(frame['house_area']).astype('float64')
+    })
+
+
+def device_types_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """把设备类型列转换成快照使用的紧凑类型"""
+    return pd.DataFrame({
+        'type_id': _ids(frame['type_id']),
+        'type_name': frame['type_name'].astype('category'),
+        'avg_power_consumption': pd.to_numeric(frame['avg_power_consumption']).astype('float64')
+    })
+
+
+def devices_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """把设备列转换成快照使用的紧凑类型"""
+    return pd.DataFrame({
+        'device_id': _ids(frame['device_id']),
+        'user_id': _ids(frame['user_id']),
+        'device_type_id': _ids(frame['device_type_id']),
+        'device_name': frame['device_name'].astype('category'),
+        'actual_power_consumption': pd.to_numeric(frame['actual_power_consumption']).astype('float64')
+    })
+
+
+class DataSnapshot:
+    """分析和可视化共用的内存数据快照"""
+
+    def __init__(self, db: Session, chunk_size: int = 100000):
+        self.db = db
+        # usage_records 分批流式读取，每批转换成紧凑类型后再合并
+        self.chunk_size = chunk_size
+        self._frames = {}
+        self._hidden = None
+
+    def _visible(self, user_id=None, device_id=None) -> list:
+        """排除正在删除的用户和设备的条件，每个快照只查询一次未完成的删除任务"""
+        if self._hidden is None:
+            self._hidden = purge.hidden_ids(self.db)
+        return purge.visible_filters(self._hidden, user_id, device_id)
+
+    def load(self) -> 'DataSnapshot':
+        """立即加载全部表，返回自身"""
+        for name in ('users', 'device_types', 'devices', 'usage'):
+            self._frame(name)
+        return self
+
+    def _frame(self, name: str) -> pd.DataFrame:
+        if name not in self._frames:
+            self._frames[name] = getattr(self, f'_load_{name}')()
+        return self._frames[name]
+
+    @property
+    def users(self) -> pd.DataFrame:
+        """user_id, username, house_area"""
+        return self._frame('users')
+
+    @property
+    def device_types(self) -> pd.DataFrame:
+        """type_id, type_name, avg_power_consumption"""
+        return self._frame('device_types')
+
+    @property
+    def devices(self) -> pd.DataFrame:
+        """device_id, user_id, device_type_id, device_name, actual_power_consumption"""
+        return self._frame('devices')
+
+    @property
+    def usage(self) -> pd.DataFrame:
+        """record_id, user_id, device_id, start_time, end_time, duration_minutes, energy_consumed，按 record_id 排序"""
+        return self._frame('usage')
+
+    @property
+    def usage_hour(self) -> pd.Series:
+        """每条使用记录开始时间的小时（int8）"""
+        return self._frame('usage_hour')
+
+    def _load_users(self) -> pd.DataFrame:
+        User = database.User
+        rows = self.db.execute(select(User.user_id, User.username, User.house_area).where(
+            *self._visible(User.user_id)
+        )).all()
+        return users_frame(pd.DataFrame(rows, columns=['user_id', 'username', 'house_area']))
+
+    def _load_device_types(self) -> pd.DataFrame:
+        DeviceType = database.DeviceType
+        rows = self.db.execute(select(
+            DeviceType.type_id, DeviceType.type_name, DeviceType.avg_power_consumption
+        )).all()
+        return device_types_frame(pd.DataFrame(rows, columns=['type_id', 'type_name', 'avg_power_consumption']))
+
+    def _load_devices(self) -> pd.DataFrame:
+        Device = database.Device
+        rows = self.db.execute(select(
+            Device.device_id, Device.user_id, Device.device_type_id, Device.device_name,
+            Device.actual_power_consumption
+        ).where(*self._visible(Device.user_id, Device.device_id))).all()
+        return devices_frame(pd.DataFrame(rows, columns=['device_id', 'user_id', 'device_type_id', 'device_name',
+                                                         'actual_power_consumption']))
+
+    def _load_usage(self) -> pd.DataFrame:
+        record = database.UsageRecord
+        columns = ['record_id', 'user_id', 'device_id', 'start_time', 'end_time', 'duration_minutes',
+                   'energy_consumed']
+        stmt = select(
+            record.record_id, record.user_id, record.device_id, record.start_time, record.end_time,
+            record.duration_minutes, record.energy_consumed
+        ).where(
+            *self._visible(record.user_id, record.device_id)
+        ).order_by(record.record_id).execution_options(yield_per=self.chunk_size)
+
+        def typed(frame):
+            return pd.DataFrame({
+                'record_id': _ids(frame['record_id']),
+                'user_id': _ids(frame['user_id']),
+                'device_id': _ids(frame['device_id']),
+                'start_time': pd.to_datetime(frame['start_time']),
+                'end_time': pd.to_datetime(frame['end_time']),
+                'duration_minutes': pd.to_numeric(frame['duration_minutes']).astype('float64'),
+                'energy_consumed': pd.to_numeric(frame['energy_consumed']).astype('float64')
+            })
+
+        chunks = [typed(pd.DataFrame(rows, columns=columns)) for rows in self.db.execute(stmt).partitions()]
+        if not chunks:
+            return typed(pd.DataFrame({column: [] for column in columns}))
+        return pd.concat(chunks, ignore_index=True)
+
+    def _load_usage_hour(self) -> pd.Series:
+        return self.usage['start_time'].dt.hour.astype('int8')
+
+    def _usage_frame(self, **columns) -> pd.DataFrame:
+        """从使用记录中取出若干列（可附带 hour）组成临时 DataFrame"""
+        usage = self.usage
+        frame = {}
+        for alias, column in columns.items():
+            frame[alias] = self.usage_hour if column == 'hour' else usage[column]
+        return pd.DataFrame(frame)
+
+    def devices_with_types(self) -> pd.DataFrame:
+        """设备内连接设备类型（只保留类型存在的设备）"""
+        return self.devices.merge(
+            self.device_types, left_on='device_type_id', right_on='type_id', how='inner'
+        )
+
+    def usage_in_range(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                       finished_only: bool = False) -> pd.Series:
+        """使用日期在闭区间 [start_date, end_date] 内（可只取已结束）的记录掩码"""
+        usage = self.usage
+        mask = pd.Series(True, index=usage.index)
+        if start_date is not None:
+            mask &= usage['start_time'] >= datetime.combine(start_date, time.min)
+        if end_date is not None:
+            mask &= usage['start_time'] < datetime.combine(end_date + timedelta(days=1), time.min)
+        if finished_only:
+            mask &= usage['end_time'].notna()
+        return mask
+
+    # ==================== 分组统计 ====================
+    # 行的字段名与对应 SQL 查询的列名一致，调用方可以不加区分地处理
+
+    def device_hour_usage(self) -> pd.DataFrame:
+        """按 (设备, 小时) 汇总：device_id, device_name, type_name, hour, usage_count, timed_count, total_minutes"""
+        grouped = self._usage_frame(device_id='device_id', hour='hour', minutes='duration_minutes').groupby(
+            ['device_id', 'hour'], sort=True
+        ).agg(
+            usage_count=('minutes', 'size'),
+            timed_count=('minutes', 'count'),
+            total_minutes=('minutes', 'sum')
+        ).reset_index()
+        devices = self.devices_with_types()[['device_id', 'device_name', 'type_name']]
+        frame = grouped.merge(devices, on='device_id', how='inner')
+        return frame[['device_id', 'device_name', 'type_name', 'hour', 'usage_count', 'timed_count',
+                      'total_minutes']]
+
+    def user_hour_activity(self) -> list:
+        """按 (小时, 用户) 计数的行：hour, activity_count, username"""
+        grouped = self._usage_frame(hour='hour', user_id='user_id').groupby(
+            ['hour', 'user_id'], sort=True
+        ).size().rename('activity_count').reset_index()
+        frame = grouped.merge(self.users[['user_id', 'username']], on='user_id', how='inner')
+        return _rows(frame.sort_values(['hour', 'user_id'])[['hour', 'activity_count', 'username']])
+
+    def user_device_usage(self) -> list:
+        """按 (用户, 设备) 汇总的行：username, device_name, usage_count, total_minutes"""
+        grouped = self._usage_frame(user_id='user_id', device_id='device_id', minutes='duration_minutes').groupby(
+            ['user_id', 'device_id'], sort=True
+        ).agg(
+            usage_count=('minutes', 'size'),
+            total_minutes=('minutes', 'sum')
+        ).reset_index()
+        frame = grouped.merge(self.users[['user_id', 'username']], on='user_id', how='inner').merge(
+            self.devices[['device_id', 'device_name']], on='device_id', how='inner'
+        )
+        frame = frame.sort_values(['user_id', 'device_id'])
+        return _rows(frame[['username', 'device_name', 'usage_count', 'total_minutes']])
+
+    def hour_usage_counts(self) -> list:
+        """按小时计数的行：hour, count"""
+        counts = self.usage_hour.value_counts().sort_index()
+        return _rows(pd.DataFrame({'hour': counts.index, 'count': counts.to_numpy()}))
+
+    def house_area_scatter(self) -> list:
+        """有面积的用户的设备数和总使用时长：house_area, device_count, total_usage_minutes
+
+        与 users LEFT JOIN devices LEFT JOIN usage_records 后按用户分组的结果一致：
+        device_count 是连接后的行数（有使用记录的设备按记录数计）。
+        """
+        usage = self.usage
+        per_device = pd.DataFrame({
+            'records': usage.groupby('device_id').size(),
+            'minutes': usage.groupby('device_id')['duration_minutes'].sum()
+        })
+        devices = self.devices[['device_id', 'user_id']].merge(
+            per_device, left_on='device_id', right_index=True, how='left'
+        )
+        devices['rows'] = devices['records'].fillna(0).clip(lower=1)
+        per_user = devices.groupby('user_id').agg(
+            device_count=('rows', 'sum'), total_usage_minutes=('minutes', 'sum')
+        )
+        users = self.users[self.users['house_area'].notna()][['user_id', 'house_area']].merge(
+            per_user, left_on='user_id', right_index=True, how='left'
+        ).sort_values('user_id')
+        users['device_count'] = users['device_count'].fillna(0).astype('int64')
+        users['total_usage_minutes'] = users['total_usage_minutes'].fillna(0)
+        return _rows(users[['house_area', 'device_count', 'total_usage_minutes']])
+
+    def device_efficiency(self, limit: int = 10) -> list:
+        """额定功耗和实际功耗都有值的设备：device_name, type_name, rated_power, actual_power"""
+        frame = self.devices_with_types()
+        frame = frame[frame['actual_power_consumption'].notna() & frame['avg_power_consumption'].notna()]
+        frame = frame.sort_values('device_id').head(limit).rename(columns={
+            'avg_power_consumption': 'rated_power', 'actual_power_consumption': 'actual_power'
+        })
+        return _rows(frame[['device_name', 'type_name', 'rated_power', 'actual_power']])
+
+    def user_peak_hours(self, user_ids) -> pd.Series:
+        """每个用户使用次数最多的3个小时（次数相同时取较早的小时），按 user_id 索引"""
+        selected = self.usage['user_id'].isin(user_ids)
+        hourly = self._usage_frame(user_id='user_id', hour='hour')[selected].groupby(
+            ['user_id', 'hour']
+        ).size().rename('usage_count').reset_index()
+        top = hourly.sort_values(
+            ['user_id', 'usage_count', 'hour'], ascending=[True, False, True]
+        ).groupby('user_id', sort=False).head(3)
+        return top.groupby('user_id', sort=False)['hour'].agg(lambda hours: [int(hour) for hour in hours])
+
+    def user_favorite_devices(self, user_ids, top_n: int = 5) -> pd.Series:
+        """每个用户使用次数最多的 top_n 个设备名（次数相同时按名称），按 user_id 索引"""
+        selected = self.usage['user_id'].isin(user_ids)
+        per_device = self._usage_frame(user_id='user_id', device_id='device_id')[selected].groupby(
+            ['user_id', 'device_id']
+        ).size().rename('usage_count').reset_index().merge(
+            self.devices[['device_id', 'device_name']], on='device_id', how='inner'
+        )
+        per_device['device_name'] = per_device['device_name'].astype(str)
+        by_name = per_device.groupby(['user_id', 'device_name'])['usage_count'].sum().reset_index()
+        top = by_name.sort_values(
+            ['user_id', 'usage_count', 'device_name'], ascending=[True, False, True]
+        ).groupby('user_id', sort=False).head(top_n)
+        return top.groupby('user_id', sort=False)['device_name'].agg(list)
+
+    def user_finished_records(self, user_ids, since: Optional[datetime] = None) -> dict:
+        """每个用户已结束的使用记录（按 record_id 排序），行字段 start_time, end_time, device_name"""
+        usage = self.usage
+        mask = usage['user_id'].isin(user_ids) & usage['end_time'].notna()
+        if since is not None:
+            mask &= usage['start_time'] >= since
+        records = usage.loc[mask, ['record_id', 'user_id', 'device_id', 'start_time', 'end_time']].merge(
+            self.devices[['device_id', 'device_name']], on='device_id', how='inner'
+        ).sort_values(['user_id', 'record_id'])
+        records_by_user = {}
+        for row in _rows(records[['user_id', 'start_time', 'end_time', 'device_name']]):
+            records_by_user.setdefault(row.user_id, []).append(row)
+        return records_by_user
+
+    def house_area_rows(self, edges: List[float]):
+        """按面积区间统计，返回与 analyze_house_area_impact 三次分组查询字段相同的行：
+
+        (bucket, user_count, device_total, users_with_devices)、(bucket, total_minutes, timed_count)、
+        (bucket, type_name, count)。区间 [edges[i], edges[i+1])，最后一个区间无上限。
+        """
+        users = self.users[self.users['house_area'].notna() & (self.users['house_area'] >= edges[0])]
+        bucket = pd.Series(
+            np.searchsorted(np.asarray(edges[1:]), users['house_area'].to_numpy(), side='right'),
+            index=users['user_id'].to_numpy()
+        )
+
+        device_counts = self.devices.groupby('user_id').size().reindex(bucket.index)
+        device_rows = pd.DataFrame({'bucket': bucket.to_numpy(), 'count': device_counts.to_numpy()}).groupby(
+            'bucket'
+        ).agg(
+            user_count=('count', 'size'), device_total=('count', 'sum'), users_with_devices=('count', 'count')
+        ).reset_index()
+
+        usage = pd.DataFrame({
+            'bucket': self.usage['user_id'].map(bucket), 'minutes': self.usage['duration_minutes']
+        }).dropna(subset=['bucket'])
+        usage_rows = usage.groupby('bucket').agg(
+            total_minutes=('minutes', 'sum'), timed_count=('minutes', 'count')
+        ).reset_index()
+        usage_rows['bucket'] = usage_rows['bucket'].astype(int)
+
+        devices = self.devices_with_types()
+        devices = pd.DataFrame({
+            'bucket': devices['user_id'].map(bucket), 'type_name': devices['type_name'].astype(str)
+        }).dropna(subset=['bucket'])
+        type_rows = devices.groupby(['bucket', 'type_name']).size().rename('count').reset_index()
+        type_rows['bucket'] = type_rows['bucket'].astype(int)
+
+        return _rows(device_rows), _rows(usage_rows), _rows(type_rows)
+
+    def energy_rows(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                    finished_only: bool = False, top_users: int = 10):
+        """按设备类型和按用户汇总能耗的行：(type_name, total_energy)、能耗最高的 top_users 个 (username, total_energy)"""
+        usage = self.usage
+        mask = self.usage_in_range(start_date, end_date, finished_only)
+        energy = pd.DataFrame({
+            'user_id': usage['user_id'][mask], 'device_id': usage['device_id'][mask],
+            'energy': usage['energy_consumed'][mask]
+        })
+
+        per_device = energy.groupby('device_id')['energy'].sum().rename('total_energy')
+        by_type = self.devices_with_types()[['device_id', 'type_name']].merge(
+            per_device, left_on='device_id', right_index=True, how='inner'
+        )
+        by_type['type_name'] = by_type['type_name'].astype(str)
+        by_type = by_type.groupby('type_name')['total_energy'].sum().reset_index()
+
+        per_user = energy.groupby('user_id')['energy'].sum().rename('total_energy')
+        by_user = self.users[['user_id', 'username']].merge(
+            per_user, left_on='user_id', right_index=True, how='inner'
+        )
+        by_user['username'] = by_user['username'].astype(str)
+        by_user = by_user.groupby('username')['total_energy'].sum().reset_index().sort_values(
+            ['total_energy', 'username'], ascending=[False, True]
+        ).head(top_users)
+
+        return _rows(by_type), _rows(by_user)
+
+    def area_quantile_edges(self, quantiles: int) -> List[float]:
+        """与 NTILE(quantiles) OVER (ORDER BY house_area) 相同的分组下界"""
+        areas = np.sort(self.users['house_area'].dropna().to_numpy())
+        base, extra = divmod(len(areas), quantiles)
+        edges, start = [], 0
+        for tile in range(quantiles):
+            size = base + (1 if tile < extra else 0)
+            if size == 0:
+                break
+            edges.append(float(areas[start]))
+            start += size
+        return edges
@@ -3,11 +3,16 @@
 运行此脚本将测试所有API接口并输出结果
 """
 
+import argparse
 import requests
 import json
+import random
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 # API基础配置
 BASE_URL = "http://localhost:8000"
@@ -865,23 +870,292 @@ class APITester:
         finally:
             self.print_summary()
 
+
+# 压测负载配置：(接口模板, 方法, 权重)，读写比例近似线上流量
+LOAD_PROFILES = {
+    "mixed": [
+        ("/users/{user_id}", "GET", 20),
+        ("/users/{user_id}/devices", "GET", 15),
+        ("/users/{user_id}/usage-records", "GET", 15),
+        ("/devices/{device_id}/usage-records", "GET", 10),
+        ("/usage-records/?limit=100", "GET", 8),
+        ("/security-events/?limit=100", "GET", 5),
+        ("/analytics/device-usage", "GET", 2),
+        ("/analytics/user-habits?limit=20", "GET", 2),
+        ("/analytics/house-area-impact", "GET", 2),
+        ("/analytics/energy-consumption", "GET", 2),
+        ("/usage-records/", "POST", 12),
+        ("/security-events/", "POST", 4),
+        ("/usage-records/{record_id}", "DELETE", 3),
+    ],
+    "read": [
+        ("/users/{user_id}", "GET", 30),
+        ("/users/{user_id}/devices", "GET", 20),
+        ("/users/{user_id}/usage-records", "GET", 20),
+        ("/devices/{device_id}/usage-records", "GET", 15),
+        ("/usage-records/?limit=100", "GET", 10),
+        ("/security-events/?limit=100", "GET", 5),
+    ],
+    "write": [
+        ("/usage-records/", "POST", 70),
+        ("/security-events/", "POST", 20),
+        ("/usage-records/{record_id}", "DELETE", 10),
+    ],
+    "analytics": [
+        ("/analytics/device-usage", "GET", 1),
+        ("/analytics/user-habits?limit=20", "GET", 1),
+        ("/analytics/house-area-impact", "GET", 1),
+        ("/analytics/energy-consumption", "GET", 1),
+    ],
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法百分位数，sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class LoadTester:
+    """并发压测：多个客户端线程按负载配置随机发请求，可限定总请求速率
+
+    rate 为 None 时每个客户端收到响应后立即发下一个请求（闭环）；
+    指定 rate 时按固定间隔统一排定发送时刻（开环），延迟从排定时刻算起，服务端变慢时排队时间也计入延迟。
+    """
+
+    def __init__(self, base_url: str = BASE_URL, clients: int = 10, duration: float = 30,
+                 rate: Optional[float] = None, profile: str = "mixed", seed: int = 42, timeout: float = 30):
+        if profile not in LOAD_PROFILES:
+            raise ValueError(f"未知的负载配置: {profile}")
+        self.base_url = base_url
+        self.clients = clients
+        self.duration = duration
+        self.rate = rate
+        self.profile = profile
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.operations = LOAD_PROFILES[profile]
+        self.weights = [weight for _, _, weight in self.operations]
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_slot = 0
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+        self._error_samples = {}
+        self._created_record_ids = []
+
+        self.user_ids: List[int] = []
+        self.devices: List[Dict[str, Any]] = []
+
+    def _session(self) -> requests.Session:
+        # 每个客户端线程一个连接复用的会话
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            self._local.session.headers.update(HEADERS)
+        return self._local.session
+
+    def prepare(self):
+        """取一批现有用户和设备作为请求参数"""
+        session = self._session()
+        self.user_ids = [user["user_id"] for user in
+                         session.get(f"{self.base_url}/users/?limit=500", timeout=self.timeout).json()]
+        self.devices = session.get(f"{self.base_url}/devices/?limit=500", timeout=self.timeout).json()
+        if not self.user_ids or not self.devices:
+            raise RuntimeError("数据库中没有用户或设备，请先导入数据或运行 generate_data.py")
+
+    def _build_request(self, template: str, method: str):
+        """按接口模板填入随机的现有 ID，返回 ((方法, 接口模板), URL 路径, 请求体)"""
+        with self._lock:
+            rng = self.random
+            device = rng.choice(self.devices)
+            user_id = rng.choice(self.user_ids)
+            record_id = None
+            if "{record_id}" in template:
+                if self._created_record_ids:
+                    record_id = self._created_record_ids.pop(rng.randrange(len(self._created_record_ids)))
+                else:
+                    # 还没有本次压测创建的记录可删，改为创建一条
+                    template, method = "/usage-records/", "POST"
+            offset = rng.randint(0, 30 * 24 * 60)
+
+        endpoint = template.format(user_id=user_id, device_id=device["device_id"], record_id=record_id)
+        data = None
+        if method == "POST" and template == "/usage-records/":
+            start = datetime.now() - timedelta(minutes=offset)
+            data = {
+                "user_id": device["user_id"],
+                "device_id": device["device_id"],
+                "start_time": start.isoformat(),
+                "end_time": (start + timedelta(minutes=30)).isoformat(),
+                "operation_type": "开机"
+            }
+        elif method == "POST" and template == "/security-events/":
+            data = {
+                "user_id": device["user_id"],
+                "device_id": device["device_id"],
+                "event_type": "移动检测",
+                "severity_level": "低",
+                "description": "压测事件"
+            }
+        return (method, template), endpoint, data
+
+    def _wait_for_slot(self) -> Optional[float]:
+        """开环模式下领取下一个发送时刻并等待，返回排定时刻；超出压测时长时返回 None"""
+        with self._lock:
+            slot = self._started + self._next_slot / self.rate
+            self._next_slot += 1
+        if slot >= self._deadline:
+            return None
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return slot
+
+    def _client(self):
+        session = self._session()
+        while True:
+            if self.rate:
+                scheduled = self._wait_for_slot()
+                if scheduled is None:
+                    return
+            else:
+                if time.perf_counter() >= self._deadline:
+                    return
+                scheduled = time.perf_counter()
+
+            with self._lock:
+                template, method, _ = self.random.choices(self.operations, weights=self.weights)[0]
+            key, endpoint, data = self._build_request(template, method)
+            status, error = 0, None
+            try:
+                response = session.request(key[0], f"{self.base_url}{endpoint}", json=data, timeout=self.timeout)
+                status = response.status_code
+                if status >= 400:
+                    error = f"HTTP {status}: {response.text[:200]}"
+                elif key == ("POST", "/usage-records/"):
+                    with self._lock:
+                        self._created_record_ids.append(response.json()["record_id"])
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            latency = time.perf_counter() - scheduled
+
+            with self._lock:
+                self._latencies[key].append(latency)
+                if error:
+                    self._errors[key] += 1
+                    self._error_samples.setdefault(key, error)
+
+    def run(self) -> Dict[str, Any]:
+        """执行压测，返回各接口和整体的统计"""
+        self.prepare()
+        self._started = time.perf_counter()
+        self._deadline = self._started + self.duration
+        with ThreadPoolExecutor(max_workers=self.clients) as pool:
+            for future in [pool.submit(self._client) for _ in range(self.clients)]:
+                future.result()
+        elapsed = time.perf_counter() - self._started
+        return self._report(elapsed)
+
+    def cleanup(self):
+        """删除压测中创建且未被删除的使用记录"""
+        session = self._session()
+        for record_id in self._created_record_ids:
+            session.delete(f"{self.base_url}/usage-records/{record_id}", timeout=self.timeout)
+        self._created_record_ids = []
+
+    def _summarize(self, latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+        values = sorted(latencies)
+        return {
+            "requests": len(values),
+            "errors": errors,
+            "error_rate": round(errors / len(values), 4) if values else 0.0,
+            "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0.0
+        }
+
+    def _report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {
+            f"{method} {template}": self._summarize(latencies, self._errors[(method, template)], elapsed)
+            for (method, template), latencies in sorted(self._latencies.items())
+        }
+        all_latencies = [latency for latencies in self._latencies.values() for latency in latencies]
+        return {
+            "profile": self.profile,
+            "clients": self.clients,
+            "target_rps": self.rate,
+            "duration_seconds": round(elapsed, 2),
+            "total": self._summarize(all_latencies, sum(self._errors.values()), elapsed),
+            "endpoints": endpoints,
+            "error_samples": {f"{method} {template}": sample
+                              for (method, template), sample in self._error_samples.items()}
+        }
+
+
+def print_load_report(report: Dict[str, Any]):
+    """打印压测结果"""
+    print("=" * 100)
+    target = f"{report['target_rps']} req/s" if report["target_rps"] else "不限（闭环）"
+    print(f"压测结果 | 负载: {report['profile']} | 并发客户端: {report['clients']} | "
+          f"目标速率: {target} | 时长: {report['duration_seconds']}s")
+    print("=" * 100)
+    print(f"{'接口':<48}{'请求数':>8}{'错误率':>9}{'吞吐(req/s)':>13}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    rows = list(report["endpoints"].items()) + [("总计", report["total"])]
+    for name, stats in rows:
+        print(f"{name:<48}{stats['requests']:>8}{stats['error_rate'] * 100:>8.1f}%{stats['throughput_rps']:>13.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    if report["error_samples"]:
+        print("\n错误示例:")
+        for name, sample in report["error_samples"].items():
+            print(f"     {name}: {sample}")
+    print("=" * 100)
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="智能家居管理系统 API 测试")
+    parser.add_argument("--base-url", default=BASE_URL, help=f"API 地址 (默认: {BASE_URL})")
+    parser.add_argument("--load", action="store_true", help="压测模式：并发发送混合负载并统计延迟分位数")
+    parser.add_argument("--clients", type=int, default=10, help="压测并发客户端数 (默认: 10)")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长，秒 (默认: 30)")
+    parser.add_argument("--rate", type=float, help="目标总请求速率 req/s，不指定时客户端收到响应后立即发下一个请求")
+    parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default="mixed", help="压测负载配置 (默认: mixed)")
+    parser.add_argument("--json", help="把压测结果写入 JSON 文件，便于对比不同部署参数")
+    parser.add_argument("--keep-data", action="store_true", help="压测结束后保留创建的使用记录")
+    args = parser.parse_args()
+
     # 检查系统是否可用
     try:
-        response = requests.get("http://localhost:8000/health", timeout=5)
+        response = requests.get(f"{args.base_url}/health", timeout=5)
         if response.status_code != 200:
             print("   系统检查失败，请确保系统已启动")
             return
     except requests.exceptions.RequestException:
-        print("   无法连接到系统，请确保系统已启动在 http://localhost:8000")
+        print(f"   无法连接到系统，请确保系统已启动在 {args.base_url}")
         return
     
     print("  系统连接正常，开始测试...")
     print()
+
+    if args.load:
+        load_tester = LoadTester(args.base_url, clients=args.clients, duration=args.duration,
+                                 rate=args.rate, profile=args.profile)
+        report = load_tester.run()
+        if not args.keep_data:
+            load_tester.cleanup()
+        print_load_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return
     
     # 创建测试器并运行测试
     tester = APITester()
+    tester.base_url = args.base_url
     tester.run_all_tests()
 
 if __name__ == "__main__":
@@ -1,44 +1,542 @@
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.font_manager import FontProperties
-import seaborn as sns
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, select
+from config import HOUSE_AREA_CONFIG
 import database
+import energy_stats
+import purge
+import rollup
+import hashlib
+import json
 import os
+import time
 
-# 设置中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']  # 支持中文显示
-plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+_pyplot = None
+
+# (结果键, 图表名/文件名, 中文名称)，generate_all_visualizations 按此顺序生成
+CHARTS = [
+    ('device_usage', 'device_usage_analysis', '设备使用分析'),
+    ('user_activity', 'user_activity_patterns', '用户活动模式'),
+    ('user_habits', 'user_habits_analysis', '用户习惯分析'),
+    ('house_area', 'house_area_impact', '房屋面积影响'),
+    ('energy_consumption', 'energy_consumption_analysis', '能耗分析'),
+]
+
+# 每张图表读取的表，数据指纹由这些表的行数、最大主键和最大 updated_at（有该列时）组成
+CHART_SOURCES = {
+    'device_usage_analysis': ('usage_records', 'devices', 'device_types'),
+    'user_activity_patterns': ('usage_records', 'users'),
+    'user_habits_analysis': ('usage_records', 'devices', 'users'),
+    'house_area_impact': ('usage_records', 'devices', 'device_types', 'users'),
+    'energy_consumption_analysis': ('usage_records', 'devices', 'device_types', 'users'),
+}
+
+def _load_pyplot():
+    """首次绘图时才导入 matplotlib 并设置中文字体，只导入本模块不加载绘图库"""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib.pyplot as plt
+        # 设置中文字体
+        plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']  # 支持中文显示
+        plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+        _pyplot = plt
+    return _pyplot
+
+def _save_figure(plt, path: str):
+    plt.tight_layout()
+    plt.savefig(path, dpi=300, bbox_inches='tight')
+    plt.close()
+
+# ==================== 绘图函数 ====================
+# 只接收查询好的普通数据（列表/字典），不访问数据库，可以在子进程中执行
+
+def render_device_usage_analysis(data: dict, path: str):
+    """绘制设备使用分析图表"""
+    import numpy as np
+    plt = _load_pyplot()
+    devices = data['devices']
+    usage_counts = data['usage_counts']
+    total_hours = data['total_hours']
+    avg_durations = data['avg_durations']
+
+    # 创建子图
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
+    fig.suptitle('设备使用分析报告 (API数据源)', fontsize=16, fontweight='bold')
+
+    # 1. 设备使用频次柱状图
+    ax1.bar(devices, usage_counts, color='skyblue', alpha=0.7)
+    ax1.set_title('设备使用频次', fontsize=14)
+    ax1.set_xlabel('设备名称')
+    ax1.set_ylabel('使用次数')
+    ax1.tick_params(axis='x', rotation=45)
+
+    # 2. 设备总使用时长
+    ax2.barh(devices, total_hours, color='lightgreen', alpha=0.7)
+    ax2.set_title('设备总使用时长', fontsize=14)
+    ax2.set_xlabel('使用时长 (小时)')
+    ax2.set_ylabel('设备名称')
+
+    # 3. 平均使用时长
+    colors = plt.cm.viridis(np.linspace(0, 1, len(devices)))
+    ax3.scatter(range(len(devices)), avg_durations, c=colors, s=100, alpha=0.7)
+    ax3.set_title('平均使用时长', fontsize=14)
+    ax3.set_xlabel('设备序号')
+    ax3.set_ylabel('平均时长 (小时)')
+    ax3.set_xticks(range(len(devices)))
+    ax3.set_xticklabels([f'设备{i+1}' for i in range(len(devices))])
+
+    # 4. 使用时长分布饼图
+    if sum(total_hours) > 0:
+        ax4.pie(total_hours, labels=devices, autopct='%1.1f%%', startangle=90)
+        ax4.set_title('设备使用时长分布', fontsize=14)
+    else:
+        ax4.text(0.5, 0.5, '暂无使用数据', ha='center', va='center', transform=ax4.transAxes)
+
+    _save_figure(plt, path)
+
+def render_user_activity_patterns(data: dict, path: str):
+    """绘制用户活动模式图表"""
+    import numpy as np
+    plt = _load_pyplot()
+    activity_data = data['activity_data']
+
+    # 创建图表
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(15, 10))
+    fig.suptitle('用户活动模式分析', fontsize=16, fontweight='bold')
+
+    # 1. 24小时活动热力图
+    if activity_data:
+        users = list(activity_data.keys())
+        hours_data = np.array([activity_data[user] for user in users])
+
+        im = ax1.imshow(hours_data, cmap='Blues', aspect='auto')
+        ax1.set_title('用户24小时活动热力图', fontsize=14)
+        ax1.set_xlabel('小时')
+        ax1.set_ylabel('用户')
+        ax1.set_xticks(range(24))
+        ax1.set_xticklabels([f'{i:02d}:00' for i in range(24)])
+        ax1.set_yticks(range(len(users)))
+        ax1.set_yticklabels(users)
+
+        # 添加颜色条
+        cbar = plt.colorbar(im, ax=ax1)
+        cbar.set_label('活动次数')
+
+    # 2. 整体活动趋势
+    total_activity = [0] * 24
+    for user_data in activity_data.values():
+        for i, count in enumerate(user_data):
+            total_activity[i] += count
+
+    ax2.plot(range(24), total_activity, marker='o', linewidth=2, markersize=6)
+    ax2.fill_between(range(24), total_activity, alpha=0.3)
+    ax2.set_title('整体24小时活动趋势', fontsize=14)
+    ax2.set_xlabel('小时')
+    ax2.set_ylabel('总活动次数')
+    ax2.set_xticks(range(0, 24, 2))
+    ax2.set_xticklabels([f'{i:02d}:00' for i in range(0, 24, 2)])
+    ax2.grid(True, alpha=0.3)
+
+    _save_figure(plt, path)
+
+def render_user_habits_analysis(data: dict, path: str):
+    """绘制用户使用习惯分析图表"""
+    plt = _load_pyplot()
+    user_device_usage = data['user_device_usage']
+
+    # 创建图表
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
+    fig.suptitle('用户使用习惯分析 (API数据源)', fontsize=16, fontweight='bold')
+
+    # 1. 用户设备使用频次对比
+    if user_device_usage:
+        users = list(user_device_usage.keys())[:5]  # 取前5个用户
+        all_devices = set()
+        for user_data in user_device_usage.values():
+            all_devices.update(user_data.keys())
+        devices = list(all_devices)[:8]  # 取前8个设备
+
+        # 创建使用频次矩阵
+        usage_matrix = []
+        for user in users:
+            user_usage = []
+            for device in devices:
+                count = user_device_usage.get(user, {}).get(device, {}).get('count', 0)
+                user_usage.append(count)
+            usage_matrix.append(user_usage)
+
+        # 绘制热力图
+        im1 = ax1.imshow(usage_matrix, cmap='YlOrRd', aspect='auto')
+        ax1.set_title('用户设备使用频次热力图', fontsize=12)
+        ax1.set_xlabel('设备')
+        ax1.set_ylabel('用户')
+        ax1.set_xticks(range(len(devices)))
+        ax1.set_xticklabels(devices, rotation=45)
+        ax1.set_yticks(range(len(users)))
+        ax1.set_yticklabels(users)
+
+        # 2. 用户最常用设备排行
+        if users:
+            user = users[0]  # 选择第一个用户
+            user_devices = user_device_usage[user]
+            sorted_devices = sorted(user_devices.items(),
+                                  key=lambda x: x[1]['count'], reverse=True)[:6]
+
+            device_names = [item[0] for item in sorted_devices]
+            counts = [item[1]['count'] for item in sorted_devices]
+
+            ax2.bar(range(len(device_names)), counts, color='lightcoral', alpha=0.7)
+            ax2.set_title(f'{user} 最常用设备排行', fontsize=12)
+            ax2.set_xlabel('设备排名')
+            ax2.set_ylabel('使用次数')
+            ax2.set_xticks(range(len(device_names)))
+            ax2.set_xticklabels([f'第{i+1}名' for i in range(len(device_names))])
+
+            # 添加设备名称标签
+            for i, (name, count) in enumerate(zip(device_names, counts)):
+                ax2.text(i, count + 0.5, name, ha='center', va='bottom',
+                        rotation=45, fontsize=8)
+
+        # 3. 用户使用时长分布
+        total_hours_by_user = {}
+        for user, devices_data in user_device_usage.items():
+            total_hours = sum(usage['hours'] for usage in devices_data.values())
+            total_hours_by_user[user] = total_hours
+
+        if total_hours_by_user:
+            users_sorted = sorted(total_hours_by_user.items(),
+                                key=lambda x: x[1], reverse=True)[:6]
+            user_names = [item[0] for item in users_sorted]
+            hours = [item[1] for item in users_sorted]
+
+            ax3.pie(hours, labels=user_names, autopct='%1.1f%%', startangle=90)
+            ax3.set_title('用户使用时长分布', fontsize=12)
+
+        # 4. 设备使用时段偏好
+        hour_usage = data['hour_usage']
+        ax4.plot(range(24), hour_usage, marker='s', linewidth=2,
+                color='green', markersize=4)
+        ax4.fill_between(range(24), hour_usage, alpha=0.3, color='green')
+        ax4.set_title('设备使用时段偏好', fontsize=12)
+        ax4.set_xlabel('小时')
+        ax4.set_ylabel('使用次数')
+        ax4.set_xticks(range(0, 24, 3))
+        ax4.set_xticklabels([f'{i:02d}:00' for i in range(0, 24, 3)])
+        ax4.grid(True, alpha=0.3)
+
+    _save_figure(plt, path)
+
+def render_house_area_impact(data: dict, path: str):
+    """绘制房屋面积影响分析图表"""
+    import numpy as np
+    plt = _load_pyplot()
+    areas = data['areas']
+    device_counts = data['device_counts']
+    usage_hours = data['usage_hours']
+
+    # 创建图表
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
+    fig.suptitle('房屋面积影响分析 (API数据源)', fontsize=16, fontweight='bold')
+
+    # 1. 面积与设备数量散点图
+    if areas:
+        ax1.scatter(areas, device_counts, alpha=0.6, s=60, c='blue')
+        ax1.set_title('房屋面积 vs 设备数量', fontsize=14)
+        ax1.set_xlabel('房屋面积 (㎡)')
+        ax1.set_ylabel('设备数量')
+        ax1.grid(True, alpha=0.3)
+
+        # 添加趋势线
+        if len(areas) > 1:
+            z = np.polyfit(areas, device_counts, 1)
+            p = np.poly1d(z)
+            ax1.plot(areas, p(areas), "r--", alpha=0.8)
+
+    # 2. 面积与使用时长散点图
+    if areas:
+        ax2.scatter(areas, usage_hours, alpha=0.6, s=60, c='green')
+        ax2.set_title('房屋面积 vs 使用时长', fontsize=14)
+        ax2.set_xlabel('房屋面积 (㎡)')
+        ax2.set_ylabel('总使用时长 (小时)')
+        ax2.grid(True, alpha=0.3)
+
+        # 添加趋势线
+        if len(areas) > 1:
+            z = np.polyfit(areas, usage_hours, 1)
+            p = np.poly1d(z)
+            ax2.plot(areas, p(areas), "r--", alpha=0.8)
+
+    # 3. 不同面积区间的平均设备数量（基于API数据）
+    ranges = data['ranges']
+
+    ax3.bar(ranges, data['avg_devices'], color='orange', alpha=0.7)
+    ax3.set_title('不同面积区间的平均设备数量', fontsize=14)
+    ax3.set_xlabel('面积区间')
+    ax3.set_ylabel('平均设备数量')
+    ax3.tick_params(axis='x', rotation=45)
+
+    # 4. 不同面积区间的平均使用时长（基于API数据）
+    ax4.bar(ranges, data['avg_usage'], color='purple', alpha=0.7)
+    ax4.set_title('不同面积区间的平均使用时长', fontsize=14)
+    ax4.set_xlabel('面积区间')
+    ax4.set_ylabel('平均使用时长 (小时)')
+    ax4.tick_params(axis='x', rotation=45)
+
+    _save_figure(plt, path)
+
+def render_energy_consumption_analysis(data: dict, path: str):
+    """绘制能耗分析图表"""
+    import numpy as np
+    plt = _load_pyplot()
+    energy_by_device_type = data['energy_by_device_type']
+    top_energy_users = data['top_energy_users']
+    efficiency_data = data['efficiency']
+
+    # 创建子图
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
+    fig.suptitle('能耗分析报告 (API数据源)', fontsize=16, fontweight='bold')
+
+    # 1. 设备类型能耗对比柱状图（基于API数据）
+    if energy_by_device_type:
+        type_names = [item['type_name'] for item in energy_by_device_type]
+        type_energies = [item['total_energy'] for item in energy_by_device_type]
+
+        bars = ax1.bar(range(len(type_names)), type_energies,
+                      color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD'])
+        ax1.set_title('设备类型能耗对比 (API数据)', fontsize=14)
+        ax1.set_xlabel('设备类型')
+        ax1.set_ylabel('总能耗 (千瓦时)')
+        ax1.set_xticks(range(len(type_names)))
+        ax1.set_xticklabels(type_names, rotation=45, ha='right')
+
+        # 在柱子上显示数值
+        for bar, energy in zip(bars, type_energies):
+            ax1.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
+                    f'{energy:.2f}', ha='center', va='bottom')
+
+    # 2. 设备类型能耗饼图（基于API数据）
+    if energy_by_device_type:
+        ax2.pie(type_energies, labels=type_names, autopct='%1.1f%%', startangle=90,
+                colors=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD'])
+        ax2.set_title('设备类型能耗占比 (API数据)', fontsize=14)
+
+    # 3. 用户能耗排行榜（基于API数据）
+    if top_energy_users:
+        usernames = [item['username'] for item in top_energy_users]
+        user_energies = [item['total_energy'] for item in top_energy_users]
+
+        bars = ax3.barh(range(len(usernames)), user_energies, color='lightcoral')
+        ax3.set_title('用户能耗排行榜 (API数据)', fontsize=14)
+        ax3.set_xlabel('总能耗 (千瓦时)')
+        ax3.set_ylabel('用户')
+        ax3.set_yticks(range(len(usernames)))
+        ax3.set_yticklabels(usernames)
+
+        # 在柱子上显示数值
+        for bar, energy in zip(bars, user_energies):
+            ax3.text(bar.get_width() + 0.1, bar.get_y() + bar.get_height()/2,
+                    f'{energy:.2f}', ha='left', va='center')
+
+    # 4. 能耗效率分析（实际功耗 vs 额定功耗）
+    if efficiency_data:
+        device_names = [row['device_name'] for row in efficiency_data]
+        rated_powers = [row['rated_power'] for row in efficiency_data]
+        actual_powers = [row['actual_power'] for row in efficiency_data]
+
+        x = np.arange(len(device_names))
+        width = 0.35
+
+        ax4.bar(x - width/2, rated_powers, width, label='额定功耗', alpha=0.8, color='skyblue')
+        ax4.bar(x + width/2, actual_powers, width, label='实际功耗', alpha=0.8, color='orange')
+
+        ax4.set_title('设备功耗效率对比', fontsize=14)
+        ax4.set_xlabel('设备')
+        ax4.set_ylabel('功耗 (瓦)')
+        ax4.set_xticks(x)
+        ax4.set_xticklabels([f'设备{i+1}' for i in range(len(device_names))], rotation=45)
+        ax4.legend()
+        ax4.grid(True, alpha=0.3)
+    else:
+        ax4.text(0.5, 0.5, '暂无功耗效率数据', ha='center', va='center',
+                transform=ax4.transAxes, fontsize=14)
+
+    _save_figure(plt, path)
+
+_RENDERERS = {
+    'device_usage_analysis': render_device_usage_analysis,
+    'user_activity_patterns': render_user_activity_patterns,
+    'user_habits_analysis': render_user_habits_analysis,
+    'house_area_impact': render_house_area_impact,
+    'energy_consumption_analysis': render_energy_consumption_analysis,
+}
+
+def _init_render_worker():
+    """绘图子进程初始化：强制使用无界面的 Agg 后端"""
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+def _render_chart(name: str, data: dict, path: str):
+    """在子进程中绘制一张图表，返回 (保存路径, 绘图耗时秒数)"""
+    start = time.perf_counter()
+    _RENDERERS[name](data, path)
+    return path, time.perf_counter() - start
+
+# ==================== 数据指纹 ====================
+# 指纹文件与图表同名、扩展名为 .fingerprint，保存生成该图表时输入数据的指纹
+
+def _table_state(db: Session, table_name: str) -> list:
+    """一次查询取表的行数、最大主键和最大 updated_at"""
+    table = database.Base.metadata.tables[table_name]
+    columns = [func.count(), func.max(list(table.primary_key.columns)[0])]
+    if 'updated_at' in table.c:
+        columns.append(func.max(table.c.updated_at))
+    return list(db.execute(select(*columns).select_from(table)).one())
+
+def _fingerprint_path(path: str) -> str:
+    return os.path.splitext(path)[0] + '.fingerprint'
+
+def _fingerprint_matches(path: str, fingerprint: str) -> bool:
+    """图表文件存在且保存的指纹与当前指纹一致"""
+    try:
+        with open(_fingerprint_path(path), encoding='utf-8') as f:
+            stored = f.read().strip()
+    except OSError:
+        return False
+    return stored == fingerprint and os.path.exists(path)
+
+def _write_fingerprint(path: str, fingerprint: str):
+    with open(_fingerprint_path(path), 'w', encoding='utf-8') as f:
+        f.write(fingerprint)
+
+def _clear_fingerprint(path: str):
+    """重新绘图前删除旧指纹，绘图中途失败时不会把残缺的图表当作最新结果复用"""
+    if os.path.exists(_fingerprint_path(path)):
+        os.remove(_fingerprint_path(path))
 
 class SmartHomeVisualizer:
-    """智能家居数据可视化类"""
-    
-    def __init__(self, db: Session):
+    """智能家居数据可视化类
+
+    每张图表分两步：_fetch_* 在当前数据库会话上查询并整理出普通数据，
+    render_* 只根据这些数据绘图。generate_all_visualizations(parallel=True)
+    先在主进程查询全部数据，再把绘图分发到进程池。
+
+    绘图前先计算图表输入数据的指纹（见 CHART_SOURCES），与上次生成时保存的指纹一致且图表文件仍在时
+    直接复用，不再查询和绘图；force=True 时总是重新生成。
+
+    传入 snapshot.DataSnapshot 时，各图表的分析和辅助统计都在同一份内存快照上完成，
+    生成全部图表每张表只扫描一次。
+    """
+
+    def __init__(self, db: Session, use_rollup: bool = None, force: bool = False, snapshot=None):
         self.db = db
+        self.force = force
+        self.snapshot = snapshot
+        # 按小时分组的统计优先读小时汇总表（默认跟随 ROLLUP_CONFIG）
+        self.usage = rollup.usage_measures(use_rollup)
         self.output_dir = "visualizations"
         # 创建输出目录
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
-    
-    def plot_device_usage_analysis(self, save_path: str = None):
+
+    def _chart_path(self, name: str) -> str:
+        return f'{self.output_dir}/{name}.png'
+
+    def chart_fingerprint(self, name: str, states: dict = None) -> str:
+        """图表输入数据的指纹：数据源表的行数、最大主键、最大 updated_at 以及影响结果的配置
+
+        states 缓存本轮已查询过的表状态，一次生成多张图表时每张表只查一次。
+        devices/device_types 没有 updated_at，只修改已有设备的名称或功耗不会改变指纹，需要 force 重新生成。
+        """
+        states = {} if states is None else states
+        tables = list(CHART_SOURCES[name])
+        params = {}
+        if name == 'house_area_impact':
+            params['area_edges'] = HOUSE_AREA_CONFIG['edges']
+        if name == 'energy_consumption_analysis' and energy_stats.is_enabled():
+            # 能耗报告改读能耗统计表时，物化进度（水位线更新时间）也是输入
+            params['energy_stats'] = True
+            tables.append('materializer_watermarks')
+        # 登记或完成删除任务会改变可见的数据
+        tables.append('purge_jobs')
+
+        for table_name in tables:
+            if table_name not in states:
+                states[table_name] = _table_state(self.db, table_name)
+        payload = {
+            'chart': name,
+            'params': params,
+            'tables': {table_name: states[table_name] for table_name in tables}
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _prepare(self, name: str, label: str, path: str, timing: dict, states: dict = None, snapshot=None):
+        """计算指纹并查询图表数据，返回 (是否复用已有图表, 图表数据, 指纹)"""
+        start = time.perf_counter()
+        fingerprint = self.chart_fingerprint(name, states)
+        timing['fingerprint'] = round(time.perf_counter() - start, 3)
+        if not self.force and _fingerprint_matches(path, fingerprint):
+            print(f"{label}数据未变化，复用已有图表: {path}")
+            return True, None, fingerprint
+
+        _clear_fingerprint(path)
+        start = time.perf_counter()
+        data = getattr(self, f'_fetch_{name}')(snapshot if snapshot is not None else self.snapshot)
+        timing['fetch'] = round(time.perf_counter() - start, 3)
+        return False, data, fingerprint
+
+    def _plot(self, name: str, label: str, save_path: str = None, timing: dict = None, states: dict = None,
+              snapshot=None):
+        """查询数据并在当前进程绘图，数据未变化时复用已有图表，数据不足时返回 None"""
+        timing = {} if timing is None else timing
+        path = save_path or self._chart_path(name)
+        reused, data, fingerprint = self._prepare(name, label, path, timing, states, snapshot)
+        if reused:
+            return path
+        if data is None:
+            return None
+        start = time.perf_counter()
+        _RENDERERS[name](data, path)
+        timing['render'] = round(time.perf_counter() - start, 3)
+        _write_fingerprint(path, fingerprint)
+        print(f"{label}图表已保存: {path}")
+        return path
+
+    def plot_device_usage_analysis(self, save_path: str = None, snapshot=None):
         """绘制设备使用分析图表 - 基于API数据"""
+        return self._plot('device_usage_analysis', '设备使用分析', save_path, snapshot=snapshot)
+
+    def plot_user_activity_patterns(self, save_path: str = None, snapshot=None):
+        """绘制用户活动模式图表 - 直接数据库查询（无对应API）"""
+        return self._plot('user_activity_patterns', '用户活动模式', save_path, snapshot=snapshot)
+
+    def plot_user_habits_analysis(self, save_path: str = None, snapshot=None):
+        """绘制用户使用习惯分析图表 - 基于API数据"""
+        return self._plot('user_habits_analysis', '用户习惯分析', save_path, snapshot=snapshot)
+
+    def plot_house_area_impact(self, save_path: str = None, snapshot=None):
+        """绘制房屋面积影响分析图表 - 基于API数据"""
+        return self._plot('house_area_impact', '房屋面积影响', save_path, snapshot=snapshot)
+
+    def plot_energy_consumption_analysis(self, save_path: str = None, snapshot=None):
+        """绘制能耗分析图表 - 基于API数据"""
+        return self._plot('energy_consumption_analysis', '能耗分析', save_path, snapshot=snapshot)
+
+    def _fetch_device_usage_analysis(self, snapshot=None):
+        """查询设备使用分析图表数据"""
         from analytics import SmartHomeAnalytics
-        
+
         print("开始获取设备使用分析数据 (来自API)...")
-        
+
         # 使用API数据源
-        analytics = SmartHomeAnalytics(self.db)
+        analytics = SmartHomeAnalytics(self.db, snapshot=snapshot)
         api_data = analytics.analyze_device_usage_frequency()
-        
+
         # 打印设备使用分析数据
         print("\n" + "="*60)
         print("设备使用分析数据详情 (API数据源)")
         print("="*60)
-        
+
         print("\n1. 设备使用详细统计:")
         print("-" * 50)
         if api_data:
@@ -52,111 +550,74 @@ class SmartHomeVisualizer:
                 print()
         else:
             print("  暂无设备使用数据")
-        
+
         print(f"总计统计设备数: {len(api_data)}")
         total_hours = sum(device.total_usage_hours for device in api_data)
         total_frequency = sum(device.usage_frequency for device in api_data)
         print(f"所有设备总使用时长: {total_hours:.2f} 小时")
         print(f"所有设备总使用频次: {total_frequency} 次")
         print("="*60)
-        
+
         if not api_data:
             print("没有足够的数据生成设备使用分析图表")
             return None
-        
-        # 数据处理
-        devices = [device.device_name for device in api_data]
-        usage_counts = [device.usage_frequency for device in api_data]
-        total_hours = [device.total_usage_hours for device in api_data]
-        avg_durations = [device.avg_session_duration / 60 for device in api_data]  # 转换为小时
-        
-        # 创建子图
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
-        fig.suptitle('设备使用分析报告 (API数据源)', fontsize=16, fontweight='bold')
-        
-        # 1. 设备使用频次柱状图
-        ax1.bar(devices, usage_counts, color='skyblue', alpha=0.7)
-        ax1.set_title('设备使用频次', fontsize=14)
-        ax1.set_xlabel('设备名称')
-        ax1.set_ylabel('使用次数')
-        ax1.tick_params(axis='x', rotation=45)
-        
-        # 2. 设备总使用时长
-        ax2.barh(devices, total_hours, color='lightgreen', alpha=0.7)
-        ax2.set_title('设备总使用时长', fontsize=14)
-        ax2.set_xlabel('使用时长 (小时)')
-        ax2.set_ylabel('设备名称')
-        
-        # 3. 平均使用时长
-        colors = plt.cm.viridis(np.linspace(0, 1, len(devices)))
-        ax3.scatter(range(len(devices)), avg_durations, c=colors, s=100, alpha=0.7)
-        ax3.set_title('平均使用时长', fontsize=14)
-        ax3.set_xlabel('设备序号')
-        ax3.set_ylabel('平均时长 (小时)')
-        ax3.set_xticks(range(len(devices)))
-        ax3.set_xticklabels([f'设备{i+1}' for i in range(len(devices))])
-        
-        # 4. 使用时长分布饼图
-        if sum(total_hours) > 0:
-            ax4.pie(total_hours, labels=devices, autopct='%1.1f%%', startangle=90)
-            ax4.set_title('设备使用时长分布', fontsize=14)
-        else:
-            ax4.text(0.5, 0.5, '暂无使用数据', ha='center', va='center', transform=ax4.transAxes)
-        
-        plt.tight_layout()
-        
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        else:
-            plt.savefig(f'{self.output_dir}/device_usage_analysis.png', dpi=300, bbox_inches='tight')
-        
-        plt.close()
-        print(f"设备使用分析图表已保存: {self.output_dir}/device_usage_analysis.png")
-        return f'{self.output_dir}/device_usage_analysis.png'
-    
-    def plot_user_activity_patterns(self, save_path: str = None):
-        """绘制用户活动模式图表 - 直接数据库查询（无对应API）"""
+
+        return {
+            'devices': [device.device_name for device in api_data],
+            'usage_counts': [device.usage_frequency for device in api_data],
+            'total_hours': [device.total_usage_hours for device in api_data],
+            'avg_durations': [device.avg_session_duration / 60 for device in api_data],  # 转换为小时
+        }
+
+    def _fetch_user_activity_patterns(self, snapshot=None):
+        """查询用户活动模式图表数据"""
         print("开始获取用户活动模式数据 (直接数据库查询)...")
-        
+
         # 获取24小时活动数据
-        query = self.db.query(
-            func.hour(database.UsageRecord.start_time).label('hour'),
-            func.count(database.UsageRecord.record_id).label('activity_count'),
-            database.User.username
-        ).join(
-            database.User, database.UsageRecord.user_id == database.User.user_id
-        ).group_by(
-            func.hour(database.UsageRecord.start_time),
-            database.User.user_id
-        ).all()
-        
+        usage = self.usage
+        if snapshot is not None:
+            query = snapshot.user_hour_activity()
+        else:
+            query = self.db.query(
+                usage.hour.label('hour'),
+                usage.usage_count.label('activity_count'),
+                database.User.username
+            ).join(
+                database.User, usage.user_id == database.User.user_id
+            ).filter(
+                *purge.visible_filters(purge.hidden_ids(self.db), usage.user_id, usage.device_id)
+            ).group_by(
+                usage.hour,
+                database.User.user_id
+            ).all()
+
         # 打印用户活动模式数据
         print("\n" + "="*60)
         print("用户活动模式数据详情 (直接数据库查询)")
         print("="*60)
-        
+
         if not query:
             print("没有足够的数据生成用户活动模式图表")
             return None
-        
+
         # 数据整理
         activity_data = {}
         hourly_summary = {}
-        
+
         for row in query:
             username = row.username
-            hour = row.hour
-            count = row.activity_count
-            
+            hour = int(row.hour)
+            count = int(row.activity_count)
+
             if username not in activity_data:
                 activity_data[username] = [0] * 24
             activity_data[username][hour] = count
-            
+
             # 按小时汇总
             if hour not in hourly_summary:
                 hourly_summary[hour] = 0
             hourly_summary[hour] += count
-        
+
         print("\n1. 用户活动分布:")
         print("-" * 40)
         for username, hours_data in activity_data.items():
@@ -166,82 +627,36 @@ class SmartHomeVisualizer:
             print(f"    总活动次数: {total_activity}")
             print(f"    活跃时段: {active_hours}")
             print()
-        
+
         print("\n2. 24小时活动汇总:")
         print("-" * 40)
         for hour in sorted(hourly_summary.keys()):
             print(f"  {hour:02d}:00 - {hour+1:02d}:00: {hourly_summary[hour]} 次活动")
-        
+
         total_activities = sum(hourly_summary.values())
         peak_hour = max(hourly_summary.keys(), key=lambda x: hourly_summary[x])
         print(f"\n总活动次数: {total_activities}")
         print(f"最活跃时段: {peak_hour:02d}:00-{peak_hour+1:02d}:00 ({hourly_summary[peak_hour]}次)")
         print(f"统计用户数: {len(activity_data)}")
         print("="*60)
-        
-        # 创建图表
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(15, 10))
-        fig.suptitle('用户活动模式分析', fontsize=16, fontweight='bold')
-        
-        # 1. 24小时活动热力图
-        if activity_data:
-            users = list(activity_data.keys())
-            hours_data = np.array([activity_data[user] for user in users])
-            
-            im = ax1.imshow(hours_data, cmap='Blues', aspect='auto')
-            ax1.set_title('用户24小时活动热力图', fontsize=14)
-            ax1.set_xlabel('小时')
-            ax1.set_ylabel('用户')
-            ax1.set_xticks(range(24))
-            ax1.set_xticklabels([f'{i:02d}:00' for i in range(24)])
-            ax1.set_yticks(range(len(users)))
-            ax1.set_yticklabels(users)
-            
-            # 添加颜色条
-            cbar = plt.colorbar(im, ax=ax1)
-            cbar.set_label('活动次数')
-        
-        # 2. 整体活动趋势
-        total_activity = [0] * 24
-        for user_data in activity_data.values():
-            for i, count in enumerate(user_data):
-                total_activity[i] += count
-        
-        ax2.plot(range(24), total_activity, marker='o', linewidth=2, markersize=6)
-        ax2.fill_between(range(24), total_activity, alpha=0.3)
-        ax2.set_title('整体24小时活动趋势', fontsize=14)
-        ax2.set_xlabel('小时')
-        ax2.set_ylabel('总活动次数')
-        ax2.set_xticks(range(0, 24, 2))
-        ax2.set_xticklabels([f'{i:02d}:00' for i in range(0, 24, 2)])
-        ax2.grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        else:
-            plt.savefig(f'{self.output_dir}/user_activity_patterns.png', dpi=300, bbox_inches='tight')
-        
-        plt.close()
-        print(f"用户活动模式图表已保存: {self.output_dir}/user_activity_patterns.png")
-        return f'{self.output_dir}/user_activity_patterns.png'
-    
-    def plot_user_habits_analysis(self, save_path: str = None):
-        """绘制用户使用习惯分析图表 - 基于API数据"""
+
+        return {'activity_data': activity_data}
+
+    def _fetch_user_habits_analysis(self, snapshot=None):
+        """查询用户使用习惯分析图表数据"""
         from analytics import SmartHomeAnalytics
-        
+
         print("开始获取用户使用习惯数据 (来自API)...")
-        
+
         # 使用API数据源
-        analytics = SmartHomeAnalytics(self.db)
+        analytics = SmartHomeAnalytics(self.db, snapshot=snapshot)
         api_data = analytics.analyze_user_habits()
-        
+
         # 打印用户习惯分析数据
         print("\n" + "="*60)
         print("用户使用习惯数据详情 (API数据源)")
         print("="*60)
-        
+
         print("\n1. 用户习惯详细分析:")
         print("-" * 50)
         if api_data:
@@ -253,35 +668,42 @@ class SmartHomeVisualizer:
                 print()
         else:
             print("  暂无用户习惯数据")
-        
+
         # 统计汇总
         total_users = len(api_data)
         users_with_combinations = len([u for u in api_data if u.frequently_used_together])
         users_with_peaks = len([u for u in api_data if u.peak_activity_hours])
-        
+
         print(f"总用户数: {total_users}")
         print(f"有设备组合习惯的用户: {users_with_combinations}")
         print(f"有明显活跃时段的用户: {users_with_peaks}")
         print("="*60)
-        
+
         if not api_data:
             print("没有足够的数据生成用户习惯分析图表")
             return None
-        
+
         # 辅助数据查询（用于可视化图表）
-        user_device_query = self.db.query(
-            database.User.username,
-            database.Device.device_name,
-            func.count(database.UsageRecord.record_id).label('usage_count'),
-            func.sum(database.UsageRecord.duration_minutes).label('total_minutes')
-        ).join(
-            database.UsageRecord, database.User.user_id == database.UsageRecord.user_id
-        ).join(
-            database.Device, database.UsageRecord.device_id == database.Device.device_id
-        ).group_by(
-            database.User.user_id, database.Device.device_id
-        ).all()
-        
+        usage = self.usage
+        if snapshot is not None:
+            user_device_query = snapshot.user_device_usage()
+        else:
+            visible = purge.visible_filters(purge.hidden_ids(self.db), usage.user_id, usage.device_id)
+            user_device_query = self.db.query(
+                database.User.username,
+                database.Device.device_name,
+                usage.usage_count.label('usage_count'),
+                usage.total_minutes.label('total_minutes')
+            ).join(
+                usage.entity, database.User.user_id == usage.user_id
+            ).join(
+                database.Device, usage.device_id == database.Device.device_id
+            ).filter(
+                *visible
+            ).group_by(
+                database.User.user_id, database.Device.device_id
+            ).all()
+
         # 数据整理
         user_device_usage = {}
         for row in user_device_query:
@@ -289,129 +711,46 @@ class SmartHomeVisualizer:
             device = row.device_name
             usage_count = row.usage_count
             total_hours = round(float(row.total_minutes or 0) / 60, 2)
-            
+
             if username not in user_device_usage:
                 user_device_usage[username] = {}
             user_device_usage[username][device] = {
                 'count': usage_count,
                 'hours': total_hours
             }
-        
-        # 创建图表
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
-        fig.suptitle('用户使用习惯分析 (API数据源)', fontsize=16, fontweight='bold')
-        
-        # 1. 用户设备使用频次对比
+
+        # 设备使用时段偏好
+        hour_usage = [0] * 24
         if user_device_usage:
-            users = list(user_device_usage.keys())[:5]  # 取前5个用户
-            all_devices = set()
-            for user_data in user_device_usage.values():
-                all_devices.update(user_data.keys())
-            devices = list(all_devices)[:8]  # 取前8个设备
-            
-            # 创建使用频次矩阵
-            usage_matrix = []
-            for user in users:
-                user_usage = []
-                for device in devices:
-                    count = user_device_usage.get(user, {}).get(device, {}).get('count', 0)
-                    user_usage.append(count)
-                usage_matrix.append(user_usage)
-            
-            # 绘制热力图
-            im1 = ax1.imshow(usage_matrix, cmap='YlOrRd', aspect='auto')
-            ax1.set_title('用户设备使用频次热力图', fontsize=12)
-            ax1.set_xlabel('设备')
-            ax1.set_ylabel('用户')
-            ax1.set_xticks(range(len(devices)))
-            ax1.set_xticklabels(devices, rotation=45)
-            ax1.set_yticks(range(len(users)))
-            ax1.set_yticklabels(users)
-            
-            # 2. 用户最常用设备排行
-            if users:
-                user = users[0]  # 选择第一个用户
-                user_devices = user_device_usage[user]
-                sorted_devices = sorted(user_devices.items(), 
-                                      key=lambda x: x[1]['count'], reverse=True)[:6]
-                
-                device_names = [item[0] for item in sorted_devices]
-                counts = [item[1]['count'] for item in sorted_devices]
-                
-                ax2.bar(range(len(device_names)), counts, color='lightcoral', alpha=0.7)
-                ax2.set_title(f'{user} 最常用设备排行', fontsize=12)
-                ax2.set_xlabel('设备排名')
-                ax2.set_ylabel('使用次数')
-                ax2.set_xticks(range(len(device_names)))
-                ax2.set_xticklabels([f'第{i+1}名' for i in range(len(device_names))])
-                
-                # 添加设备名称标签
-                for i, (name, count) in enumerate(zip(device_names, counts)):
-                    ax2.text(i, count + 0.5, name, ha='center', va='bottom', 
-                            rotation=45, fontsize=8)
-            
-            # 3. 用户使用时长分布
-            total_hours_by_user = {}
-            for user, devices_data in user_device_usage.items():
-                total_hours = sum(data['hours'] for data in devices_data.values())
-                total_hours_by_user[user] = total_hours
-            
-            if total_hours_by_user:
-                users_sorted = sorted(total_hours_by_user.items(), 
-                                    key=lambda x: x[1], reverse=True)[:6]
-                user_names = [item[0] for item in users_sorted]
-                hours = [item[1] for item in users_sorted]
-                
-                ax3.pie(hours, labels=user_names, autopct='%1.1f%%', startangle=90)
-                ax3.set_title('用户使用时长分布', fontsize=12)
-            
-            # 4. 设备使用时段偏好
-            hour_usage = [0] * 24
-            hour_query = self.db.query(
-                func.hour(database.UsageRecord.start_time).label('hour'),
-                func.count(database.UsageRecord.record_id).label('count')
-            ).group_by(func.hour(database.UsageRecord.start_time)).all()
-            
+            if snapshot is not None:
+                hour_query = snapshot.hour_usage_counts()
+            else:
+                hour_query = self.db.query(
+                    usage.hour.label('hour'),
+                    usage.usage_count.label('count')
+                ).filter(*visible).group_by(usage.hour).all()
+
             for row in hour_query:
                 if row.hour is not None:
-                    hour_usage[row.hour] = row.count
-            
-            ax4.plot(range(24), hour_usage, marker='s', linewidth=2, 
-                    color='green', markersize=4)
-            ax4.fill_between(range(24), hour_usage, alpha=0.3, color='green')
-            ax4.set_title('设备使用时段偏好', fontsize=12)
-            ax4.set_xlabel('小时')
-            ax4.set_ylabel('使用次数')
-            ax4.set_xticks(range(0, 24, 3))
-            ax4.set_xticklabels([f'{i:02d}:00' for i in range(0, 24, 3)])
-            ax4.grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        else:
-            plt.savefig(f'{self.output_dir}/user_habits_analysis.png', dpi=300, bbox_inches='tight')
-        
-        plt.close()
-        print(f"用户习惯分析图表已保存: {self.output_dir}/user_habits_analysis.png")
-        return f'{self.output_dir}/user_habits_analysis.png'
-    
-    def plot_house_area_impact(self, save_path: str = None):
-        """绘制房屋面积影响分析图表 - 基于API数据"""
+                    hour_usage[int(row.hour)] = int(row.count)
+
+        return {'user_device_usage': user_device_usage, 'hour_usage': hour_usage}
+
+    def _fetch_house_area_impact(self, snapshot=None):
+        """查询房屋面积影响分析图表数据"""
         from analytics import SmartHomeAnalytics
-        
+
         print("开始获取房屋面积影响数据 (来自API)...")
-        
+
         # 使用API数据源
-        analytics = SmartHomeAnalytics(self.db)
+        analytics = SmartHomeAnalytics(self.db, snapshot=snapshot)
         api_data = analytics.analyze_house_area_impact()
-        
+
         # 打印房屋面积影响分析数据
         print("\n" + "="*60)
         print("房屋面积影响分析数据详情 (API数据源)")
         print("="*60)
-        
+
         print("\n1. 不同面积区间分析:")
         print("-" * 50)
         if api_data:
@@ -423,113 +762,58 @@ class SmartHomeVisualizer:
                 print()
         else:
             print("  暂无房屋面积数据")
-        
+
         print(f"统计面积区间数: {len(api_data)}")
         total_avg_devices = sum(area.avg_devices_count for area in api_data)
         total_avg_usage = sum(area.avg_usage_hours for area in api_data)
         print(f"所有区间平均设备数: {total_avg_devices / len(api_data):.2f}" if api_data else "0")
         print(f"所有区间平均使用时长: {total_avg_usage / len(api_data):.2f} 小时" if api_data else "0")
         print("="*60)
-        
+
         if not api_data:
             print("没有足够的数据生成房屋面积影响图表")
             return None
-        
+
         # 辅助数据查询（用于散点图）
-        scatter_query = self.db.query(
-            database.User.house_area,
-            func.count(database.Device.device_id).label('device_count'),
-            func.sum(database.UsageRecord.duration_minutes).label('total_usage_minutes')
-        ).outerjoin(
-            database.Device, database.User.user_id == database.Device.user_id
-        ).outerjoin(
-            database.UsageRecord, database.Device.device_id == database.UsageRecord.device_id
-        ).filter(
-            database.User.house_area.isnot(None)
-        ).group_by(database.User.user_id).all()
-        
-        # 数据处理
-        areas = [float(row.house_area) for row in scatter_query if row.house_area]
-        device_counts = [row.device_count or 0 for row in scatter_query]
-        usage_hours = [round(float(row.total_usage_minutes or 0) / 60, 2) for row in scatter_query]
-        
-        # 创建图表
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
-        fig.suptitle('房屋面积影响分析 (API数据源)', fontsize=16, fontweight='bold')
-        
-        # 1. 面积与设备数量散点图
-        if areas:
-            ax1.scatter(areas, device_counts, alpha=0.6, s=60, c='blue')
-            ax1.set_title('房屋面积 vs 设备数量', fontsize=14)
-            ax1.set_xlabel('房屋面积 (㎡)')
-            ax1.set_ylabel('设备数量')
-            ax1.grid(True, alpha=0.3)
-            
-            # 添加趋势线
-            if len(areas) > 1:
-                z = np.polyfit(areas, device_counts, 1)
-                p = np.poly1d(z)
-                ax1.plot(areas, p(areas), "r--", alpha=0.8)
-        
-        # 2. 面积与使用时长散点图
-        if areas:
-            ax2.scatter(areas, usage_hours, alpha=0.6, s=60, c='green')
-            ax2.set_title('房屋面积 vs 使用时长', fontsize=14)
-            ax2.set_xlabel('房屋面积 (㎡)')
-            ax2.set_ylabel('总使用时长 (小时)')
-            ax2.grid(True, alpha=0.3)
-            
-            # 添加趋势线
-            if len(areas) > 1:
-                z = np.polyfit(areas, usage_hours, 1)
-                p = np.poly1d(z)
-                ax2.plot(areas, p(areas), "r--", alpha=0.8)
-        
-        # 3. 不同面积区间的平均设备数量（基于API数据）
-        ranges = [area.area_range for area in api_data]
-        avg_devices = [area.avg_devices_count for area in api_data]
-        
-        ax3.bar(ranges, avg_devices, color='orange', alpha=0.7)
-        ax3.set_title('不同面积区间的平均设备数量', fontsize=14)
-        ax3.set_xlabel('面积区间')
-        ax3.set_ylabel('平均设备数量')
-        ax3.tick_params(axis='x', rotation=45)
-        
-        # 4. 不同面积区间的平均使用时长（基于API数据）
-        avg_usage = [area.avg_usage_hours for area in api_data]
-        
-        ax4.bar(ranges, avg_usage, color='purple', alpha=0.7)
-        ax4.set_title('不同面积区间的平均使用时长', fontsize=14)
-        ax4.set_xlabel('面积区间')
-        ax4.set_ylabel('平均使用时长 (小时)')
-        ax4.tick_params(axis='x', rotation=45)
-        
-        plt.tight_layout()
-        
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
+        if snapshot is not None:
+            scatter_query = snapshot.house_area_scatter()
         else:
-            plt.savefig(f'{self.output_dir}/house_area_impact.png', dpi=300, bbox_inches='tight')
-        
-        plt.close()
-        print(f"房屋面积影响图表已保存: {self.output_dir}/house_area_impact.png")
-        return f'{self.output_dir}/house_area_impact.png'
-    
-    def plot_energy_consumption_analysis(self, save_path: str = None):
-        """绘制能耗分析图表 - 基于API数据"""
+            scatter_query = self.db.query(
+                database.User.house_area,
+                func.count(database.Device.device_id).label('device_count'),
+                func.sum(database.UsageRecord.duration_minutes).label('total_usage_minutes')
+            ).outerjoin(
+                database.Device, database.User.user_id == database.Device.user_id
+            ).outerjoin(
+                database.UsageRecord, database.Device.device_id == database.UsageRecord.device_id
+            ).filter(
+                database.User.house_area.isnot(None)
+            ).group_by(database.User.user_id).all()
+
+        return {
+            'areas': [float(row.house_area) for row in scatter_query if row.house_area],
+            'device_counts': [row.device_count or 0 for row in scatter_query],
+            'usage_hours': [round(float(row.total_usage_minutes or 0) / 60, 2) for row in scatter_query],
+            'ranges': [area.area_range for area in api_data],
+            'avg_devices': [area.avg_devices_count for area in api_data],
+            'avg_usage': [area.avg_usage_hours for area in api_data],
+        }
+
+    def _fetch_energy_consumption_analysis(self, snapshot=None):
+        """查询能耗分析图表数据"""
         from analytics import SmartHomeAnalytics
-        
+
         print("开始获取能耗分析数据 (来自API)...")
-        
+
         # 使用API数据源
-        analytics = SmartHomeAnalytics(self.db)
+        analytics = SmartHomeAnalytics(self.db, snapshot=snapshot)
         api_data = analytics.generate_energy_consumption_report()
-        
+
         # 打印能耗分析数据
         print("\n" + "="*60)
         print("能耗分析数据详情 (API数据源)")
         print("="*60)
-        
+
         print("\n1. 按设备类型统计能耗 (来自API):")
         print("-" * 50)
         if api_data['energy_by_device_type']:
@@ -537,7 +821,7 @@ class SmartHomeVisualizer:
                 print(f"  {i}. {item['type_name']}: {item['total_energy']:.3f} 千瓦时")
         else:
             print("  暂无设备类型能耗数据")
-        
+
         print("\n2. 按用户统计能耗 (来自API):")
         print("-" * 50)
         if api_data['top_energy_users']:
@@ -545,20 +829,23 @@ class SmartHomeVisualizer:
                 print(f"  {i}. {item['username']}: {item['total_energy']:.3f} 千瓦时")
         else:
             print("  暂无用户能耗数据")
-        
+
         # 获取设备功耗效率数据（直接查询，因为API中没有）
-        efficiency_data = self.db.query(
-            database.Device.device_name,
-            database.DeviceType.type_name,
-            database.DeviceType.avg_power_consumption.label('rated_power'),
-            database.Device.actual_power_consumption.label('actual_power')
-        ).join(
-            database.DeviceType, database.Device.device_type_id == database.DeviceType.type_id
-        ).filter(
-            database.Device.actual_power_consumption.isnot(None),
-            database.DeviceType.avg_power_consumption.isnot(None)
-        ).limit(10).all()
-        
+        if snapshot is not None:
+            efficiency_data = snapshot.device_efficiency(limit=10)
+        else:
+            efficiency_data = self.db.query(
+                database.Device.device_name,
+                database.DeviceType.type_name,
+                database.DeviceType.avg_power_consumption.label('rated_power'),
+                database.Device.actual_power_consumption.label('actual_power')
+            ).join(
+                database.DeviceType, database.Device.device_type_id == database.DeviceType.type_id
+            ).filter(
+                database.Device.actual_power_consumption.isnot(None),
+                database.DeviceType.avg_power_consumption.isnot(None)
+            ).limit(10).all()
+
         print("\n3. 设备功耗效率对比 (补充数据):")
         print("-" * 50)
         if efficiency_data:
@@ -571,11 +858,11 @@ class SmartHomeVisualizer:
                 print(f"  {row.device_name} | {row.type_name} | {rated:.1f} | {actual:.1f} | {efficiency:.1f}%")
         else:
             print("  暂无功耗效率数据")
-        
+
         # 计算总体统计
         total_by_type = sum(item['total_energy'] for item in api_data['energy_by_device_type'])
         total_by_user = sum(item['total_energy'] for item in api_data['top_energy_users'])
-        
+
         print("\n4. 总体统计 (API数据):")
         print("-" * 50)
         print(f"  设备类型总能耗: {total_by_type:.3f} 千瓦时")
@@ -584,133 +871,92 @@ class SmartHomeVisualizer:
         print(f"  统计用户数: {len(api_data['top_energy_users'])}")
         print(f"  功耗效率统计设备数: {len(efficiency_data) if efficiency_data else 0}")
         print("="*60)
-        
+
         if not api_data['energy_by_device_type'] and not api_data['top_energy_users']:
             print("API返回数据不足，无法生成图表")
             return None
-        
-        # 创建子图
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
-        fig.suptitle('能耗分析报告 (API数据源)', fontsize=16, fontweight='bold')
-        
-        # 1. 设备类型能耗对比柱状图（基于API数据）
-        if api_data['energy_by_device_type']:
-            type_names = [item['type_name'] for item in api_data['energy_by_device_type']]
-            type_energies = [item['total_energy'] for item in api_data['energy_by_device_type']]
-            
-            bars = ax1.bar(range(len(type_names)), type_energies,
-                          color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD'])
-            ax1.set_title('设备类型能耗对比 (API数据)', fontsize=14)
-            ax1.set_xlabel('设备类型')
-            ax1.set_ylabel('总能耗 (千瓦时)')
-            ax1.set_xticks(range(len(type_names)))
-            ax1.set_xticklabels(type_names, rotation=45, ha='right')
-            
-            # 在柱子上显示数值
-            for bar, energy in zip(bars, type_energies):
-                ax1.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
-                        f'{energy:.2f}', ha='center', va='bottom')
-        
-        # 2. 设备类型能耗饼图（基于API数据）
-        if api_data['energy_by_device_type']:
-            ax2.pie(type_energies, labels=type_names, autopct='%1.1f%%', startangle=90,
-                    colors=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD'])
-            ax2.set_title('设备类型能耗占比 (API数据)', fontsize=14)
-        
-        # 3. 用户能耗排行榜（基于API数据）
-        if api_data['top_energy_users']:
-            usernames = [item['username'] for item in api_data['top_energy_users']]
-            user_energies = [item['total_energy'] for item in api_data['top_energy_users']]
-            
-            bars = ax3.barh(range(len(usernames)), user_energies, color='lightcoral')
-            ax3.set_title('用户能耗排行榜 (API数据)', fontsize=14)
-            ax3.set_xlabel('总能耗 (千瓦时)')
-            ax3.set_ylabel('用户')
-            ax3.set_yticks(range(len(usernames)))
-            ax3.set_yticklabels(usernames)
-            
-            # 在柱子上显示数值
-            for bar, energy in zip(bars, user_energies):
-                ax3.text(bar.get_width() + 0.1, bar.get_y() + bar.get_height()/2,
-                        f'{energy:.2f}', ha='left', va='center')
-        
-        # 4. 能耗效率分析（实际功耗 vs 额定功耗）
-        if efficiency_data:
-            device_names = [row.device_name for row in efficiency_data]
-            rated_powers = [float(row.rated_power or 0) for row in efficiency_data]
-            actual_powers = [float(row.actual_power or 0) for row in efficiency_data]
-            
-            x = np.arange(len(device_names))
-            width = 0.35
-            
-            ax4.bar(x - width/2, rated_powers, width, label='额定功耗', alpha=0.8, color='skyblue')
-            ax4.bar(x + width/2, actual_powers, width, label='实际功耗', alpha=0.8, color='orange')
-            
-            ax4.set_title('设备功耗效率对比', fontsize=14)
-            ax4.set_xlabel('设备')
-            ax4.set_ylabel('功耗 (瓦)')
-            ax4.set_xticks(x)
-            ax4.set_xticklabels([f'设备{i+1}' for i in range(len(device_names))], rotation=45)
-            ax4.legend()
-            ax4.grid(True, alpha=0.3)
-        else:
-            ax4.text(0.5, 0.5, '暂无功耗效率数据', ha='center', va='center',
-                    transform=ax4.transAxes, fontsize=14)
-        
-        plt.tight_layout()
-        
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        else:
-            plt.savefig(f'{self.output_dir}/energy_consumption_analysis.png', dpi=300, bbox_inches='tight')
-        
-        plt.close()
-        print(f"能耗分析图表已保存: {self.output_dir}/energy_consumption_analysis.png")
-        return f'{self.output_dir}/energy_consumption_analysis.png'
-    
-    def generate_all_visualizations(self):
-        """生成所有可视化图表 - 基于API数据源"""
-        results = {}
-        
+
+        return {
+            'energy_by_device_type': api_data['energy_by_device_type'],
+            'top_energy_users': api_data['top_energy_users'],
+            'efficiency': [
+                {
+                    'device_name': row.device_name,
+                    'rated_power': float(row.rated_power or 0),
+                    'actual_power': float(row.actual_power or 0)
+                }
+                for row in efficiency_data
+            ],
+        }
+
+    def generate_all_visualizations(self, parallel: bool = False, workers: int = None, snapshot=None):
+        """生成所有可视化图表 - 基于API数据源
+
+        parallel=True 时先在当前会话查询全部图表数据，再用进程池并行绘图（每张图表一个任务，
+        进程数默认取 CPU 核数，可用 workers 指定）。results['timings'] 记录每张图表计算指纹、查询和绘图的耗时（秒），
+        复用已有图表时只有指纹耗时。snapshot 为各图表共用的数据快照（默认取构造时传入的快照）。
+        """
+        results = {key: None for key, _, _ in CHARTS}
+        timings = {}
+        states = {}
+
         print("开始生成所有可视化图表 (基于API数据源)")
         print("="*60)
-        
-        try:
-            results['device_usage'] = self.plot_device_usage_analysis()
-            print("设备使用分析图表生成完成")
-        except Exception as e:
-            print(f"设备使用分析图表生成失败: {e}")
-            results['device_usage'] = None
-        
-        try:
-            results['user_activity'] = self.plot_user_activity_patterns()
-            print("用户活动模式图表生成完成")
-        except Exception as e:
-            print(f"用户活动模式图表生成失败: {e}")
-            results['user_activity'] = None
-        
-        try:
-            results['user_habits'] = self.plot_user_habits_analysis()
-            print("用户习惯分析图表生成完成")
-        except Exception as e:
-            print(f"用户习惯分析图表生成失败: {e}")
-            results['user_habits'] = None
-        
-        try:
-            results['house_area'] = self.plot_house_area_impact()
-            print("房屋面积影响图表生成完成")
-        except Exception as e:
-            print(f"房屋面积影响图表生成失败: {e}")
-            results['house_area'] = None
-        
-        try:
-            results['energy_consumption'] = self.plot_energy_consumption_analysis()
-            print("能耗分析图表生成完成")
-        except Exception as e:
-            print(f"能耗分析图表生成失败: {e}")
-            results['energy_consumption'] = None
-        
+
+        if parallel:
+            self._generate_parallel(results, timings, states, workers, snapshot)
+        else:
+            for key, name, label in CHARTS:
+                timings[key] = {}
+                try:
+                    results[key] = self._plot(name, label, timing=timings[key], states=states, snapshot=snapshot)
+                    print(f"{label}图表生成完成")
+                except Exception as e:
+                    print(f"{label}图表生成失败: {e}")
+
+        results['timings'] = timings
         print("="*60)
         print("所有图表生成完成!")
-        
-        return results
\ No newline at end of file
+
+        return results
+
+    def _generate_parallel(self, results: dict, timings: dict, states: dict, workers: int = None, snapshot=None):
+        """先查询全部数据，再在进程池中绘图"""
+        datasets = {}
+        for key, name, label in CHARTS:
+            timings[key] = {}
+            path = self._chart_path(name)
+            try:
+                reused, data, fingerprint = self._prepare(name, label, path, timings[key], states, snapshot)
+            except Exception as e:
+                print(f"{label}图表生成失败: {e}")
+                continue
+            if reused:
+                results[key] = path
+            if data is None:
+                print(f"{label}图表生成完成")
+            else:
+                datasets[key] = (name, label, data, fingerprint)
+
+        if not datasets:
+            return
+
+        max_workers = min(workers or os.cpu_count() or 1, len(datasets))
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_render_worker) as pool:
+            futures = {
+                pool.submit(_render_chart, name, data, self._chart_path(name)): key
+                for key, (name, label, data, fingerprint) in datasets.items()
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                label = datasets[key][1]
+                try:
+                    path, seconds = future.result()
+                except Exception as e:
+                    print(f"{label}图表生成失败: {e}")
+                    continue
+                timings[key]['render'] = round(seconds, 3)
+                _write_fingerprint(path, datasets[key][3])
+                results[key] = path
+                print(f"{label}图表已保存: {path}")
+                print(f"{label}图表生成完成")